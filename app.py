@@ -5,6 +5,7 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), 'src')))
 
 from agent import MathAgent
+from tracing import tracer
 from utils import get_logger
 import json
 from datetime import datetime
@@ -50,6 +51,20 @@ def load_agent():
 
 math_agent = load_agent()
 
+# --- Per-stage latency (only with tracing enabled: MATH_AGENT_TRACING=1) ---
+if tracer.enabled:
+    with st.sidebar:
+        st.subheader("Stage latency")
+        histograms = tracer.metrics.stage_histograms()
+        if not histograms:
+            st.caption("No traced queries yet.")
+        else:
+            st.dataframe(tracer.metrics.stage_summary(), hide_index=True)
+            stage = st.selectbox("Histogram", list(histograms))
+            histogram = histograms[stage]
+            labels = [f"<= {bound * 1000:g} ms" for bound in histogram["buckets"][:-1]] + [f"> {histogram['buckets'][-2] * 1000:g} ms"]
+            st.bar_chart({"queries": dict(zip(labels, histogram["counts"]))})
+
 # Initialize session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -79,15 +94,21 @@ if prompt := st.chat_input("Ask a math question..."):
         # Process query and display response
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
+            message_placeholder.markdown("Thinking...")
             full_response = ""
-            with st.spinner("Thinking..."):
-                try:
-                    logger.info(f"Calling agent.process_query for: {prompt}")
-                    full_response = math_agent.process_query(prompt)
-                    logger.info("Agent processing complete.")
-                except Exception as e:
-                    logger.error(f"Error during agent processing: {e}", exc_info=True)
-                    full_response = f"Sorry, an internal error occurred: {e}"
+            try:
+                logger.info(f"Calling agent.stream_query for: {prompt}")
+                stream = math_agent.stream_query(prompt)
+                # Render the partial answer as tokens arrive
+                for chunk in stream:
+                    full_response += chunk
+                    message_placeholder.markdown(full_response + "▌")
+                # The output guardrail may have replaced the streamed text
+                full_response = stream.final_response
+                logger.info("Agent processing complete.")
+            except Exception as e:
+                logger.error(f"Error during agent processing: {e}", exc_info=True)
+                full_response = f"Sorry, an internal error occurred: {e}"
 
             message_placeholder.markdown(full_response)
 
@@ -0,0 +1,330 @@
+"""
+End-to-end MathAgent latency and throughput, fully offline.
+
+Gemini, the embeddings, Tavily and the result pages are replaced by the fakes in fake_backends.py (configurable
+latency and error rates); everything else (guardrails, caches, KB/BM25 search, web fetching and extraction,
+routing) is the real agent code. Queries are replayed at a fixed concurrency through process_query (sync),
+aprocess_query (async), stream_query (stream) or process_batch (batch), and per-stage plus end-to-end
+p50/p95/p99 latency and throughput are reported.
+
+Query files are CSV (`question` column, else the first) or JSONL (`query`, `question` or `title` field).
+A share of the queries gets its numbers changed so it is not in the KB (web route) and a share is asked twice
+(answer cache). Caches start empty in a temporary directory.
+
+`--compare REV [REV]` runs the same benchmark in git worktrees of the given revisions (a single REV is compared
+with the current working tree) and prints the relative change of every metric.
+
+    python benchmarks/agent_latency.py --limit 200 --concurrency 8
+    python benchmarks/agent_latency.py --mode async --llm-ms 800 --llm-error-rate 0.02
+    python benchmarks/agent_latency.py --queries data/jee_math.csv requests.jsonl --compare HEAD~3
+"""
+import argparse
+import asyncio
+import contextvars
+import csv
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fake_backends import BackendProfile, StageRecorder, install, instrument_methods, normalize_text
+
+# Agent methods timed as stages, where the revision under test has them
+STAGE_METHODS = {"answer_cache": "_answer_from_cache", "answer_cache_exact": "_answer_from_exact_cache",
+                 "answer_cache_semantic": "_answer_from_semantic_cache", "input_guardrails": "_check_input",
+                 "kb_retrieval": "_retrieve_kb_context", "web": "_get_web_context"}
+PERCENTILES = (50, 95, 99)
+
+def read_queries(paths: list[str]) -> list[str]:
+    queries = []
+    for path in paths:
+        if path.endswith(".jsonl"):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        query = record.get("query") or record.get("question") or record.get("title")
+                        if query:
+                            queries.append(str(query))
+        else:
+            with open(path, encoding="utf-8", newline="") as f:
+                reader = csv.DictReader(f)
+                column = "question" if "question" in (reader.fieldnames or []) else (reader.fieldnames or [None])[0]
+                queries.extend(row[column] for row in reader if row.get(column))
+    return queries
+
+def build_workload(queries: list[str], limit: int, unknown_fraction: float, repeat_fraction: float, seed: int) -> list[str]:
+    """Samples `limit` queries, changes the numbers in some (so they miss the KB) and repeats some."""
+    rng = random.Random(seed)
+    sample = rng.sample(queries, min(limit, len(queries)))
+    workload = []
+    for query in sample:
+        if rng.random() < unknown_fraction:
+            query = re.sub(r"\d+", lambda m: str(int(m.group()) + rng.randint(1, 9)), query) + " (variant)"
+        workload.append(query)
+    repeats = [rng.choice(workload) for _ in range(int(len(workload) * repeat_fraction))]
+    for query in repeats:
+        workload.insert(rng.randint(len(workload) // 2, len(workload)), query)
+    return workload
+
+def load_kb_vectors(index_dir: str) -> dict:
+    """Maps each normalized KB question to its stored vector, so the fake embeddings can hit the KB."""
+    import faiss
+    import pickle
+
+    index = faiss.read_index(os.path.join(index_dir, "index.faiss"))
+    with open(os.path.join(index_dir, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    vectors = index.reconstruct_n(0, index.ntotal)
+    known = {}
+    for row, doc_id in index_to_docstore_id.items():
+        doc = docstore.search(doc_id)
+        question = doc.page_content.partition("\nAnswer:")[0].removeprefix("Question:")
+        known[normalize_text(question)] = vectors[row]
+    return known, index.d
+
+def summarize(values_ms: list[float]) -> dict:
+    if not values_ms:
+        return {}
+    summary = {f"p{p}_ms": round(float(np.percentile(values_ms, p)), 2) for p in PERCENTILES}
+    summary["mean_ms"] = round(float(np.mean(values_ms)), 2)
+    return summary
+
+def run_benchmark(args) -> dict:
+    os.chdir(args.project_root)
+    sys.path.insert(0, os.path.join(args.project_root, "src"))
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("TAVILY_API_KEY", "benchmark")
+    os.environ["NO_PROXY"] = os.environ["no_proxy"] = "127.0.0.1,localhost"
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    known_vectors, dim = load_kb_vectors(os.path.join(args.project_root, "faiss_index_jee_math"))
+    backends = install(llm=BackendProfile(args.llm_ms, args.jitter, args.llm_error_rate),
+                       embedding=BackendProfile(args.embed_ms, args.jitter, args.embed_error_rate),
+                       search=BackendProfile(args.search_ms, args.jitter, args.search_error_rate),
+                       pages=BackendProfile(args.page_ms, args.jitter, args.page_error_rate),
+                       seed=args.seed, answer_words=args.answer_words, page_kb=args.page_kb,
+                       embedding_dim=dim, known_distance=args.kb_distance)
+    backends.embeddings.known_vectors = known_vectors
+
+    # Fresh caches for every run; config is patched before the agent modules read it
+    import config
+    cache_dir = tempfile.mkdtemp(prefix="agent-benchmark-")
+    config.WEB_CACHE_PATH = os.path.join(cache_dir, "web_cache.sqlite3")
+    config.WEB_CACHE_ENABLED = not args.no_web_cache
+    config.ANSWER_CACHE_ENABLED = not args.no_answer_cache
+    config.ANSWER_CACHE_PATH = None
+
+    from agent import MathAgent
+
+    stages = instrument_methods(MathAgent, STAGE_METHODS)
+    queries = read_queries([os.path.join(PROJECT_ROOT, path) if not os.path.isabs(path) else path for path in args.queries])
+    workload = build_workload(queries, args.limit, args.unknown_fraction, args.repeat_fraction, args.seed)
+
+    with backends.page_server:
+        start = time.perf_counter()
+        agent = MathAgent()
+        init_s = time.perf_counter() - start
+        if args.warmup:
+            run_queries(agent, build_workload(queries, args.warmup, 0.0, 0.0, args.seed + 1), args)
+        backend_calls_before = backends.stats()
+
+        start = time.perf_counter()
+        results = run_queries(agent, workload, args)
+        wall_s = time.perf_counter() - start
+
+    latencies = [r["latency_ms"] for r in results]
+    stage_names = sorted({name for r in results for name in r["stages"]})
+    report = {
+        "label": args.label, "mode": args.mode, "concurrency": args.concurrency, "queries": len(workload),
+        "agent_init_s": round(init_s, 3), "wall_s": round(wall_s, 3),
+        "throughput_qps": round(len(workload) / wall_s, 2) if wall_s else None,
+        "end_to_end": summarize(latencies),
+        "stages": {name: summarize([r["stages"].get(name, 0.0) * 1000 for r in results]) for name in stage_names},
+        "agent_errors": sum(1 for r in results if r["error"]),
+        "backend_calls": {name: {key: value - backend_calls_before[name][key] for key, value in calls.items()}
+                          for name, calls in backends.stats().items()},
+        "instrumented_stages": stages,
+    }
+    if args.mode == "stream":
+        report["time_to_first_chunk"] = summarize([r["ttfc_ms"] for r in results if r.get("ttfc_ms") is not None])
+    if args.mode == "batch":
+        report["batch_stats"] = {key: round(value, 4) if isinstance(value, float) else value
+                                 for key, value in results[0]["batch_stats"].items()} if results else {}
+    return report
+
+def _timed_call(function, query: str) -> dict:
+    stages = StageRecorder.start()
+    result = {"stages": stages, "error": None}
+    start = time.perf_counter()
+    try:
+        function(query, result, start)
+    except Exception as e:
+        result["error"] = repr(e)
+    result["latency_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+def run_queries(agent, workload: list[str], args) -> list[dict]:
+    if args.mode == "async":
+        return asyncio.run(_run_async(agent, workload, args.concurrency))
+    if args.mode == "batch":
+        return _run_batches(agent, workload, args.batch_size, args.concurrency)
+
+    def sync_query(query, result, start):
+        agent.process_query(query)
+
+    def stream_query(query, result, start):
+        for _ in agent.stream_query(query):
+            result.setdefault("ttfc_ms", (time.perf_counter() - start) * 1000)
+
+    function = stream_query if args.mode == "stream" else sync_query
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        # Each query runs in its own context so stage timings are not mixed up between queries
+        return list(pool.map(lambda query: contextvars.copy_context().run(_timed_call, function, query), workload))
+
+async def _run_async(agent, workload: list[str], concurrency: int) -> list[dict]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(query: str) -> dict:
+        async with semaphore:
+            stages = StageRecorder.start() # Tasks run in their own context copy
+            result = {"stages": stages, "error": None}
+            start = time.perf_counter()
+            try:
+                await agent.aprocess_query(query)
+            except Exception as e:
+                result["error"] = repr(e)
+            result["latency_ms"] = (time.perf_counter() - start) * 1000
+            return result
+
+    return await asyncio.gather(*(one(query) for query in workload))
+
+def _run_batches(agent, workload: list[str], batch_size: int, concurrency: int) -> list[dict]:
+    """Batch mode: every query's latency is that of its process_batch call."""
+    results = []
+    batch_stats = {}
+    for offset in range(0, len(workload), batch_size):
+        batch = workload[offset:offset + batch_size]
+        stages = StageRecorder.start()
+        start = time.perf_counter()
+        error = None
+        try:
+            agent.process_batch(batch, max_concurrency=concurrency, stats=batch_stats)
+        except Exception as e:
+            error = repr(e)
+        latency_ms = (time.perf_counter() - start) * 1000
+        results.extend({"stages": stages, "error": error, "latency_ms": latency_ms, "batch_stats": batch_stats} for _ in batch)
+    return results
+
+# --- Revision comparison ---
+
+def _forwarded_args(argv: list[str]) -> list[str]:
+    """Command line minus --compare (and its values), --project-root and --json-out."""
+    forwarded, skip_values = [], False
+    for arg in argv:
+        if arg.startswith("--"):
+            skip_values = arg.split("=")[0] in ("--compare", "--project-root", "--json-out", "--label")
+            if skip_values:
+                continue
+        elif skip_values:
+            continue
+        forwarded.append(arg)
+    return forwarded
+
+def _run_revision(revision: str, workdir: str, forwarded: list[str]) -> dict:
+    if revision == "WORKTREE":
+        root = PROJECT_ROOT
+    else:
+        root = os.path.join(workdir, re.sub(r"[^\w.-]", "_", revision))
+        subprocess.run(["git", "-C", PROJECT_ROOT, "worktree", "add", "--detach", root, revision], check=True,
+                       stdout=subprocess.DEVNULL)
+    out_path = os.path.join(workdir, re.sub(r"[^\w.-]", "_", revision) + ".json")
+    try:
+        # This script (not the revision's copy) drives both runs, so the workload and fakes are identical
+        subprocess.run([sys.executable, os.path.abspath(__file__), *forwarded, "--project-root", root,
+                        "--json-out", out_path, "--label", revision], check=True, cwd=root)
+        with open(out_path, encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        if root != PROJECT_ROOT:
+            subprocess.run(["git", "-C", PROJECT_ROOT, "worktree", "remove", "--force", root], check=False)
+
+def _flatten(report: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+def compare(revisions: list[str], argv: list[str]):
+    if len(revisions) == 1:
+        revisions = [revisions[0], "WORKTREE"]
+    forwarded = _forwarded_args(argv)
+    with tempfile.TemporaryDirectory(prefix="agent-benchmark-compare-") as workdir:
+        base, head = (_run_revision(revision, workdir, forwarded) for revision in revisions)
+    base_flat, head_flat = _flatten(base), _flatten(head)
+    for key in base_flat:
+        if key in head_flat and (key.endswith("_ms") or key in ("throughput_qps", "wall_s", "agent_init_s")):
+            old, new = base_flat[key], head_flat[key]
+            change = round((new - old) / old * 100, 1) if old else None
+            print(json.dumps({"metric": key, revisions[0]: old, revisions[1]: new, "change_pct": change}))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["sync", "async", "stream", "batch"], default="sync")
+    parser.add_argument("--concurrency", type=int, default=8, help="Queries in flight (generation concurrency in batch mode)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--queries", nargs="+", default=["data/jee_math.csv"], help="CSV/JSONL query files")
+    parser.add_argument("--limit", type=int, default=200, help="Queries sampled from the query files")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured queries run first")
+    parser.add_argument("--unknown-fraction", type=float, default=0.2, help="Share of queries changed so they miss the KB")
+    parser.add_argument("--repeat-fraction", type=float, default=0.1, help="Share of queries asked a second time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-ms", type=float, default=400.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--embed-ms", type=float, default=60.0)
+    parser.add_argument("--embed-error-rate", type=float, default=0.0)
+    parser.add_argument("--search-ms", type=float, default=300.0)
+    parser.add_argument("--search-error-rate", type=float, default=0.0)
+    parser.add_argument("--page-ms", type=float, default=150.0)
+    parser.add_argument("--page-error-rate", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.25, help="Lognormal sigma of all backend latencies")
+    parser.add_argument("--answer-words", type=int, default=120, help="Length of generated answers")
+    parser.add_argument("--page-kb", type=int, default=40, help="Size of served result pages")
+    parser.add_argument("--kb-distance", type=float, default=0.5, help="L2 distance of KB questions from their stored vectors")
+    parser.add_argument("--no-answer-cache", action="store_true")
+    parser.add_argument("--no-web-cache", action="store_true")
+    parser.add_argument("--compare", nargs="+", metavar="REV", help="Git revisions to compare (one REV: against the working tree)")
+    parser.add_argument("--project-root", default=PROJECT_ROOT, help=argparse.SUPPRESS)
+    parser.add_argument("--label", default="WORKTREE", help=argparse.SUPPRESS)
+    parser.add_argument("--json-out", help="Also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the agent's logging")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare[:2], sys.argv[1:])
+        return
+
+    report = run_benchmark(args)
+    print(json.dumps(report))
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Recall / latency / memory of the ANN index types against the exact flat index, fully offline.
+
+Vectors are either synthetic (unit-norm Gaussian clusters, like normalized text embeddings) or the
+cached embeddings stored in the shipped FAISS index. Queries are noisy copies of corpus vectors, so
+some fall under SIMILARITY_THRESHOLD and some do not; "threshold_agreement" is the fraction of queries
+where the index makes the same KB-vs-web decision as the flat index.
+
+    python benchmarks/ann_recall.py --n 200000
+    python benchmarks/ann_recall.py --source kb
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from config import (SIMILARITY_THRESHOLD, VECTOR_STORE_PATH, HNSW_M, HNSW_EF_CONSTRUCTION, PQ_M, PQ_NBITS,
+                    PQ_REFINE_K_FACTOR)
+from ann_index import build_index, configure_search, index_memory_bytes, default_nlist
+
+def synthetic_vectors(n: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + rng.normal(scale=0.6, size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def kb_vectors() -> np.ndarray:
+    import faiss
+
+    index = faiss.read_index(os.path.join(PROJECT_ROOT, VECTOR_STORE_PATH, "index.faiss"))
+    return index.reconstruct_n(0, index.ntotal)
+
+def make_queries(vectors: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """Noisy copies of corpus vectors, with noise spread so top-1 distances straddle the threshold."""
+    rng = np.random.default_rng(seed)
+    base = vectors[rng.integers(0, len(vectors), count)]
+    scale = rng.uniform(0.0, 1.5, size=(count, 1)) / np.sqrt(vectors.shape[1])
+    return (base + rng.normal(size=base.shape) * scale).astype(np.float32)
+
+def measure(index, queries: np.ndarray, k: int, exact_rows: np.ndarray, exact_top1: np.ndarray) -> dict:
+    latencies = []
+    rows = np.empty((len(queries), k), dtype=np.int64)
+    top1 = np.empty(len(queries), dtype=np.float32)
+    for i, query in enumerate(queries):
+        # One query per call, like the interactive agent
+        start = time.perf_counter()
+        distances, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        rows[i], top1[i] = ids[0], distances[0][0]
+    recall = np.mean([len(set(r) & set(e)) / k for r, e in zip(rows, exact_rows)])
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        f"recall@{k}": round(float(recall), 4),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "max_top1_score_error": round(float(np.max(np.abs(top1 - exact_top1))), 5),
+        "threshold_agreement": round(float(np.mean((top1 < SIMILARITY_THRESHOLD) == (exact_top1 < SIMILARITY_THRESHOLD))), 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", choices=["synthetic", "kb"], default="synthetic")
+    parser.add_argument("--n", type=int, default=100000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[32, 128, 256])
+    args = parser.parse_args()
+
+    vectors = kb_vectors() if args.source == "kb" else synthetic_vectors(args.n, args.dim, args.clusters)
+    queries = make_queries(vectors, args.queries)
+    print(f"{len(vectors)} vectors (dim {vectors.shape[1]}), {len(queries)} queries, k={args.k}, "
+          f"threshold {SIMILARITY_THRESHOLD}, nlist {default_nlist(len(vectors))}")
+
+    configs = [("flat", {}, [{}]),
+               ("ivf_flat", {}, [{"nprobe": p} for p in args.nprobe]),
+               ("hnsw", {"hnsw_m": HNSW_M, "hnsw_ef_construction": HNSW_EF_CONSTRUCTION}, [{"ef_search": e} for e in args.ef_search]),
+               ("ivf_pq", {"pq_m": PQ_M, "pq_nbits": PQ_NBITS}, [{"nprobe": p} for p in args.nprobe]),
+               ("ivf_pq", {"pq_m": PQ_M, "pq_nbits": PQ_NBITS, "refine_k_factor": PQ_REFINE_K_FACTOR}, [{"nprobe": p} for p in args.nprobe])]
+
+    exact_rows = exact_top1 = None
+    for index_type, build_params, search_params in configs:
+        start = time.perf_counter()
+        try:
+            index = build_index(vectors, index_type, **build_params)
+        except ValueError as e:
+            print(json.dumps({"index": index_type, "skipped": str(e)}))
+            continue
+        build_s = time.perf_counter() - start
+        if exact_rows is None:
+            exact_distances, exact_rows = index.search(queries, args.k)
+            exact_top1 = exact_distances[:, 0]
+        name = index_type + ("+refine" if build_params.get("refine_k_factor") else "")
+        for params in search_params:
+            configure_search(index, **params)
+            result = {"index": name, **params, "build_s": round(build_s, 2), "memory_mb": round(index_memory_bytes(index) / 1e6, 1)}
+            result.update(measure(index, queries, args.k, exact_rows, exact_top1))
+            print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+Deterministic stand-ins for the remote services MathAgent talks to, so it can be benchmarked offline:
+a chat model (Gemini), query embeddings, the Tavily search tool and a local HTTP server for result pages.
+Each one sleeps for a configurable latency (lognormal around a median) and fails at a configurable rate.
+
+`install()` patches them into langchain_google_genai / langchain_community before `guardrails`, `vector_store`
+and `agent` are imported, so the agent code runs unmodified (at any git revision).
+Time spent in each backend is recorded per query with `StageRecorder`.
+"""
+import contextvars
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+STREAM_FIRST_CHUNK_SHARE = 0.3 # Share of a streamed completion's latency spent before the first chunk
+
+class FakeBackendError(RuntimeError):
+    """Injected failure of a fake backend, with the HTTP status a real provider would return (429 or 503)."""
+
+    def __init__(self, message: str, status_code: int = 503):
+        super().__init__(f"{status_code} {message}")
+        self.status_code = status_code
+
+@dataclass
+class BackendProfile:
+    latency_ms: float = 0.0 # Median latency per call
+    jitter: float = 0.25 # Lognormal sigma around the median (0 = constant latency)
+    error_rate: float = 0.0 # Share of calls failing with 503
+    quota_per_second: float = 0.0 # Provider-side rate limit: calls beyond it within a second fail with 429 (0 = none)
+    tail_rate: float = 0.0 # Share of calls that are `tail_factor` times slower than sampled
+    tail_factor: float = 10.0
+    outages: tuple = () # (start, end) windows, in seconds after the first call, in which every call fails with 503
+
+class _Behaviour:
+    """Seeded latency sampling and error injection shared by all calls to one backend."""
+
+    def __init__(self, name: str, profile: BackendProfile, seed: int):
+        self.name = name
+        self.profile = profile
+        self._rng = random.Random(f"{seed}:{name}")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.prompt_tokens = 0 # Answer generation prompts only, estimated at ~4 characters per token
+        self._started = None
+        self._window = (0, 0) # (second, calls in that second) for the quota
+
+    def sample(self) -> tuple[float, int]:
+        """Returns (latency in seconds, HTTP status of the injected failure or 0 if the call succeeds)."""
+        with self._lock:
+            now = time.monotonic()
+            if self._started is None:
+                self._started = now
+            self.calls += 1
+            latency = self.profile.latency_ms / 1000
+            if self.profile.jitter and latency:
+                latency *= math.exp(self._rng.gauss(0.0, self.profile.jitter))
+            if self.profile.tail_rate and self._rng.random() < self.profile.tail_rate:
+                latency *= self.profile.tail_factor
+            failed = 503 if self._rng.random() < self.profile.error_rate else 0
+            elapsed = now - self._started
+            if any(start <= elapsed < end for start, end in self.profile.outages):
+                failed = 503
+            if self.profile.quota_per_second:
+                second, calls = self._window
+                calls = calls + 1 if int(now) == second else 1
+                self._window = (int(now), calls)
+                if calls > self.profile.quota_per_second:
+                    failed = 429
+                    self.throttled += 1
+            self.errors += bool(failed)
+        return latency, failed
+
+    def call(self, stage: str = None):
+        """Sleeps for one sampled latency (recorded under `stage`) and raises if the call was picked to fail."""
+        latency, failed = self.sample()
+        with StageRecorder.measure(stage or self.name):
+            time.sleep(latency if failed != 429 else 0.0) # Quota rejections come back immediately
+        if failed:
+            raise FakeBackendError(f"Injected {self.name} failure", status_code=failed)
+
+    def record_prompt(self, prompt: str):
+        with self._lock:
+            self.prompt_tokens += len(prompt) // 4
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "errors": self.errors, "throttled": self.throttled, "prompt_tokens": self.prompt_tokens}
+
+class StageRecorder:
+    """
+    Collects (stage, seconds) pairs for the query running in the current context.
+    Context is copied into asyncio.to_thread workers, so async branches are attributed too;
+    work handed to plain thread pools inside the agent is not.
+    """
+    _current: contextvars.ContextVar = contextvars.ContextVar("benchmark_stages", default=None)
+
+    @classmethod
+    def start(cls) -> dict:
+        stages: dict[str, float] = {}
+        cls._current.set(stages)
+        return stages
+
+    @classmethod
+    def add(cls, stage: str, seconds: float):
+        stages = cls._current.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    @classmethod
+    @contextmanager
+    def measure(cls, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.add(stage, time.perf_counter() - start)
+
+def instrument_methods(cls, stage_methods: dict[str, str]) -> list[str]:
+    """Wraps the named methods of `cls` (where they exist) to record their duration. Returns the stages wrapped."""
+    wrapped = []
+    for stage, method_name in stage_methods.items():
+        method = getattr(cls, method_name, None)
+        if method is None:
+            continue
+
+        def timed(self, *args, _method=method, _stage=stage, **kwargs):
+            with StageRecorder.measure(_stage):
+                return _method(self, *args, **kwargs)
+
+        setattr(cls, method_name, timed)
+        wrapped.append(stage)
+    return wrapped
+
+# --- Chat model ---
+
+_TOPIC_CHECK = re.compile(r"Answer only with 'yes' or 'no'")
+_BATCH_TOPIC_CHECK = re.compile(r"'<number>: yes' or '<number>: no'")
+_NUMBERED_QUERY = re.compile(r"^(\d+)\. '", re.MULTILINE)
+
+def _prompt_text(messages: list[BaseMessage]) -> str:
+    return "\n".join(str(message.content) for message in messages)
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model with canned replies: "yes" to topic checks (one line per query for batched checks)
+    and a fixed step-by-step solution of `answer_words` words to everything else.
+    """
+    behaviour: Any
+    answer_words: int = 120
+    stream_chunks: int = 12
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark-chat"
+
+    def _reply(self, prompt: str) -> tuple[str, str]:
+        """Returns (stage, reply text)."""
+        if _BATCH_TOPIC_CHECK.search(prompt):
+            return "llm_guardrail", "\n".join(f"{n}: yes" for n in _NUMBERED_QUERY.findall(prompt))
+        if _TOPIC_CHECK.search(prompt):
+            return "llm_guardrail", "yes"
+        words = [f"step{i // 12 + 1}" if i % 12 == 0 else "term" for i in range(self.answer_words)]
+        return "llm_generation", " ".join(words) + "\nFinal answer: 42"
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        prompt = _prompt_text(messages)
+        stage, text = self._reply(prompt)
+        if stage == "llm_generation":
+            self.behaviour.record_prompt(prompt)
+        self.behaviour.call(stage)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        prompt = _prompt_text(messages)
+        stage, text = self._reply(prompt)
+        if stage == "llm_generation":
+            self.behaviour.record_prompt(prompt)
+        latency, failed = self.behaviour.sample()
+        with StageRecorder.measure(stage):
+            time.sleep(latency * STREAM_FIRST_CHUNK_SHARE)
+        if failed:
+            raise FakeBackendError("Injected llm failure", status_code=failed)
+        words = text.split(" ")
+        size = max(1, math.ceil(len(words) / self.stream_chunks))
+        chunks = [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+        for i, chunk in enumerate(chunks):
+            if i:
+                with StageRecorder.measure(stage):
+                    time.sleep(latency * (1 - STREAM_FIRST_CHUNK_SHARE) / max(1, len(chunks) - 1))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+
+# --- Embeddings ---
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+class FakeEmbeddings(Embeddings):
+    """
+    Query embeddings for an existing index: a text registered with `known_vectors` (e.g. a KB question) embeds
+    to its stored vector plus noise of L2 norm `known_distance`, so the KB search finds it at that distance;
+    any other text embeds to a pseudo-random unit vector derived from its hash (far from every KB vector).
+    """
+
+    def __init__(self, behaviour: _Behaviour, dim: int = 768, known_vectors: dict[str, np.ndarray] = None,
+                 known_distance: float = 0.5):
+        self.behaviour = behaviour
+        self.dim = dim
+        self.known_vectors = known_vectors or {}
+        self.known_distance = known_distance
+
+    def _vector(self, text: str) -> list[float]:
+        key = normalize_text(text)
+        rng = np.random.default_rng(int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little"))
+        noise = rng.normal(size=self.dim).astype(np.float32)
+        noise /= np.linalg.norm(noise)
+        known = self.known_vectors.get(key)
+        if known is None:
+            return noise.tolist()
+        return (known + noise * self.known_distance).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        self.behaviour.call("embedding")
+        return self._vector(text)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.behaviour.call("embedding")
+        return [self._vector(text) for text in texts]
+
+# --- Web search and pages ---
+
+class FakeSearchTool:
+    """Tavily stand-in: returns `results` hits per query, pointing at pages on the local page server."""
+
+    def __init__(self, behaviour: _Behaviour, base_url: str, results: int = 3):
+        self.behaviour = behaviour
+        self.base_url = base_url
+        self.results = results
+
+    def invoke(self, query: str) -> list[dict]:
+        try:
+            self.behaviour.call("web_search")
+        except FakeBackendError as e:
+            return repr(e) # Like TavilySearchResults, which returns the error instead of raising
+        digest = hashlib.blake2b(normalize_text(query).encode(), digest_size=6).hexdigest()
+        return [{"url": f"{self.base_url}/page/{digest}-{i}", "content": f"Snippet {i} about {query}"}
+                for i in range(self.results)]
+
+PAGE_SENTENCES = [
+    "The derivative of a polynomial is found term by term.",
+    "Each power x^n contributes n x^(n-1) to the derivative.",
+    "Integration reverses differentiation up to an additive constant.",
+    "A definite integral is the signed area under the curve between the limits.",
+    "The chain rule differentiates a composition as the product of the derivatives.",
+    "Setting the first derivative to zero locates the stationary points.",
+    "The second derivative tells maxima from minima.",
+    "Lagrange multipliers turn a constrained problem into solving a system of equations.",
+    "The sum of an arithmetic series is n times the mean of the first and last terms.",
+    "The probability of independent events occurring together is the product of their probabilities.",
+    "A quadratic has real roots exactly when its discriminant b^2 - 4ac is non-negative.",
+    "The area of a triangle is half the base times the height.",
+]
+PAGE_VARIANTS = 8
+
+class PageServer:
+    """
+    Local HTTP server returning generated article pages of `page_kb` KB after a sampled latency (or a 503).
+    Each URL gets one of PAGE_VARIANTS pages whose paragraphs mix sentences from PAGE_SENTENCES.
+    """
+
+    def __init__(self, behaviour: _Behaviour, page_kb: int = 40):
+        self.behaviour = behaviour
+        rng = random.Random(0)
+        self.pages = []
+        for _ in range(PAGE_VARIANTS):
+            paragraphs, size = [], 0
+            while size < page_kb * 1024:
+                paragraphs.append("<p>" + " ".join(rng.choice(PAGE_SENTENCES) for _ in range(8)) + "</p>\n")
+                size += len(paragraphs[-1])
+            self.pages.append((f"<html><head><title>Worked example</title><script>var x = 1;</script></head><body>"
+                               f"<nav>Home | Topics | About</nav><main><h1>Worked example</h1>{''.join(paragraphs)}</main>"
+                               f"<footer>Copyright</footer></body></html>").encode())
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                latency, failed = server.behaviour.sample()
+                time.sleep(latency)
+                status, payload = (failed, b"unavailable") if failed else (200, server.page_for(self.path))
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.handle_error = lambda request, client_address: None # Bounded page reads reset connections
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-page-server", daemon=True)
+
+    def page_for(self, path: str) -> bytes:
+        return self.pages[int(hashlib.md5(path.encode()).hexdigest(), 16) % len(self.pages)]
+
+    def __enter__(self) -> "PageServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# --- Installation ---
+
+@dataclass
+class FakeBackends:
+    llm: _Behaviour
+    embedding: _Behaviour
+    search: _Behaviour
+    pages: _Behaviour
+    page_server: PageServer
+    embeddings: FakeEmbeddings = None
+
+    def stats(self) -> dict:
+        return {name: getattr(self, name).stats() for name in ("llm", "embedding", "search", "pages")}
+
+def install(llm: BackendProfile, embedding: BackendProfile, search: BackendProfile, pages: BackendProfile,
+            seed: int = 0, answer_words: int = 120, page_kb: int = 40, embedding_dim: int = 768,
+            known_distance: float = 0.5) -> FakeBackends:
+    """
+    Patches the fakes into the LangChain integrations the agent imports from. Must run before `guardrails`,
+    `vector_store` and `agent` are imported. The returned page server still has to be started (`with`).
+    """
+    import langchain_google_genai
+    import langchain_community.tools.tavily_search as tavily_search
+
+    backends = FakeBackends(llm=_Behaviour("llm", llm, seed), embedding=_Behaviour("embedding", embedding, seed),
+                            search=_Behaviour("search", search, seed), pages=_Behaviour("pages", pages, seed),
+                            page_server=None)
+    backends.page_server = PageServer(backends.pages, page_kb=page_kb)
+    backends.embeddings = FakeEmbeddings(backends.embedding, dim=embedding_dim, known_distance=known_distance)
+
+    langchain_google_genai.ChatGoogleGenerativeAI = lambda **kwargs: FakeChatModel(behaviour=backends.llm, answer_words=answer_words)
+    langchain_google_genai.GoogleGenerativeAIEmbeddings = lambda **kwargs: backends.embeddings
+    tavily_search.TavilySearchResults = lambda **kwargs: FakeSearchTool(backends.search, backends.page_server.base_url,
+                                                                         kwargs.get("max_results", 3))
+    return backends
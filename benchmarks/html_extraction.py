@@ -0,0 +1,192 @@
+"""
+CPU time and peak memory of fetching and extracting one web fallback page, before and after bounded extraction.
+
+Pages are served from a local HTTP server out of a fixture directory: saved pages (`curl -o page.html <url>`,
+or "Save page as... > HTML only") with their content type taken from the file extension. Without `--fixtures`
+a synthetic corpus is generated (`--generate DIR` keeps it): a reference article behind a heavy navigation
+and inline scripts, a Q&A thread without <main>, a script-heavy single-page app, a 5 MB table, a Latin-1 page
+without a charset header and a PDF.
+
+    before  session.get() downloads the whole body, BeautifulSoup(html.parser) builds the full tree,
+            <main>/<article>/<body> text, then text[:max_chars]
+    after   what WebFetcher._fetch_one does: streamed body with a byte cap, content-type check, TextExtractor with
+            boilerplate stripping and an early stop, then text[:max_chars]
+
+Per page and variant it reports the median thread CPU time over `--repeats` runs, the tracemalloc peak
+(a separate run), bytes read and the extracted characters.
+
+    python benchmarks/html_extraction.py
+    python benchmarks/html_extraction.py --fixtures saved_pages/ --repeats 10
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from functools import partial
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from web_fetcher import create_http_session, read_page_text
+
+MATH_SENTENCES = [
+    "The derivative of x^{n} is n x^{n-1}, which follows from the binomial theorem.",
+    "By the fundamental theorem of calculus, the integral of f' over [a, b] equals f(b) - f(a).",
+    "A quadratic equation ax^2 + bx + c = 0 has two real roots when b^2 - 4ac > 0.",
+    "The probability of two independent events is the product of their probabilities.",
+    "The area of a circle of radius r is pi r^2 and its circumference is 2 pi r.",
+    "Summing the geometric series 1 + q + q^2 + ... gives 1 / (1 - q) for |q| < 1.",
+]
+FILLER = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore."
+
+def _paragraphs(rng: random.Random, count: int) -> str:
+    return "\n".join(f"<p>{' '.join(rng.choice(MATH_SENTENCES) for _ in range(4))}</p>" for _ in range(count))
+
+def _nav(count: int) -> str:
+    links = "".join(f'<li><a href="/wiki/Topic_{i}">Topic {i}</a></li>' for i in range(count))
+    return f'<nav id="site-navigation"><ul>{links}</ul></nav>'
+
+def _script(kb: int) -> str:
+    return "<script>window.__STATE__ = " + json.dumps({"items": ["x" * 90] * (kb * 10)}) + ";</script>"
+
+def generate_fixtures(directory: str, seed: int = 0):
+    """Writes the synthetic fixture corpus into `directory`."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    styles = "body{margin:0}" * 2000
+    head = lambda title, scripts: f'<head><meta charset="utf-8"><title>{title}</title><style>{styles}</style>{scripts}</head>'
+    pages = {
+        "reference_article.html": (
+            f"<!DOCTYPE html><html>{head('Quadratic equation', _script(200))}<body>"
+            f"<header class='site-header'>Encyclopedia</header>{_nav(1500)}"
+            f"<div class='sidebar'>{_paragraphs(rng, 40)}</div>"
+            f"<main><h1>Quadratic equation</h1>{_paragraphs(rng, 400)}</main>"
+            f"<footer>{'<a href=#>link</a>' * 500}</footer></body></html>"),
+        "qa_thread.html": (
+            f"<html>{head('How do I integrate by parts?', '')}<body>{_nav(200)}"
+            f"<div class='question'><p>{FILLER}</p>{_paragraphs(rng, 5)}</div>"
+            + "".join(f"<div class='answer'><p>{FILLER}</p>{_paragraphs(rng, 20)}<div class='comments'>"
+                      f"{'<span>Thanks, this helped!</span>' * 30}</div></div>" for _ in range(30))
+            + "</body></html>"),
+        "spa_shell.html": (
+            f"<html>{head('Calculator', _script(1500))}<body><div id='root'></div>"
+            f"<article><p>{MATH_SENTENCES[0]}</p></article></body></html>"),
+        "large_table.html": (
+            f"<html>{head('Table of integrals', '')}<body><main><h1>Table of integrals</h1><table>"
+            + "".join(f"<tr><td>{i}</td><td>x^{i}</td><td>x^{i + 1}/{i + 1}</td><td>{FILLER}</td></tr>"
+                      for i in range(40000))
+            + "</table></main></body></html>"),
+    }
+    for name, html in pages.items():
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write(html)
+    # Latin-1 text only declared in a <meta> tag (".htm" is served without a charset)
+    with open(os.path.join(directory, "latin1_notes.htm"), "wb") as f:
+        f.write(f"<html><head><meta http-equiv='Content-Type' content='text/html; charset=iso-8859-1'></head><body>"
+                f"<article><h1>Géométrie</h1>{_paragraphs(rng, 150)}<p>Théorème de Pythagore: a² + b² = c²</p>"
+                f"</article></body></html>".encode("latin-1"))
+    with open(os.path.join(directory, "lecture_notes.pdf"), "wb") as f:
+        f.write(b"%PDF-1.4\n" + os.urandom(2 * 1024 * 1024))
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    extensions_map = {".html": "text/html; charset=utf-8", ".htm": "text/html", ".pdf": "application/pdf",
+                      "": "application/octet-stream"}
+
+    def log_message(self, *args):
+        pass
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass # The bounded reader closes connections early; the resets are expected
+
+def fetch_before(session, url: str, max_chars: int) -> tuple[str, int]:
+    from bs4 import BeautifulSoup
+    response = session.get(url, timeout=30)
+    response.raise_for_status()
+    soup = BeautifulSoup(response.text, 'html.parser')
+    main_content = soup.find('main') or soup.find('article') or soup.body
+    text = main_content.get_text(separator='\n', strip=True) if main_content else soup.get_text(separator='\n', strip=True)
+    return text[:max_chars], len(response.content)
+
+def fetch_after(session, url: str, max_chars: int, max_bytes: int) -> tuple[str, int]:
+    # WebFetcher._fetch_one without the page cache, so bytes read can be reported
+    with session.get(url, timeout=30, stream=True) as response:
+        response.raise_for_status()
+        text, received = read_page_text(response, target_chars=max_chars, max_bytes=max_bytes)
+    return text[:max_chars], received
+
+def measure(fetch, url: str, repeats: int) -> dict:
+    cpu = []
+    for _ in range(repeats):
+        start = time.thread_time()
+        try:
+            text, received = fetch(url)
+            error = None
+        except Exception as e:
+            text, received, error = "", None, type(e).__name__
+        cpu.append(time.thread_time() - start)
+    tracemalloc.start()
+    try:
+        fetch(url)
+    except Exception:
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"cpu_ms": round(statistics.median(cpu) * 1000, 2), "peak_kb": round(peak / 1024, 1),
+            "bytes_read": received, "chars": len(text), "error": error}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", help="Directory of saved pages (default: a generated corpus)")
+    parser.add_argument("--generate", help="Write the generated corpus to this directory and keep it")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--max-chars", type=int, default=1500)
+    parser.add_argument("--max-bytes", type=int, default=512 * 1024)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    os.environ["NO_PROXY"] = os.environ["no_proxy"] = "127.0.0.1,localhost"
+
+    directory = args.fixtures
+    if not directory:
+        directory = args.generate or tempfile.mkdtemp(prefix="html-fixtures-")
+        generate_fixtures(directory, args.seed)
+
+    httpd = FixtureServer(("127.0.0.1", 0), partial(FixtureHandler, directory=directory))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    session = create_http_session()
+    variants = {"before": lambda url: fetch_before(session, url, args.max_chars),
+                "after": lambda url: fetch_after(session, url, args.max_chars, args.max_bytes)}
+    totals = {variant: {"cpu_ms": 0.0, "peak_kb": 0.0} for variant in variants}
+    try:
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path):
+                continue
+            report = {"page": name, "size_kb": round(os.path.getsize(path) / 1024, 1)}
+            for variant, fetch in variants.items():
+                report[variant] = measure(fetch, f"{base_url}/{name}", args.repeats)
+                for key in totals[variant]:
+                    totals[variant][key] += report[variant][key]
+            print(json.dumps(report))
+    finally:
+        httpd.shutdown()
+    print(json.dumps({"total": {variant: {key: round(value, 1) for key, value in total.items()}
+                                for variant, total in totals.items()}}))
+
+if __name__ == "__main__":
+    main()
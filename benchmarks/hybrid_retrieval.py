@@ -0,0 +1,144 @@
+"""
+Hit rate and latency of lexical-only (BM25), vector-only and hybrid (RRF + decisive lexical bypass) KB retrieval.
+
+Queries are generated from the KB questions in three variants:
+  exact    - the question as stored
+  noisy    - different casing/spacing with ~20% of the non-numeric words dropped
+  keywords - only the numbers, symbols and the three rarest words
+
+Embeddings default to a local hashed character n-gram model so the benchmark runs offline; with
+`--embeddings gemini` (needs GOOGLE_API_KEY) the shipped index vectors and the real query embeddings are used.
+`--simulated-embed-ms` adds a fixed delay per embedding call to model a remote embedding API in local mode.
+
+    python benchmarks/hybrid_retrieval.py
+    python benchmarks/hybrid_retrieval.py --embeddings gemini --limit 200
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from config import (CSV_PATH, VECTOR_STORE_PATH, HYBRID_CANDIDATES, RRF_K, BM25_DECISIVE_QUERY_COVERAGE,
+                    BM25_DECISIVE_DOC_COVERAGE, BM25_DECISIVE_MARGIN)
+from bm25_index import BM25Index, tokenize, reciprocal_rank_fusion
+from topic_classifier import TopicClassifier
+from vector_store import iter_csv_documents
+
+class LocalEmbeddings:
+    """Offline stand-in for the embedding model: hashed character n-grams, L2 normalized."""
+
+    def __init__(self, dim: int = 768, delay_s: float = 0.0):
+        self.featurizer = TopicClassifier(n_features=dim)
+        self.dim = dim
+        self.delay_s = delay_s
+
+    def embed(self, text: str) -> np.ndarray:
+        if self.delay_s:
+            time.sleep(self.delay_s)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for bucket, value in self.featurizer._features(text).items():
+            vector[bucket] = value
+        return vector
+
+def load_corpus(embeddings_mode: str, dim: int, delay_s: float):
+    """Returns (contents, questions, document vectors, query embedding function)."""
+    if embeddings_mode == "gemini":
+        from langchain_community.vectorstores import FAISS
+        from vector_store import _create_embeddings
+
+        embeddings = _create_embeddings()
+        store = FAISS.load_local(os.path.join(PROJECT_ROOT, VECTOR_STORE_PATH), embeddings, allow_dangerous_deserialization=True)
+        docs = [store.docstore.search(store.index_to_docstore_id[i]) for i in range(store.index.ntotal)]
+        vectors = store.index.reconstruct_n(0, store.index.ntotal)
+        return ([doc.page_content for doc in docs], [doc.metadata["question"] for doc in docs], vectors,
+                lambda text: np.asarray(embeddings.embed_query(text), dtype=np.float32))
+
+    local = LocalEmbeddings(dim)
+    docs = [doc for chunk in iter_csv_documents(os.path.join(PROJECT_ROOT, CSV_PATH)) for doc in chunk]
+    vectors = np.stack([local.embed(doc.page_content) for doc in docs])
+    local.delay_s = delay_s
+    return [doc.page_content for doc in docs], [doc.metadata["question"] for doc in docs], vectors, local.embed
+
+def make_variants(question: str, bm25: BM25Index, rng: random.Random) -> dict[str, str]:
+    tokens = question.split()
+    noisy = [t for t in tokens if re.search(r"\d", t) or rng.random() > 0.2]
+    noisy_text = re.sub(r"\s+([?.,%])", r"\1", " ".join(noisy))
+    noisy_text = noisy_text.upper() if rng.random() < 0.5 else noisy_text.capitalize()
+
+    terms = tokenize(question)
+    words = sorted({t for t in terms if t.isalpha() and t in bm25.term_index},
+                   key=lambda t: -float(bm25.idf[bm25.term_index[t]]))[:3]
+    keywords = " ".join(t for t in terms if not t.isalpha() or t in words)
+    return {"exact": question, "noisy": noisy_text, "keywords": keywords}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", choices=["local", "gemini"], default="local")
+    parser.add_argument("--dim", type=int, default=768, help="Local embedding dimension")
+    parser.add_argument("--simulated-embed-ms", type=float, default=0.0)
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N KB questions as queries")
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    contents, questions, vectors, embed = load_corpus(args.embeddings, args.dim, args.simulated_embed_ms / 1000)
+    norms = np.sum(vectors * vectors, axis=1)
+    bm25 = BM25Index.build((str(i), question) for i, question in enumerate(questions))
+    rng = random.Random(0)
+
+    def vector_search(query: str, k: int) -> list[int]:
+        query_vector = embed(query)
+        distances = norms - 2.0 * vectors @ query_vector
+        return np.argsort(distances)[:k].tolist()
+
+    def lexical(query: str) -> list[int]:
+        return [i for i, _ in bm25.search(query, k=args.k)]
+
+    def vector(query: str) -> list[int]:
+        return vector_search(query, args.k)
+
+    def hybrid(query: str) -> list[int]:
+        hits = bm25.search(query, k=HYBRID_CANDIDATES)
+        if bm25.is_decisive(query, hits, BM25_DECISIVE_QUERY_COVERAGE, BM25_DECISIVE_DOC_COVERAGE, BM25_DECISIVE_MARGIN):
+            hybrid.decisive += 1
+            return [i for i, _ in hits[:args.k]]
+        hybrid.embedding_calls += 1
+        fused = reciprocal_rank_fusion([vector_search(query, HYBRID_CANDIDATES), [i for i, _ in hits]], RRF_K)
+        return fused[:args.k]
+
+    limit = args.limit or len(questions)
+    queries = [(i, variant, text) for i, question in enumerate(questions[:limit])
+               for variant, text in make_variants(question, bm25, rng).items()]
+    print(f"{len(contents)} KB documents, {len(queries)} queries ({args.embeddings} embeddings), k={args.k}")
+
+    for name, retrieve in (("lexical", lexical), ("vector", vector), ("hybrid", hybrid)):
+        hybrid.decisive = hybrid.embedding_calls = 0
+        by_variant: dict[str, list] = {}
+        latencies = []
+        for target, variant, text in queries:
+            start = time.perf_counter()
+            ranked = retrieve(text)
+            latencies.append((time.perf_counter() - start) * 1000)
+            # Hits are judged by content, so duplicate KB rows count as the same answer
+            ranked_contents = [contents[i] for i in ranked]
+            by_variant.setdefault(variant, []).append((ranked_contents[:1] == [contents[target]], contents[target] in ranked_contents))
+        result = {"method": name}
+        for variant, hits in by_variant.items():
+            result[f"{variant}_hit@1"] = round(float(np.mean([h1 for h1, _ in hits])), 3)
+            result[f"{variant}_hit@{args.k}"] = round(float(np.mean([hk for _, hk in hits])), 3)
+        result.update({"p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                       "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+                       "embedding_calls": {"lexical": 0, "vector": len(queries), "hybrid": hybrid.embedding_calls}[name]})
+        if name == "hybrid":
+            result["decisive"] = hybrid.decisive
+        print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
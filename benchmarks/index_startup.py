@@ -0,0 +1,128 @@
+"""
+Compares knowledge base startup cost: FAISS.load_local (index.faiss + pickled docstore) vs the mmap format.
+
+Each format is loaded in a fresh subprocess, which reports load time and memory (from /proc/self/status)
+after loading and after a first search. Embeddings are faked, so no API key is needed.
+
+    python benchmarks/index_startup.py                    # the shipped index (converted to a temp dir)
+    python benchmarks/index_startup.py --synthetic 200000 # a synthetic index of N random documents
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+def memory_kb() -> dict:
+    """Resident memory split into anonymous (private heap) and file-backed (shareable page cache) pages."""
+    stats = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                stats[key] = int(value.split()[0])
+    return stats
+
+def fake_embeddings(dim: int):
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    return DeterministicFakeEmbedding(size=dim)
+
+def child(fmt: str, path: str, dim: int):
+    # Imports are done before the clock starts so only index loading is measured
+    if fmt == "faiss":
+        from langchain_community.vectorstores import FAISS
+    else:
+        from mmap_index import MmapVectorStore
+    import numpy as np
+
+    embeddings = fake_embeddings(dim)
+    before = memory_kb()
+    start = time.perf_counter()
+    if fmt == "faiss":
+        store = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    else:
+        store = MmapVectorStore(path, embeddings)
+    load_s = time.perf_counter() - start
+    after_load = memory_kb()
+
+    query = np.random.default_rng(0).normal(size=dim).astype(np.float32).tolist()
+    start = time.perf_counter()
+    store.similarity_search_with_score_by_vector(query, k=3)
+    first_search_s = time.perf_counter() - start
+    after_search = memory_kb()
+
+    print(json.dumps({
+        "format": fmt,
+        "load_ms": round(load_s * 1000, 2),
+        "first_search_ms": round(first_search_s * 1000, 2),
+        "rss_delta_after_load_kb": after_load["VmRSS"] - before["VmRSS"],
+        "anon_delta_after_load_kb": after_load["RssAnon"] - before["RssAnon"],
+        "rss_delta_after_search_kb": after_search["VmRSS"] - before["VmRSS"],
+        "anon_delta_after_search_kb": after_search["RssAnon"] - before["RssAnon"],
+        "file_backed_after_search_kb": after_search["RssFile"],
+    }))
+
+def build_synthetic(path: str, n: int, dim: int):
+    """Writes a flat FAISS index of n random vectors with small Q/A documents."""
+    import faiss
+    import numpy as np
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain.docstore.document import Document
+
+    rng = np.random.default_rng(0)
+    index = faiss.IndexFlatL2(dim)
+    for start in range(0, n, 50000):
+        index.add(rng.normal(size=(min(50000, n - start), dim)).astype(np.float32))
+    ids = [str(i) for i in range(n)]
+    docs = {ids[i]: Document(page_content=f"Question: synthetic problem {i}\nAnswer: synthetic solution {i}",
+                             metadata={"source": "synthetic", "question": f"synthetic problem {i}"}) for i in range(n)}
+    FAISS(fake_embeddings(dim), index, InMemoryDocstore(docs), dict(enumerate(ids))).save_local(path)
+
+def run_child(fmt: str, path: str, dim: int) -> dict:
+    output = subprocess.run([sys.executable, __file__, "--child", fmt, path, "--dim", str(dim)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, default=0, help="Build a synthetic index with this many documents")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh processes per format (the best run is reported)")
+    parser.add_argument("--child", nargs=2, metavar=("FORMAT", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], args.child[1], args.dim)
+        return
+
+    from langchain_community.vectorstores import FAISS
+    from config import VECTOR_STORE_PATH
+    from mmap_index import convert_faiss_to_mmap
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic:
+            faiss_path = os.path.join(tmp, "faiss")
+            print(f"Building synthetic index with {args.synthetic} documents...")
+            build_synthetic(faiss_path, args.synthetic, args.dim)
+        else:
+            faiss_path = os.path.join(PROJECT_ROOT, VECTOR_STORE_PATH)
+        mmap_path = os.path.join(tmp, "mmap")
+        store = FAISS.load_local(faiss_path, fake_embeddings(args.dim), allow_dangerous_deserialization=True)
+        convert_faiss_to_mmap(store, mmap_path)
+        count = store.index.ntotal
+        del store
+
+        print(f"{count} documents, dim {args.dim}")
+        for fmt, path in (("faiss", faiss_path), ("mmap", mmap_path)):
+            runs = [run_child(fmt, path, args.dim) for _ in range(args.repeat)]
+            best = min(runs, key=lambda r: r["load_ms"])
+            print(json.dumps(best))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Fault-injection check of the provider client layer (src/providers.py), fully offline.
+
+Each scenario drives a fake backend from fake_backends.py that injects one kind of fault, through a bare
+ProviderClient (no rate limit, retries, hedging or breaker: the previous behaviour) and through one configured
+like production. Workers call in a closed loop for `--duration` seconds; per variant it reports success rate,
+goodput, latency percentiles of successful calls, how many calls reached the provider and the client's counters.
+
+    quota      the provider allows 20 calls/s and answers 429 beyond that
+    transient  20% of calls fail with 503
+    outage     every call fails with 503 between 1s and 3s
+    tail       5% of calls are 20x slower than the median
+
+    python benchmarks/provider_faults.py
+    python benchmarks/provider_faults.py --scenarios outage tail --duration 8
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from fake_backends import BackendProfile, _Behaviour
+from providers import ProviderClient, ProviderUnavailableError
+
+SCENARIOS = {
+    "quota": {"profile": {"quota_per_second": 20}, "client": {"rate_per_second": 18, "burst": 5}},
+    "transient": {"profile": {"error_rate": 0.2}, "client": {}},
+    "outage": {"profile": {"outages": ((1.0, 3.0),)}, "client": {"reset_seconds": 0.5}},
+    "tail": {"profile": {"tail_rate": 0.05, "tail_factor": 20}, "client": {"hedge_after_seconds": 0.15}},
+}
+PERCENTILES = (50, 95, 99)
+
+def resilient_client(name: str, overrides: dict, args) -> ProviderClient:
+    settings = {"max_retries": 3, "retry_base_delay": 0.05, "retry_max_delay": 0.5, "max_rate_wait": 2.0,
+                "failure_threshold": 5, "reset_seconds": 2.0, **overrides}
+    return ProviderClient(name, **settings)
+
+def run_variant(scenario: str, variant: str, args) -> dict:
+    config = SCENARIOS[scenario]
+    behaviour = _Behaviour(scenario, BackendProfile(args.latency_ms, args.jitter, **config["profile"]), args.seed)
+    client = ProviderClient(scenario) if variant == "bare" else resilient_client(scenario, config["client"], args)
+    results, lock = [], threading.Lock()
+    stop_at = time.monotonic() + args.duration
+
+    def worker():
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            try:
+                client.call(behaviour.call)
+                outcome = "ok"
+            except ProviderUnavailableError:
+                outcome = "fail_fast"
+            except Exception:
+                outcome = "error"
+            with lock:
+                results.append((outcome, (time.perf_counter() - start) * 1000))
+            time.sleep(args.think_ms / 1000)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in range(args.concurrency):
+            pool.submit(worker)
+
+    ok = [latency for outcome, latency in results if outcome == "ok"]
+    return {
+        "scenario": scenario, "variant": variant, "calls": len(results), "ok": len(ok),
+        "errors": sum(outcome == "error" for outcome, _ in results),
+        "fail_fast": sum(outcome == "fail_fast" for outcome, _ in results),
+        "success_rate": round(len(ok) / len(results), 4) if results else None,
+        "goodput_per_s": round(len(ok) / args.duration, 2),
+        "latency_ok": {f"p{p}_ms": round(float(np.percentile(ok, p)), 2) for p in PERCENTILES} if ok else {},
+        "provider_calls": behaviour.stats(),
+        "client": {key: value for key, value in client.stats().items() if key not in ("calls", "successes")},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per scenario and variant")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--think-ms", type=float, default=20.0, help="Pause between a worker's calls")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Median provider latency")
+    parser.add_argument("--jitter", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    for scenario in args.scenarios:
+        for variant in ("bare", "resilient"):
+            print(json.dumps(run_variant(scenario, variant, args)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Local load test of the HTTP serving mode (src/server.py), fully offline.
+
+The server runs in a subprocess with the fake Gemini/embedding/Tavily/page backends from fake_backends.py
+installed in every worker, so admission control, deadlines and multi-worker scaling can be measured without
+API keys. The client keeps `--concurrency` requests open against /v1/query, /v1/stream or /v1/batch and reports
+status codes (200/429/503/504), latency percentiles of the successful requests and throughput, then sends
+SIGTERM and reports how long the graceful shutdown took.
+
+    python benchmarks/server_load.py --workers 2 --concurrency 64 --requests 500
+    python benchmarks/server_load.py --max-concurrency 4 --max-queue 8 --concurrency 64   # provoke 429s
+    python benchmarks/server_load.py --endpoint stream --timeout-s 0.5 --llm-ms 1500      # provoke deadlines
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from agent_latency import build_workload, load_kb_vectors, read_queries, summarize
+from fake_backends import BackendProfile, install
+
+SETTINGS_ENV = "SERVER_LOAD_SETTINGS" # JSON with the fake backend and server settings, read by every worker
+
+def create_fake_app():
+    """App factory for uvicorn workers: installs the fake backends, then builds the real server app."""
+    settings = json.loads(os.environ[SETTINGS_ENV])
+    os.chdir(PROJECT_ROOT)
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("TAVILY_API_KEY", "benchmark")
+    os.environ["NO_PROXY"] = os.environ["no_proxy"] = "127.0.0.1,localhost"
+    if not settings["verbose"]:
+        logging.disable(logging.CRITICAL)
+
+    known_vectors, dim = load_kb_vectors(os.path.join(PROJECT_ROOT, "faiss_index_jee_math"))
+    profile = lambda name: BackendProfile(settings[f"{name}_ms"], settings["jitter"], settings[f"{name}_error_rate"])
+    backends = install(llm=profile("llm"), embedding=profile("embed"), search=profile("search"), pages=profile("page"),
+                       seed=settings["seed"] + os.getpid(), embedding_dim=dim)
+    backends.embeddings.known_vectors = known_vectors
+    backends.page_server.__enter__() # Lives as long as the worker (daemon thread)
+
+    # Config is patched before the server and agent modules read it
+    import config
+    cache_dir = tempfile.mkdtemp(prefix="server-load-")
+    config.WEB_CACHE_PATH = os.path.join(cache_dir, "web_cache.sqlite3")
+    config.ANSWER_CACHE_ENABLED = not settings["no_answer_cache"]
+    config.ANSWER_CACHE_PATH = None
+    for key in ("max_concurrency", "max_queue", "request_timeout_seconds"):
+        if settings[key] is not None:
+            setattr(config, f"SERVER_{key.upper()}", settings[key])
+
+    import server
+    return server.create_app()
+
+def serve(args):
+    import uvicorn
+    uvicorn.run("server_load:create_fake_app", factory=True, host="127.0.0.1", port=args.port, workers=args.workers,
+                timeout_graceful_shutdown=args.grace_s, log_level="info" if args.verbose else "warning")
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_until_ready(base_url: str, workers: int, timeout: float) -> float:
+    """Polls /readyz on fresh connections until every worker answered 200; returns the startup time."""
+    start = time.perf_counter()
+    ready_pids = set()
+    while len(ready_pids) < workers:
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError(f"Only {len(ready_pids)}/{workers} workers became ready in {timeout}s")
+        try:
+            with urllib.request.urlopen(f"{base_url}/readyz", timeout=2) as response:
+                ready_pids.add(json.load(response)["pid"])
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    return time.perf_counter() - start
+
+async def run_load(base_url: str, workload: list[str], args) -> list[dict]:
+    import aiohttp
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    if args.endpoint == "batch":
+        workload = [workload[i:i + args.batch_size] for i in range(0, len(workload), args.batch_size)]
+
+    async def one(session, item) -> dict:
+        body = {"queries": item} if args.endpoint == "batch" else {"query": item}
+        if args.timeout_s:
+            body["timeout_s"] = args.timeout_s
+        async with semaphore:
+            start = time.perf_counter()
+            result = {"status": None, "ttfb_ms": None}
+            try:
+                async with session.post(f"{base_url}/v1/{args.endpoint}", json=body) as response:
+                    result["status"] = response.status
+                    async for _ in response.content.iter_any():
+                        if result["ttfb_ms"] is None:
+                            result["ttfb_ms"] = (time.perf_counter() - start) * 1000
+            except aiohttp.ClientError as e:
+                result["status"] = type(e).__name__
+            result["latency_ms"] = (time.perf_counter() - start) * 1000
+            return result
+
+    # One connection per in-flight request, so requests spread over the worker processes
+    connector = aiohttp.TCPConnector(limit=args.concurrency, force_close=True)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None)) as session:
+        return await asyncio.gather(*(one(session, item) for item in workload))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=["query", "stream", "batch"], default="query")
+    parser.add_argument("--workers", type=int, default=1, help="Server worker processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="Client requests in flight")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=16, help="Queries per /v1/batch request")
+    parser.add_argument("--timeout-s", type=float, help="Per-request deadline sent with every request")
+    parser.add_argument("--max-concurrency", type=int, help="Override SERVER_MAX_CONCURRENCY")
+    parser.add_argument("--max-queue", type=int, help="Override SERVER_MAX_QUEUE")
+    parser.add_argument("--request-timeout-seconds", type=float, help="Override SERVER_REQUEST_TIMEOUT_SECONDS")
+    parser.add_argument("--queries", nargs="+", default=["data/jee_math.csv"], help="CSV/JSONL query files")
+    parser.add_argument("--unknown-fraction", type=float, default=0.2, help="Share of queries changed so they miss the KB")
+    parser.add_argument("--repeat-fraction", type=float, default=0.1, help="Share of queries asked a second time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-ms", type=float, default=400.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--embed-ms", type=float, default=60.0)
+    parser.add_argument("--embed-error-rate", type=float, default=0.0)
+    parser.add_argument("--search-ms", type=float, default=300.0)
+    parser.add_argument("--search-error-rate", type=float, default=0.0)
+    parser.add_argument("--page-ms", type=float, default=150.0)
+    parser.add_argument("--page-error-rate", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.25, help="Lognormal sigma of all backend latencies")
+    parser.add_argument("--no-answer-cache", action="store_true")
+    parser.add_argument("--grace-s", type=float, default=30.0, help="Graceful shutdown timeout")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--json-out", help="Also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the server's logging")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    args.port = args.port or _free_port()
+    base_url = f"http://127.0.0.1:{args.port}"
+    settings = {key: getattr(args, key) for key in (
+        "llm_ms", "llm_error_rate", "embed_ms", "embed_error_rate", "search_ms", "search_error_rate", "page_ms",
+        "page_error_rate", "jitter", "seed", "no_answer_cache", "verbose", "max_concurrency", "max_queue",
+        "request_timeout_seconds")}
+    env = {**os.environ, SETTINGS_ENV: json.dumps(settings), "NO_PROXY": "127.0.0.1,localhost", "no_proxy": "127.0.0.1,localhost"}
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port), "--workers",
+               str(args.workers), "--grace-s", str(args.grace_s)] + (["--verbose"] if args.verbose else [])
+    process = subprocess.Popen(command, env=env, cwd=PROJECT_ROOT)
+    try:
+        startup_s = wait_until_ready(base_url, args.workers, args.startup_timeout)
+        queries = read_queries([os.path.join(PROJECT_ROOT, path) if not os.path.isabs(path) else path for path in args.queries])
+        workload = build_workload(queries, args.requests * (args.batch_size if args.endpoint == "batch" else 1),
+                                  args.unknown_fraction, args.repeat_fraction, args.seed)
+        random.Random(args.seed).shuffle(workload)
+
+        start = time.perf_counter()
+        results = asyncio.run(run_load(base_url, workload, args))
+        wall_s = time.perf_counter() - start
+    finally:
+        shutdown_start = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=args.grace_s + 10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutdown_s = time.perf_counter() - shutdown_start
+
+    statuses = {}
+    for result in results:
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+    ok = [r for r in results if r["status"] == 200]
+    report = {
+        "endpoint": args.endpoint, "workers": args.workers, "concurrency": args.concurrency, "requests": len(results),
+        "startup_s": round(startup_s, 3), "wall_s": round(wall_s, 3), "shutdown_s": round(shutdown_s, 3),
+        "throughput_rps": round(len(ok) / wall_s, 2) if wall_s else None, "statuses": statuses,
+        "latency_ok": summarize([r["latency_ms"] for r in ok]),
+        "latency_rejected": summarize([r["latency_ms"] for r in results if r["status"] in (429, 503)]),
+    }
+    if args.endpoint == "stream":
+        report["time_to_first_byte"] = summarize([r["ttfb_ms"] for r in ok if r["ttfb_ms"] is not None])
+    print(json.dumps(report))
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Cold-start cost of MathAgent, fully offline.
+
+Every run is a fresh Python process that imports the agent, installs the fake backends from fake_backends.py
+(after the import, so the agent's own deferred imports are what is measured), constructs MathAgent and answers
+one query that misses the knowledge base (guardrails, embedding, KB search, web search, page fetch and
+generation all run). Reported per mode, as medians over `--runs` processes:
+
+    import_s            `import agent`
+    fakes_s             installing the fakes, which imports the Gemini and Tavily integrations
+    init_s              MathAgent()
+    first_query_s       latency of the first query
+    second_query_s      latency of a second, different query (steady state)
+    time_to_answer_s    process start to first answer, excluding --idle-s
+    process_s           wall time of the whole process as seen by the parent
+
+Modes: "lazy" builds everything on first use, "warmup" starts the background warm-up in MathAgent() and
+waits `--idle-s` (a user typing) before the first query, "eager" calls warm_up(wait=True) in init.
+
+    python benchmarks/startup.py --runs 5
+    python benchmarks/startup.py --modes lazy warmup --idle-s 1.0 --llm-ms 300
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+START = time.perf_counter()
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+FIRST_QUERY = "Explain the concept of Lagrange multipliers with an example."
+SECOND_QUERY = "Derive the formula for the volume of a sphere using calculus."
+METRICS = ("import_s", "fakes_s", "init_s", "first_query_s", "second_query_s", "time_to_answer_s", "process_s")
+
+def child(args):
+    """One measured process. Prints a JSON line with its timings."""
+    os.chdir(PROJECT_ROOT)
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("TAVILY_API_KEY", "benchmark")
+    os.environ["NO_PROXY"] = os.environ["no_proxy"] = "127.0.0.1,localhost"
+    logging.disable(logging.CRITICAL)
+
+    import config
+    cache_dir = tempfile.mkdtemp(prefix="startup-benchmark-")
+    config.WEB_CACHE_PATH = os.path.join(cache_dir, "web_cache.sqlite3")
+    config.ANSWER_CACHE_ENABLED = False
+    config.WARMUP_IN_BACKGROUND = args.child == "warmup"
+    timings = {}
+
+    start = time.perf_counter()
+    import agent
+    timings["import_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from fake_backends import BackendProfile, install
+    backends = install(llm=BackendProfile(args.llm_ms, 0.0), embedding=BackendProfile(args.embed_ms, 0.0),
+                       search=BackendProfile(args.search_ms, 0.0), pages=BackendProfile(args.page_ms, 0.0))
+    timings["fakes_s"] = time.perf_counter() - start
+
+    with backends.page_server:
+        start = time.perf_counter()
+        math_agent = agent.MathAgent()
+        if args.child == "eager":
+            math_agent.warm_up(wait=True)
+        timings["init_s"] = time.perf_counter() - start
+
+        idle_s = 0.0
+        if args.child == "warmup" and args.idle_s:
+            time.sleep(args.idle_s)
+            idle_s = args.idle_s
+        start = time.perf_counter()
+        math_agent.process_query(FIRST_QUERY)
+        timings["first_query_s"] = time.perf_counter() - start
+        timings["time_to_answer_s"] = time.perf_counter() - START - idle_s
+
+        start = time.perf_counter()
+        math_agent.process_query(SECOND_QUERY)
+        timings["second_query_s"] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+def run_mode(mode: str, args) -> dict:
+    command = [sys.executable, os.path.abspath(__file__), "--child", mode, "--idle-s", str(args.idle_s),
+               "--llm-ms", str(args.llm_ms), "--embed-ms", str(args.embed_ms), "--search-ms", str(args.search_ms),
+               "--page-ms", str(args.page_ms)]
+    runs = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=PROJECT_ROOT).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        timings["process_s"] = time.perf_counter() - start - (args.idle_s if mode == "warmup" else 0.0)
+        runs.append(timings)
+    return {"mode": mode, "runs": args.runs,
+            **{metric: round(statistics.median(run[metric] for run in runs), 3) for metric in METRICS}}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=["lazy", "warmup", "eager"], default=["lazy", "warmup", "eager"])
+    parser.add_argument("--runs", type=int, default=3, help="Fresh processes per mode")
+    parser.add_argument("--idle-s", type=float, default=2.0, help="Pause before the first query in warmup mode")
+    parser.add_argument("--llm-ms", type=float, default=0.0)
+    parser.add_argument("--embed-ms", type=float, default=0.0)
+    parser.add_argument("--search-ms", type=float, default=0.0)
+    parser.add_argument("--page-ms", type=float, default=0.0)
+    parser.add_argument("--child", choices=["lazy", "warmup", "eager"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+    for mode in args.modes:
+        print(json.dumps(run_mode(mode, args)))
+
+if __name__ == "__main__":
+    main()
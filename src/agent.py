@@ -1,19 +1,46 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.vectorstores import FAISS
-from langchain.prompts import PromptTemplate
-from langchain.schema.runnable import RunnablePassthrough
-from langchain.schema.output_parser import StrOutputParser
-from langchain_community.tools.tavily_search import TavilySearchResults
-import requests
-from bs4 import BeautifulSoup
-
-from config import GOOGLE_API_KEY, GEMINI_MODEL_NAME, SIMILARITY_THRESHOLD, MAX_WEB_RESULTS, TAVILY_API_KEY
-from vector_store import create_or_load_vector_store
-from guardrails import check_input_guardrails, check_output_guardrails
-from utils import get_logger
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+
+from config import (GOOGLE_API_KEY, GEMINI_MODEL_NAME, SIMILARITY_THRESHOLD, MAX_WEB_RESULTS, TAVILY_API_KEY, KB_TOP_K, SPECULATIVE_WEB_MARGIN,
+                    BATCH_MAX_CONCURRENCY, BATCH_GUARDRAIL_LLM_SIZE,
+                    ANSWER_CACHE_ENABLED, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS,
+                    ANSWER_CACHE_SEMANTIC_THRESHOLD, ANSWER_CACHE_PATH,
+                    WEB_STAGE_DEADLINE_SECONDS, WEB_FETCH_TIMEOUT_SECONDS, WEB_FETCH_MAX_WORKERS,
+                    WEB_FETCH_POOL_MAXSIZE, WEB_CONTENT_MAX_CHARS, WEB_FETCH_MAX_BYTES, WEB_CACHE_ENABLED, WEB_CACHE_PATH,
+                    WEB_SEARCH_CACHE_TTL_SECONDS, WEB_PAGE_CACHE_TTL_SECONDS, WEB_CACHE_MAX_ENTRIES,
+                    HYBRID_RETRIEVAL_ENABLED, HYBRID_CANDIDATES, RRF_K, BM25_DECISIVE_QUERY_COVERAGE,
+                    BM25_DECISIVE_DOC_COVERAGE, BM25_DECISIVE_MARGIN,
+                    DIRECT_ANSWER_ENABLED, DIRECT_ANSWER_MAX_DISTANCE, DIRECT_ANSWER_BACKGROUND_REWRITE,
+                    DIRECT_ANSWER_REWRITE_WORKERS, WARMUP_IN_BACKGROUND,
+                    CONTEXT_PACKING_ENABLED, CONTEXT_KB_TOKEN_BUDGET, CONTEXT_WEB_TOKEN_BUDGET, CONTEXT_PASSAGE_MAX_CHARS,
+                    CONTEXT_DEDUP_SIMILARITY, CONTEXT_SEMANTIC_RANKING, LOCAL_SOLVER_ENABLED, KB_SHARDING_ENABLED)
+from vector_store import (create_or_load_vector_store, batch_similarity_search_with_score, load_kb_bm25_index,
+                          get_documents_by_ids)
+from guardrails import (check_input_guardrails, check_input_guardrails_batch, check_output_guardrails,
+                        contains_sensitive_keywords, StreamingOutputGuardrail, warm_up_guardrails)
+from answer_cache import AnswerCache, normalize_query
+from bm25_index import reciprocal_rank_fusion
+from sharded_store import ShardedVectorStore, load_sharded_vector_store
+from context_packing import estimate_tokens, pack_documents, pack_web_context
+from direct_answer import render_direct_answer, same_numbers
+from embedding_cache import CachedEmbeddings
+from local_solver import solve_locally
+from web_cache import WebCache
+from providers import resilient_chat_model, resilient_search_tool
+from tracing import span, traced, current_span, count, llm_callbacks
+from utils import get_logger, lazy_property
 
 logger = get_logger(__name__)
 
+NO_ANSWER_FALLBACK_MESSAGE = "Sorry, I cannot answer this question right now. Please try again in a little while."
+
+class BatchCancelled(Exception):
+    """Raised by process_batch when its `cancel` event is set (e.g. the HTTP request deadline passed)."""
+
 class MathAgent:
     def __init__(self):
         if not GOOGLE_API_KEY:
@@ -21,18 +48,92 @@ class MathAgent:
         if not TAVILY_API_KEY:
             logger.warning("TAVILY_API_KEY not found. Web search functionality will be limited.")
 
-        self.llm = ChatGoogleGenerativeAI(model=GEMINI_MODEL_NAME, google_api_key=GOOGLE_API_KEY, temperature=0.5)
-        self.vector_store = create_or_load_vector_store()
-        if self.vector_store:
-            self.retriever = self.vector_store.as_retriever(search_kwargs={"k": 3}) # Retrieve top 3 docs
-        else:
-            self.retriever = None
+        project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+        # Persistent cache of search results and extracted page text
+        self.web_cache = None
+        if WEB_CACHE_ENABLED:
+            try:
+                self.web_cache = WebCache(os.path.join(project_root, WEB_CACHE_PATH), search_ttl_seconds=WEB_SEARCH_CACHE_TTL_SECONDS,
+                                          page_ttl_seconds=WEB_PAGE_CACHE_TTL_SECONDS, max_entries=WEB_CACHE_MAX_ENTRIES)
+            except Exception as e:
+                logger.warning(f"Failed to open web cache: {e}. Web results will not be cached.")
+
+        # Answer cache in front of the pipeline (exact + semantic tiers)
+        self.answer_cache = None
+        if ANSWER_CACHE_ENABLED:
+            cache_path = os.path.join(project_root, ANSWER_CACHE_PATH) if ANSWER_CACHE_PATH else None
+            self.answer_cache = AnswerCache(max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                                            semantic_threshold=ANSWER_CACHE_SEMANTIC_THRESHOLD, persist_path=cache_path)
+
+        # Direct-answer tier: counters, plus a small pool for optional background LLM rewrites
+        self._direct_answer_stats = {"served": 0, "rewrites_started": 0, "rewrites_cached": 0, "rewrite_errors": 0}
+        self._direct_answer_lock = threading.Lock()
+        self._rewrites_in_flight = set()
+        self._rewrite_executor = None
+
+        if WARMUP_IN_BACKGROUND:
+            self.warm_up()
+
+    # --- Clients, index and chains: built on first use (or by warm_up) so that constructing the agent is cheap ---
+
+    @lazy_property
+    def llm(self):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        # Retries are left to the provider layer (max_retries=1 is a single attempt)
+        return resilient_chat_model(ChatGoogleGenerativeAI(model=GEMINI_MODEL_NAME, google_api_key=GOOGLE_API_KEY, temperature=0.5,
+                                                           max_retries=1), callbacks=llm_callbacks())
+
+    @lazy_property
+    def vector_store(self):
+        # Topic shards when they have been built, otherwise the single index
+        vector_store = (load_sharded_vector_store() if KB_SHARDING_ENABLED else None) or create_or_load_vector_store()
+        if not vector_store:
             logger.error("Vector store not loaded. Knowledge base retrieval disabled.")
+        return vector_store
+
+    @lazy_property
+    def bm25_index(self):
+        # Local lexical index over the KB questions (hybrid retrieval)
+        if not HYBRID_RETRIEVAL_ENABLED or not self.vector_store:
+            return None
+        if isinstance(self.vector_store, ShardedVectorStore):
+            return self.vector_store.bm25_index # Over every shard; the store reloads it with the shards
+        return load_kb_bm25_index()
+
+    def _lexical_index(self):
+        """The BM25 index to search now: the sharded store swaps in a new one whenever its shards are rebuilt."""
+        if isinstance(self.vector_store, ShardedVectorStore):
+            return self.vector_store.bm25_index if HYBRID_RETRIEVAL_ENABLED else None
+        return self.bm25_index
 
-        self.web_search_tool = TavilySearchResults(max_results=MAX_WEB_RESULTS, api_key=TAVILY_API_KEY) if TAVILY_API_KEY else None
+    @lazy_property
+    def web_search_tool(self):
+        if not TAVILY_API_KEY:
+            return None
+        from langchain_community.tools.tavily_search import TavilySearchResults
+        return resilient_search_tool(TavilySearchResults(max_results=MAX_WEB_RESULTS, api_key=TAVILY_API_KEY))
+
+    @lazy_property
+    def web_fetcher(self):
+        # Shared pooled session + worker pool for concurrent page fetches
+        from web_fetcher import WebFetcher, create_http_session
+        return WebFetcher(max_workers=WEB_FETCH_MAX_WORKERS, request_timeout=WEB_FETCH_TIMEOUT_SECONDS,
+                          max_chars=WEB_CONTENT_MAX_CHARS, max_bytes=WEB_FETCH_MAX_BYTES,
+                          session=create_http_session(pool_maxsize=WEB_FETCH_POOL_MAXSIZE),
+                          page_cache=self.web_cache)
+
+    @lazy_property
+    def web_search_executor(self):
+        # Runs web searches so the caller can stop waiting at the web stage deadline
+        return ThreadPoolExecutor(max_workers=WEB_FETCH_MAX_WORKERS, thread_name_prefix="web-search")
 
-        # --- Prompt Templates ---
-        self.rag_prompt_template = PromptTemplate.from_template(
+    # --- Prompt Templates ---
+
+    @lazy_property
+    def rag_prompt_template(self):
+        from langchain_core.prompts import PromptTemplate
+        return PromptTemplate.from_template(
             """You are a helpful Math Professor AI assistant. Your goal is to provide a clear, step-by-step solution to the user's math question, based *only* on the provided context.
             If the context does not contain the answer, state that the information is not available in the knowledge base. Do not make up answers.
 
@@ -44,7 +145,10 @@ class MathAgent:
             Step-by-step Solution:"""
         )
 
-        self.web_search_prompt_template = PromptTemplate.from_template(
+    @lazy_property
+    def web_search_prompt_template(self):
+        from langchain_core.prompts import PromptTemplate
+        return PromptTemplate.from_template(
             """You are an expert Math Professor AI assistant. Your goal is to provide a clear, step-by-step solution to the user's math question.
             Use the provided web search results as a primary source of information, formulas, or methods. If the results provide a direct solution, explain it clearly.
             If the results provide relevant concepts or formulas but not a full solution, use your own mathematical reasoning abilities to solve the problem step-by-step, referencing the search results where appropriate.
@@ -58,7 +162,10 @@ class MathAgent:
             Step-by-step Solution:"""
         )
 
-        self.no_answer_prompt_template = PromptTemplate.from_template(
+    @lazy_property
+    def no_answer_prompt_template(self):
+        from langchain_core.prompts import PromptTemplate
+        return PromptTemplate.from_template(
             """You are a helpful Math Professor AI assistant. You were unable to find a relevant answer to the user's question in your knowledge base or through web search.
             Politely inform the user that you cannot provide an answer at this time.
 
@@ -67,86 +174,271 @@ class MathAgent:
             Response:"""
         )
 
-        # --- Chains ---
-        self.rag_chain = (
-            {"context": self.retriever, "question": RunnablePassthrough()}
-            | self.rag_prompt_template
+    # --- Chains ---
+
+    @lazy_property
+    def rag_chain(self):
+        from langchain_core.output_parsers import StrOutputParser
+        # Retrieval happens in process_query (one embedding + one FAISS search), so the RAG chain takes context directly
+        return (
+            self.rag_prompt_template
             | self.llm
             | StrOutputParser()
-        ) if self.retriever else None
+        ) if self.vector_store else None
 
-        self.web_chain = (
-             # Note: Context here will be formatted web results
-            {"context": RunnablePassthrough(), "question": RunnablePassthrough()}
-            | self.web_search_prompt_template
+    @lazy_property
+    def web_chain(self):
+        from langchain_core.output_parsers import StrOutputParser
+        # Takes {"context": packed web passages, "question": ...} like the RAG chain
+        return (
+            self.web_search_prompt_template
             | self.llm
             | StrOutputParser()
         )
 
-        self.no_answer_chain = (
+    @lazy_property
+    def no_answer_chain(self):
+        from langchain_core.output_parsers import StrOutputParser
+        from langchain_core.runnables import RunnablePassthrough
+        return (
             {"question": RunnablePassthrough()}
             | self.no_answer_prompt_template
             | self.llm
             | StrOutputParser()
         )
 
-    def _format_docs(self, docs):
-        return "\n\n".join(doc.page_content for doc in docs)
+    def warm_up(self, wait: bool = False):
+        """
+        Builds everything the first query needs (LLM clients, index, chains, guardrail models) ahead of time.
+        Runs in a daemon thread unless `wait` is set; queries arriving meanwhile wait only for the parts they use.
+        """
+        def build():
+            start = time.perf_counter()
+            try:
+                warm_up_guardrails()
+                for name in ("vector_store", "bm25_index", "rag_chain", "web_chain", "no_answer_chain", "web_search_tool",
+                             "web_fetcher"):
+                    getattr(self, name)
+            except Exception as e:
+                logger.warning(f"Warm-up failed: {e}. Components will be built on first use.")
+                return
+            logger.info(f"Agent warmed up in {time.perf_counter() - start:.2f}s.")
+
+        if wait:
+            build()
+            return None
+        thread = threading.Thread(target=build, name="agent-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def loaded_components(self) -> dict:
+        """Which lazily built components exist yet (for readiness checks and startup measurements)."""
+        return {name: getattr(type(self), name).is_loaded(self) for name in ("llm", "vector_store", "bm25_index",
+                "web_search_tool", "web_fetcher", "rag_chain", "web_chain", "no_answer_chain")}
+
+    def _embed_query(self, query: str, timings: dict):
+        """Embeds the query once with the knowledge base embedding model, or returns None if unavailable."""
+        if not self.vector_store:
+            return None
+        embeddings = self.vector_store.embedding_function
+        start = time.perf_counter()
+        try:
+            with span("embedding") as embedding_span:
+                if isinstance(embeddings, CachedEmbeddings):
+                    query_vector, from_cache = embeddings.embed_query_with_info(query)
+                else:
+                    query_vector, from_cache = embeddings.embed_query(query), False
+                embedding_span.set(cache_hit=from_cache)
+        except Exception as e:
+            logger.warning(f"Failed to embed query: {e}")
+            return None
+        timings["embed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        timings["embedding_calls"] = timings.get("embedding_calls", 0) + (0 if from_cache else 1)
+        return query_vector
+
+    def _search_knowledge_base(self, query_vector, timings: dict, query: str = None):
+        """
+        Runs a single FAISS search for the top documents with scores (L2 distance, lower is better).
+        A sharded knowledge base searches the shards the query is routed to, in parallel.
+        """
+        start = time.perf_counter()
+        with span("kb_search") as search_span:
+            if isinstance(self.vector_store, ShardedVectorStore):
+                docs_with_scores = self.vector_store.similarity_search_with_score_by_vector(query_vector, k=self._vector_candidates(),
+                                                                                            query=query)
+            else:
+                docs_with_scores = self.vector_store.similarity_search_with_score_by_vector(query_vector, k=self._vector_candidates())
+            search_span.set(best_score=float(docs_with_scores[0][1]) if docs_with_scores else None)
+        timings["kb_search_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return docs_with_scores
 
-    def _fetch_and_extract_web_content(self, query: str) -> str:
-        """Performs web search and extracts content from top results."""
+    def _vector_candidates(self) -> int:
+        # With hybrid retrieval, more vector candidates are fused with the lexical ones before taking the top-k
+        return max(KB_TOP_K, HYBRID_CANDIDATES) if self._lexical_index() else KB_TOP_K
+
+    def _lexical_search(self, query: str, request: dict):
+        """
+        Runs (once per request) the BM25 search over the KB questions.
+        Returns {"doc_ids", "decisive"} or None without a BM25 index.
+        """
+        bm25_index = self._lexical_index() # One index for the whole lookup, even if a reload swaps it meanwhile
+        if not bm25_index:
+            return None
+        if "lexical" not in request:
+            start = time.perf_counter()
+            with span("lexical_search") as lexical_span:
+                hits = bm25_index.search(query, k=HYBRID_CANDIDATES)
+                decisive = bm25_index.is_decisive(query, hits, BM25_DECISIVE_QUERY_COVERAGE, BM25_DECISIVE_DOC_COVERAGE,
+                                                       BM25_DECISIVE_MARGIN)
+                lexical_span.set(decisive=decisive, best_score=hits[0][1] if hits else None)
+            request["lexical"] = {"doc_ids": [str(bm25_index.doc_ids[i]) for i, _ in hits], "decisive": decisive}
+            request["timings"]["lexical_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            if decisive:
+                logger.info(f"Decisive lexical KB match (BM25 score {hits[0][1]:.2f}).")
+        return request["lexical"]
+
+    def _is_lexically_decisive(self, query: str, request: dict) -> bool:
+        lexical = self._lexical_search(query, request)
+        return bool(lexical and lexical["decisive"])
+
+    def _lexical_context(self, request: dict):
+        """KB context straight from a decisive lexical match (no embedding, no vector search)."""
+        docs = get_documents_by_ids(self.vector_store, request["lexical"]["doc_ids"][:KB_TOP_K])
+        if not docs:
+            return None
+        request["kb_best_score"] = None # No vector distance was computed
+        request["kb_top_doc"] = docs[0]
+        logger.info("Found relevant document in Knowledge Base (lexical match).")
+        return self._format_docs(docs, request)
+
+    def _fuse_with_lexical(self, docs_with_scores, request: dict):
+        """Reciprocal-rank fusion of the vector and lexical rankings. Returns the top KB_TOP_K documents."""
+        vector_docs = [doc for doc, _ in docs_with_scores]
+        lexical = request.get("lexical")
+        if not lexical or not lexical["doc_ids"]:
+            return vector_docs[:KB_TOP_K]
+        lexical_docs = get_documents_by_ids(self.vector_store, lexical["doc_ids"])
+        # Documents are keyed by content, which both retrievers return identically
+        docs_by_content = {doc.page_content: doc for doc in lexical_docs + vector_docs}
+        ranked = reciprocal_rank_fusion([[doc.page_content for doc in vector_docs], [doc.page_content for doc in lexical_docs]], RRF_K)
+        return [docs_by_content[content] for content in ranked[:KB_TOP_K]]
+
+    def _format_docs(self, docs, request: dict = None):
+        texts = [doc.page_content for doc in docs]
+        if CONTEXT_PACKING_ENABLED:
+            texts, stats = pack_documents(texts, CONTEXT_KB_TOKEN_BUDGET, CONTEXT_DEDUP_SIMILARITY)
+            self._record_context_stats("kb", stats, request)
+        return "\n\n".join(texts)
+
+    @staticmethod
+    def _record_context_stats(route: str, stats: dict, request: dict = None):
+        if request is not None:
+            request["timings"]["context_tokens"] = stats["context_tokens"]
+            request["timings"]["context_tokens_dropped"] = stats["candidate_tokens"] - stats["context_tokens"]
+        current_span().set(context_candidates=stats["candidates"], context_selected=stats["selected"],
+                           context_tokens=stats["context_tokens"], context_candidate_tokens=stats["candidate_tokens"])
+        count("context_tokens", stats["context_tokens"], route=route, kind="kept")
+        count("context_tokens", stats["candidate_tokens"] - stats["context_tokens"], route=route, kind="dropped")
+        logger.info(f"Packed {route} context: {stats['selected']} of {stats['candidates']} passages, "
+                    f"{stats['context_tokens']} of {stats['candidate_tokens']} tokens.")
+
+    @traced("web")
+    def _fetch_and_extract_web_content(self, query: str, request: dict = None) -> str:
+        """Performs web search, extracts content from top results and packs the most relevant passages."""
         if not self.web_search_tool:
             logger.warning("Web search tool not available.")
             return "Web search is not configured."
 
+        deadline = time.monotonic() + WEB_STAGE_DEADLINE_SECONDS
         try:
-            search_results = self.web_search_tool.invoke(query)
-            logger.info(f"Web search results for '{query}': {len(search_results)} found.")
-
-            extracted_content = []
-            for result in search_results:
-                url = result.get("url")
-                content_snippet = result.get("content", "") # Use snippet provided by Tavily first
-                if url:
-                    try:
-                        # Basic extraction - enhance with better parsing/filtering
-                        headers = {'User-Agent': 'Mozilla/5.0'} # Be polite
-                        response = requests.get(url, timeout=5, headers=headers)
-                        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-                        soup = BeautifulSoup(response.text, 'html.parser')
-                        # Try to find main content, fallback to body text
-                        main_content = soup.find('main') or soup.find('article') or soup.body
-                        text = main_content.get_text(separator='\n', strip=True) if main_content else soup.get_text(separator='\n', strip=True)
-                        # Limit length per source
-                        extracted_content.append(f"Source: {url}\nContent:\n{text[:1500]}...") # Limit content length
-                        logger.debug(f"Extracted content from {url}")
-                    except requests.exceptions.RequestException as e:
-                        logger.warning(f"Failed to fetch URL {url}: {e}. Using snippet: {content_snippet}")
-                        extracted_content.append(f"Source: {url}\nContent Snippet:\n{content_snippet}")
-                    except Exception as e:
-                         logger.warning(f"Failed to parse URL {url}: {e}. Using snippet: {content_snippet}")
-                         extracted_content.append(f"Source: {url}\nContent Snippet:\n{content_snippet}")
-                elif content_snippet:
-                     extracted_content.append(f"Source: Search Result Snippet\nContent:\n{content_snippet}")
+            search_results = self.web_cache.get_search(query) if self.web_cache else None
+            current_span().set(search_cache_hit=search_results is not None)
+            if search_results is not None:
+                logger.info(f"Web search cache hit for '{query}': {len(search_results)} results.")
+            else:
+                with span("web_search"):
+                    search_results = self._search_within_deadline(query, deadline)
+                logger.info(f"Web search results for '{query}': {len(search_results)} found.")
+                if self.web_cache and isinstance(search_results, list) and search_results:
+                    self.web_cache.put_search(query, search_results)
 
+            # Fetch and extract all result pages concurrently, in the time the search left; late pages fall back to their snippets
+            with span("web_fetch", results=len(search_results)):
+                pages = self.web_fetcher.fetch_pages(search_results, deadline)
 
-            if not extracted_content:
+            if not pages:
                 logger.info("No content extracted from web search results.")
                 return "No relevant information found in web search results."
+            if not CONTEXT_PACKING_ENABLED:
+                return "\n\n---\n\n".join(self.web_fetcher.format_page(page) for page in pages)
 
-            return "\n\n---\n\n".join(extracted_content)
+            with span("context_packing", route="web"):
+                # Reuses the query embedding from the cache lookup / KB search, if there was one
+                query_vector = request.get("query_vector") if request else None
+                embeddings = self.vector_store.embedding_function if CONTEXT_SEMANTIC_RANKING and self.vector_store else None
+                context, stats = pack_web_context(query, pages, CONTEXT_WEB_TOKEN_BUDGET, CONTEXT_PASSAGE_MAX_CHARS,
+                                                  CONTEXT_DEDUP_SIMILARITY, query_vector, embeddings)
+                self._record_context_stats("web", stats, request)
+            return context or "No relevant information found in web search results."
 
         except Exception as e:
             logger.error(f"Error during web search or extraction: {e}")
             return "An error occurred during web search."
 
 
-    def process_query(self, query: str) -> str:
-        """Processes the user query through the agent workflow."""
-        logger.info(f"Processing query: {query}")
+    @traced("local_solver")
+    def _solve_locally(self, query: str):
+        """Returns a step-by-step answer for plain arithmetic, percentages and simple equations, or None."""
+        if not LOCAL_SOLVER_ENABLED:
+            return None
+        start = time.perf_counter()
+        answer = solve_locally(query)
+        current_span().set(solved=answer is not None)
+        if answer is not None:
+            logger.info(f"Answered locally by the solver in {(time.perf_counter() - start) * 1000:.2f} ms.")
+        return answer
 
-        # 1. Input Guardrails
+    @traced("answer_cache")
+    def _answer_from_exact_cache(self, query: str):
+        """
+        Returns the cached answer to this very (normalized) query, or None. Safe before the input guardrails:
+        only answers to queries that passed them are cached.
+        """
+        if not self.answer_cache:
+            return None
+        cached_response = self.answer_cache.get_exact(query)
+        if cached_response is not None:
+            logger.info("Answer cache hit (exact).")
+            current_span().set(hit="exact")
+        return cached_response
+
+    def _answer_from_semantic_cache(self, query: str, request: dict):
+        """
+        Returns the cached answer to a near-duplicate query, or None on a miss. Runs only after the input
+        guardrails passed, since a near-duplicate of an answered query may itself be off-topic or blocked.
+        """
+        if not self.answer_cache:
+            return None
+        # Semantic tier needs an embedding (reused by the KB search); never serve cached answers for sensitive inputs.
+        # Queries that match a KB question lexically skip it, so they are answered without any embedding call.
+        if not contains_sensitive_keywords(query) and not self._is_lexically_decisive(query, request):
+            if request["query_vector"] is None:
+                request["query_vector"] = self._embed_query(query, request["timings"])
+            cached_response = self.answer_cache.get_semantic(request["query_vector"], query)
+            if cached_response is not None:
+                logger.info("Answer cache hit (semantic).")
+                current_span().set(hit="semantic")
+                return cached_response
+        self.answer_cache.record_miss()
+        return None
+
+    def _check_input(self, query: str):
+        """Runs the input guardrails. Returns the message to send back if the query should not be processed."""
         is_safe, message = check_input_guardrails(query)
+        return self._guardrail_outcome(query, is_safe, message)
+
+    @staticmethod
+    def _guardrail_outcome(query: str, is_safe: bool, message: str):
         if not is_safe:
             return message
         # Handle cases where guardrail allows but modifies (like greetings)
@@ -155,70 +447,694 @@ class MathAgent:
              if any(greeting in query.lower() for greeting in ["hello", "hi", "how are you", "what is your name"]):
                  return message # Return the specific greeting response
              # Otherwise, proceed with the potentially modified query if applicable, or just use original
+        return None
 
-        final_response = "Sorry, I encountered an issue and couldn't process your request."
+    def _retrieve_kb_context(self, query: str, request: dict):
+        """
+        Returns formatted KB context if the best match is below SIMILARITY_THRESHOLD (or the question matches
+        a KB question lexically), otherwise None.
+        """
+        if not self.vector_store:
+            return None
+        try:
+            if self._is_lexically_decisive(query, request):
+                lexical_context = self._lexical_context(request)
+                if lexical_context is not None:
+                    return lexical_context
+            # Embed the query once (reused from the cache lookup if already computed) and run one top-k search
+            if request["query_vector"] is None:
+                request["query_vector"] = self._embed_query(query, request["timings"])
+            query_vector = request["query_vector"]
+            docs_with_scores = self._search_knowledge_base(query_vector, request["timings"], query) if query_vector is not None else []
+            return self._select_kb_context(docs_with_scores, request)
+        except Exception as e:
+            logger.error(f"Error during KB retrieval: {e}")
+        return None
+
+    def _select_kb_context(self, docs_with_scores, request: dict):
+        """Applies SIMILARITY_THRESHOLD to a top-k result set and formats it as RAG context (None if not confident)."""
+        if docs_with_scores:
+            best_doc, score = docs_with_scores[0]
+            request["kb_best_score"] = score
+            request["kb_top_doc"] = best_doc
+            # Log the score regardless of threshold
+            logger.info(f"Best KB match score: {score} (Threshold: {SIMILARITY_THRESHOLD})")
+            if score < SIMILARITY_THRESHOLD: # FAISS uses L2 distance, lower is better
+                logger.info("Found relevant document in Knowledge Base (below threshold).")
+                # The vector score decides whether the KB is used; fusion with BM25 decides which documents.
+                # Other vector matches above the threshold are not relevant enough to spend prompt tokens on.
+                distances = {doc.page_content: distance for doc, distance in docs_with_scores}
+                docs = [doc for i, doc in enumerate(self._fuse_with_lexical(docs_with_scores, request))
+                        if i == 0 or distances.get(doc.page_content, 0.0) < SIMILARITY_THRESHOLD]
+                return self._format_docs(docs, request)
+            logger.info("KB documents found but score was above similarity threshold.")
+        else:
+            logger.info("No relevant documents found in Knowledge Base.")
+        return None
+
+    def _search_within_deadline(self, query: str, deadline: float):
+        """
+        Runs the web search (provider retries and rate-limit waits included) until the web stage `deadline`.
+        A search that overruns it keeps running in the background and still fills the web search cache.
+        """
+        future = self.web_search_executor.submit(contextvars.copy_context().run, self.web_search_tool.invoke, query)
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            if self.web_cache:
+                def cache_late_results(done):
+                    if not done.cancelled() and done.exception() is None and isinstance(done.result(), list) and done.result():
+                        self.web_cache.put_search(query, done.result())
+                future.add_done_callback(cache_late_results)
+            raise TimeoutError(f"Web search did not finish within the web stage deadline ({WEB_STAGE_DEADLINE_SECONDS}s)")
+
+    def _get_web_context(self, query: str, request: dict = None):
+        """Returns formatted web context, or None if web search failed or found nothing."""
+        logger.info("Proceeding to Web Search.")
+        web_context = self._fetch_and_extract_web_content(query, request)
+        if "No relevant information found" in web_context or "Web search is not configured" in web_context or "An error occurred" in web_context:
+            logger.info("Web search failed or found no relevant info. Using no_answer chain.")
+            return None
+        logger.info("Found relevant info via web search. Generating response.")
+        return web_context
+
+    def _direct_answer(self, query: str, request: dict, kb_context: str):
+        """
+        Returns the stored KB solution for a near-exact match (no LLM call), or None.
+        Optionally starts a background LLM rewrite whose answer replaces it in the answer cache.
+        """
+        if not DIRECT_ANSWER_ENABLED or request.get("kb_top_doc") is None:
+            return None
+        doc, score = request["kb_top_doc"], request.get("kb_best_score")
+        stored_question = doc.metadata.get("question", "")
+        is_same_question = normalize_query(stored_question) == normalize_query(query)
+        if not is_same_question and (score is None or score > DIRECT_ANSWER_MAX_DISTANCE):
+            return None
+        if not same_numbers(query, stored_question):
+            return None
+        answer = render_direct_answer(doc.page_content)
+        if answer is None:
+            return None
+        logger.info(f"Serving direct answer from the knowledge base (distance: {score}).")
+        request["direct_answer"] = True
+        request["route"] = "direct"
+        with self._direct_answer_lock:
+            self._direct_answer_stats["served"] += 1
+        request["direct_answer_context"] = kb_context
+        return answer
+
+    def _start_background_rewrite(self, query: str, request: dict):
+        """Called once the direct answer is cached, so the rewritten answer replaces it rather than the reverse."""
+        if not (DIRECT_ANSWER_BACKGROUND_REWRITE and self.answer_cache and request.get("direct_answer")):
+            return
+        key = normalize_query(query)
+        with self._direct_answer_lock:
+            if key in self._rewrites_in_flight:
+                return
+            self._rewrites_in_flight.add(key)
+            self._direct_answer_stats["rewrites_started"] += 1
+            if self._rewrite_executor is None:
+                self._rewrite_executor = ThreadPoolExecutor(max_workers=DIRECT_ANSWER_REWRITE_WORKERS, thread_name_prefix="direct-rewrite")
+        self._rewrite_executor.submit(self._background_rewrite, query, key, request["direct_answer_context"], request["query_vector"])
+
+    def _background_rewrite(self, query: str, key: str, kb_context: str, query_vector):
+        """Generates the usual RAG answer for a directly answered query and caches it."""
+        try:
+            answer = self.rag_chain.invoke({"context": kb_context, "question": query})
+            is_safe, answer = check_output_guardrails(answer)
+            if is_safe:
+                self.answer_cache.put(query, answer, query_vector)
+                with self._direct_answer_lock:
+                    self._direct_answer_stats["rewrites_cached"] += 1
+        except Exception as e:
+            logger.warning(f"Background rewrite failed for '{query}': {e}")
+            with self._direct_answer_lock:
+                self._direct_answer_stats["rewrite_errors"] += 1
+        finally:
+            with self._direct_answer_lock:
+                self._rewrites_in_flight.discard(key)
+
+    def get_direct_answer_stats(self) -> dict:
+        with self._direct_answer_lock:
+            return dict(self._direct_answer_stats)
+
+    def _record_prompt_tokens(self, route: str, inputs: dict, request: dict = None):
+        """Estimated prompt size of a KB/web generation call, reported per request and counted per route."""
+        template = {"kb": self.rag_prompt_template, "web": self.web_search_prompt_template}.get(route)
+        if request is None or template is None:
+            return
+        tokens = estimate_tokens(template.format(**inputs))
+        request["timings"]["prompt_tokens"] = tokens
+        current_span().set(prompt_tokens_estimate=tokens)
+        count("prompt_tokens", tokens, route=route)
+
+    def _invoke_chain(self, route: str, chain, inputs: dict, request: dict = None) -> str:
+        with span("generation", route=route):
+            self._record_prompt_tokens(route, inputs, request)
+            return chain.invoke(inputs)
+
+    async def _ainvoke_chain(self, route: str, chain, inputs: dict, request: dict = None) -> str:
+        with span("generation", route=route):
+            self._record_prompt_tokens(route, inputs, request)
+            return await chain.ainvoke(inputs)
+
+    def _no_answer_response(self, query: str) -> str:
+        """The polite no-answer reply, or a static one when the LLM is failing (e.g. its circuit is open)."""
+        try:
+            return self._invoke_chain("no_answer", self.no_answer_chain, {"question": query})
+        except Exception as e:
+            logger.error(f"Error invoking no-answer chain: {e}")
+            return NO_ANSWER_FALLBACK_MESSAGE
+
+    async def _ano_answer_response(self, query: str) -> str:
+        try:
+            return await self._ainvoke_chain("no_answer", self.no_answer_chain, {"question": query})
+        except Exception as e:
+            logger.error(f"Error invoking no-answer chain: {e}")
+            return NO_ANSWER_FALLBACK_MESSAGE
+
+    @staticmethod
+    def _record_route(request: dict, route: str, query_span=None):
+        """Tags the query span (by default the current span) with the path taken and counts it."""
+        request["route"] = route
+        score = request.get("kb_best_score")
+        (query_span or current_span()).set(route=route, kb_best_score=float(score) if score is not None else None)
+        count("queries", route=route)
+
+    @traced("query", mode="sync")
+    def process_query(self, query: str) -> str:
+        """Processes the user query through the agent workflow."""
+        logger.info(f"Processing query: {query}")
+        request = {"timings": {}, "query_vector": None}
+
+        # 0. Local Solver - arithmetic and simple equations need no model call at all
+        solved_response = self._solve_locally(query)
+        if solved_response is not None:
+            self._record_route(request, "solver")
+            return solved_response
+
+        # 0. Answer Cache (exact tier) - repeat questions skip guardrail, retrieval and generation calls
+        cached_response = self._answer_from_exact_cache(query)
+        if cached_response is not None:
+            self._record_route(request, "cache")
+            return cached_response
+
+        # 1. Input Guardrails
+        guardrail_message = self._check_input(query)
+        if guardrail_message is not None:
+            self._record_route(request, "guardrail")
+            return guardrail_message
+
+        # 1. Answer Cache (semantic tier) - near-duplicates of answered questions skip retrieval and generation
+        cached_response = self._answer_from_semantic_cache(query, request)
+        if cached_response is not None:
+            self._record_route(request, "cache")
+            return cached_response
 
         # 2. Knowledge Base Retrieval
-        retrieved_docs = []
-        if self.retriever:
-            try:
-                # Use similarity search with score to apply threshold
-                docs_with_scores = self.vector_store.similarity_search_with_score(query, k=1)
-                if docs_with_scores:
-                    best_doc, score = docs_with_scores[0]
-                    # Log the score regardless of threshold
-                    logger.info(f"Best KB match score: {score} (Threshold: {SIMILARITY_THRESHOLD})")
-                    if score < SIMILARITY_THRESHOLD: # FAISS uses L2 distance, lower is better
-                        retrieved_docs.append(best_doc)
-                        logger.info("Found relevant document in Knowledge Base (below threshold).")
-                        # Re-retrieve top k for context if needed, or just use the best one
-                        full_context_docs = self.retriever.invoke(query)
-                        formatted_context = self._format_docs(full_context_docs)
-                        # Use RAG chain
-                        try: # Add try-except around RAG chain invocation
-                            response = self.rag_chain.invoke({"context": formatted_context, "question": query})
-                            final_response = response
-                        except Exception as e_rag:
-                            logger.error(f"Error invoking RAG chain: {e_rag}", exc_info=True)
-                            # Fallback if RAG chain fails
-                            final_response = "Sorry, I found relevant information but encountered an error processing it."
-                            # Optionally proceed to web search here as another fallback
-                            retrieved_docs = [] # Clear retrieved docs to trigger web search if desired
-
-                    else:
-                        logger.info("KB documents found but score was above similarity threshold.")
-                else:
-                    logger.info("No relevant documents found in Knowledge Base.")
-            except Exception as e:
-                logger.error(f"Error during KB retrieval: {e}")
-                # Decide whether to proceed to web search or return error
+        kb_context = self._retrieve_kb_context(query, request)
+        return self._generate_answer(query, request, kb_context)
 
-        # 3. Web Search (if KB retrieval failed or wasn't confident)
-        if not retrieved_docs: # If no docs found or below threshold
-            logger.info("Proceeding to Web Search.")
-            web_context = self._fetch_and_extract_web_content(query)
+    def _generate_answer(self, query: str, request: dict, kb_context) -> str:
+        """Generates the answer from KB context (or falls back to web search / no-answer) and applies output guardrails."""
+        final_response = "Sorry, I encountered an issue and couldn't process your request."
+        is_cacheable = False # Only answers generated from KB or web context are cached
+
+        direct_response = self._direct_answer(query, request, kb_context) if kb_context is not None else None
+        if direct_response is not None:
+            return self._finalize_response(query, request, direct_response, is_cacheable=True)
+
+        if kb_context is not None:
+            # Use RAG chain
+            try: # Add try-except around RAG chain invocation
+                final_response = self._invoke_chain("kb", self.rag_chain, {"context": kb_context, "question": query}, request)
+                is_cacheable = True
+                request["route"] = "kb"
+            except Exception as e_rag:
+                logger.error(f"Error invoking RAG chain: {e_rag}", exc_info=True)
+                # Fallback if RAG chain fails
+                final_response = "Sorry, I found relevant information but encountered an error processing it."
+                kb_context = None # Proceed to web search as another fallback
 
-            if "No relevant information found" in web_context or "Web search is not configured" in web_context or "An error occurred" in web_context:
+        # 3. Web Search (if KB retrieval failed or wasn't confident)
+        if kb_context is None:
+            web_context = self._get_web_context(query, request)
+            if web_context is None:
                  # If web search fails or finds nothing, use the no_answer chain
-                 logger.info("Web search failed or found no relevant info. Using no_answer chain.")
-                 final_response = self.no_answer_chain.invoke({"question": query})
+                 final_response = self._no_answer_response(query)
+                 request["route"] = "no_answer"
             else:
                 # Use Web chain
-                logger.info("Found relevant info via web search. Generating response.")
                 try:
-                    response = self.web_chain.invoke({"context": web_context, "question": query})
-                    final_response = response
+                    final_response = self._invoke_chain("web", self.web_chain, {"context": web_context, "question": query}, request)
+                    is_cacheable = True
+                    request["route"] = "web"
                 except Exception as e:
                     logger.error(f"Error invoking web chain: {e}")
-                    final_response = self.no_answer_chain.invoke({"question": query}) # Fallback
-
+                    final_response = self._no_answer_response(query) # Fallback
+                    request["route"] = "no_answer"
 
         # 4. Output Guardrails
+        return self._finalize_response(query, request, final_response, is_cacheable)
+
+    def _finalize_response(self, query: str, request: dict, final_response: str, is_cacheable: bool) -> str:
+        """Runs the output guardrails and caches answers that passed them."""
+        self._record_route(request, request.get("route", "error"))
         is_safe, final_response = check_output_guardrails(final_response)
         if not is_safe:
              logger.error("Output guardrail failed.")
              # Return the safe message from the guardrail itself
+        elif is_cacheable and self.answer_cache:
+            self.answer_cache.put(query, final_response, request["query_vector"])
+            self._start_background_rewrite(query, request)
 
+        logger.info(f"Request timings: {request['timings']}")
         logger.info(f"Final response generated.")
         return final_response
 
+    @staticmethod
+    def _cancel_task(task):
+        """Cancels a speculative branch that is no longer needed (its worker thread finishes in the background)."""
+        if task is not None and not task.done():
+            task.cancel()
+        if task is not None:
+            # Retrieve the outcome so abandoned branches never log "exception was never retrieved"
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    @staticmethod
+    async def _to_thread(request: dict, func, *args):
+        """asyncio.to_thread that records when the worker thread finishes, so a cancelled query can wait for it."""
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+        request.setdefault("threads", []).append(finished)
+
+        def run():
+            try:
+                return func(*args)
+            finally:
+                loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(None))
+        return await asyncio.to_thread(run)
+
+    @traced("query", mode="async")
+    async def aprocess_query(self, query: str) -> str:
+        """
+        Async variant of process_query with the same decisions and answers.
+        The input guardrail check and KB retrieval run concurrently, and the web search is started
+        speculatively as soon as the KB score shows it will (or may, within SPECULATIVE_WEB_MARGIN) be needed.
+        Branches that turn out not to be needed are cancelled.
+        Cancelling the call (e.g. at a request deadline) starts no further stage, and only completes once the
+        stages already running in worker threads have returned, so callers can account for the work until it ends.
+        """
+        logger.info(f"Processing query (async): {query}")
+        request = {"timings": {}, "query_vector": None}
+        try:
+            return await self._aprocess_query(query, request)
+        except asyncio.CancelledError:
+            running = [finished for finished in request.get("threads", []) if not finished.done()]
+            if running:
+                logger.info(f"Query cancelled; waiting for {len(running)} running stage(s) to return.")
+                await asyncio.shield(asyncio.wait(running))
+            raise
+
+    async def _aprocess_query(self, query: str, request: dict) -> str:
+        # 0. Local Solver
+        solved_response = self._solve_locally(query)
+        if solved_response is not None:
+            self._record_route(request, "solver")
+            return solved_response
+
+        # 0. Answer Cache (exact tier; the semantic tier runs once the input guardrails passed)
+        cached_response = self._answer_from_exact_cache(query)
+        if cached_response is not None:
+            self._record_route(request, "cache")
+            return cached_response
+
+        # 1 + 2. Input Guardrails and Knowledge Base Retrieval in parallel
+        input_task = asyncio.create_task(self._to_thread(request, self._check_input, query))
+        kb_task = asyncio.create_task(self._to_thread(request, self._retrieve_kb_context, query, request))
+        web_task = None
+        try:
+            # A guardrail rejection that arrives first ends the request without waiting for the KB
+            await asyncio.wait({input_task, kb_task}, return_when=asyncio.FIRST_COMPLETED)
+            if input_task.done() and input_task.result() is not None:
+                self._record_route(request, "guardrail")
+                return input_task.result()
+
+            kb_context = await kb_task
+            best_score = request.get("kb_best_score")
+            # Start the web search while the guardrail (and possibly RAG generation) is still running
+            if kb_context is None or (best_score is not None and best_score >= SIMILARITY_THRESHOLD - SPECULATIVE_WEB_MARGIN):
+                logger.info(f"Starting web search speculatively (KB score: {best_score}).")
+                web_task = asyncio.create_task(self._to_thread(request, self._get_web_context, query, request))
+
+            guardrail_message = await input_task
+            if guardrail_message is not None:
+                self._record_route(request, "guardrail")
+                return guardrail_message
+
+            # The KB search already embedded the query, so this is a local lookup
+            cached_response = await self._to_thread(request, self._answer_from_semantic_cache, query, request)
+            if cached_response is not None:
+                self._record_route(request, "cache")
+                return cached_response
+
+            final_response = "Sorry, I encountered an issue and couldn't process your request."
+            is_cacheable = False
+
+            direct_response = self._direct_answer(query, request, kb_context) if kb_context is not None else None
+            if direct_response is not None:
+                return self._finalize_response(query, request, direct_response, is_cacheable=True)
+
+            if kb_context is not None:
+                try:
+                    final_response = await self._ainvoke_chain("kb", self.rag_chain, {"context": kb_context, "question": query}, request)
+                    is_cacheable = True
+                    request["route"] = "kb"
+                except Exception as e_rag:
+                    logger.error(f"Error invoking RAG chain: {e_rag}", exc_info=True)
+                    final_response = "Sorry, I found relevant information but encountered an error processing it."
+                    kb_context = None # Proceed to web search as another fallback
+
+            if kb_context is None:
+                web_context = await web_task if web_task else await self._to_thread(request, self._get_web_context, query, request)
+                web_task = None
+                if web_context is None:
+                    final_response = await self._ano_answer_response(query)
+                    request["route"] = "no_answer"
+                else:
+                    try:
+                        final_response = await self._ainvoke_chain("web", self.web_chain, {"context": web_context, "question": query}, request)
+                        is_cacheable = True
+                        request["route"] = "web"
+                    except Exception as e:
+                        logger.error(f"Error invoking web chain: {e}")
+                        final_response = await self._ano_answer_response(query) # Fallback
+                        request["route"] = "no_answer"
+        finally:
+            # Cancel whichever branches turned out not to be needed
+            for task in (input_task, kb_task, web_task):
+                self._cancel_task(task)
+
+        return self._finalize_response(query, request, final_response, is_cacheable)
+
+    def _embed_queries(self, queries: list[str]):
+        """Embeds many queries in one batched call. Returns None if embeddings are unavailable."""
+        embeddings = self.vector_store.embedding_function
+        try:
+            if isinstance(embeddings, CachedEmbeddings):
+                return embeddings.embed_queries(queries)
+            return [embeddings.embed_query(query) for query in queries]
+        except Exception as e:
+            logger.error(f"Batched query embedding failed: {e}")
+            return None
+
+    @traced("batch")
+    def process_batch(self, queries: list[str], max_concurrency: int = BATCH_MAX_CONCURRENCY, stats: dict = None,
+                      cancel: threading.Event = None) -> list[str]:
+        """
+        Answers many queries with the same decisions as process_query, batching the shared stages:
+        one embedding call and one FAISS search for all queries, guardrail LLM checks for many queries per call,
+        and generation (plus any web fallback) with at most `max_concurrency` requests in flight.
+        If `stats` is given it is filled with per-stage seconds and counters.
+        Once `cancel` is set no further stage or generation starts, and BatchCancelled is raised as soon as
+        the calls already in flight have returned.
+        """
+        def check_cancelled():
+            if cancel is not None and cancel.is_set():
+                raise BatchCancelled(f"Batch of {len(queries)} queries cancelled.")
+
+        stats = stats if stats is not None else {}
+        for key in ("cache_s", "embedding_s", "guardrails_s", "kb_search_s", "generation_s"):
+            stats.setdefault(key, 0.0)
+        batch_start = time.perf_counter()
+        answers = [None] * len(queries)
+        requests_by_index = {}
+
+        # Identical (normalized) queries in one batch are answered once
+        first_index = {}
+        duplicates = {}
+        for i, query in enumerate(queries):
+            key = normalize_query(query)
+            if key in first_index:
+                duplicates[i] = first_index[key]
+            else:
+                first_index[key] = i
+        pending = sorted(first_index.values())
+
+        # 0. Local Solver
+        solved = set()
+        if LOCAL_SOLVER_ENABLED:
+            stage_start = time.perf_counter()
+            still_pending = []
+            for i in pending:
+                answers[i] = solve_locally(queries[i])
+                if answers[i] is None:
+                    still_pending.append(i)
+                else:
+                    solved.add(i)
+            stats["solver_hits"] = stats.get("solver_hits", 0) + len(solved)
+            pending = still_pending
+            stats["solver_s"] = stats.get("solver_s", 0.0) + time.perf_counter() - stage_start
+
+        # 0. Answer Cache (exact tier)
+        stage_start = time.perf_counter()
+        cache_hits = 0
+        if self.answer_cache:
+            still_pending = []
+            for i in pending:
+                cached_response = self.answer_cache.get_exact(queries[i])
+                if cached_response is not None:
+                    answers[i] = cached_response
+                    cache_hits += 1
+                else:
+                    still_pending.append(i)
+            pending = still_pending
+        stats["cache_s"] += time.perf_counter() - stage_start
+
+        for i in pending:
+            requests_by_index[i] = {"timings": {}, "query_vector": None}
+
+        check_cancelled()
+        # Local BM25 lookups; lexically decisive queries need no embedding
+        lexical_decisive = set()
+        if self._lexical_index():
+            stage_start = time.perf_counter()
+            lexical_decisive = {i for i in pending if self._is_lexically_decisive(queries[i], requests_by_index[i])}
+            stats["lexical_s"] = stats.get("lexical_s", 0.0) + time.perf_counter() - stage_start
+            stats["lexical_decisive"] = stats.get("lexical_decisive", 0) + len(lexical_decisive)
+
+        # Batched query embeddings, shared by the semantic cache tier and the KB search
+        to_embed = [i for i in pending if i not in lexical_decisive]
+        if to_embed and self.vector_store:
+            stage_start = time.perf_counter()
+            vectors = self._embed_queries([queries[i] for i in to_embed])
+            if vectors is not None:
+                for i, vector in zip(to_embed, vectors):
+                    requests_by_index[i]["query_vector"] = vector
+            stats["embedding_s"] += time.perf_counter() - stage_start
+
+        check_cancelled()
+        # 1. Input Guardrails (local classifier first, many ambiguous queries per LLM call)
+        stage_start = time.perf_counter()
+        guardrail_results = check_input_guardrails_batch([queries[i] for i in pending], llm_batch_size=BATCH_GUARDRAIL_LLM_SIZE)
+        still_pending = []
+        for i, (is_safe, message) in zip(pending, guardrail_results):
+            guardrail_message = self._guardrail_outcome(queries[i], is_safe, message)
+            if guardrail_message is not None:
+                answers[i] = guardrail_message
+            else:
+                still_pending.append(i)
+        stats["guardrail_rejections"] = stats.get("guardrail_rejections", 0) + len(pending) - len(still_pending)
+        pending = still_pending
+        stats["guardrails_s"] += time.perf_counter() - stage_start
+
+        # 1. Answer Cache (semantic tier), only for queries the input guardrails let through
+        if self.answer_cache:
+            stage_start = time.perf_counter()
+            still_pending = []
+            for i in pending:
+                cached_response = None
+                if not contains_sensitive_keywords(queries[i]) and i not in lexical_decisive:
+                    cached_response = self.answer_cache.get_semantic(requests_by_index[i]["query_vector"], queries[i])
+                if cached_response is not None:
+                    answers[i] = cached_response
+                    cache_hits += 1
+                else:
+                    self.answer_cache.record_miss()
+                    still_pending.append(i)
+            pending = still_pending
+            stats["cache_s"] += time.perf_counter() - stage_start
+        stats["cache_hits"] = stats.get("cache_hits", 0) + cache_hits
+
+        check_cancelled()
+        # 2. Knowledge Base Retrieval (lexical matches directly, the rest with one multi-query FAISS search)
+        kb_contexts = {i: None for i in pending}
+        for i in pending:
+            if i in lexical_decisive:
+                kb_contexts[i] = self._lexical_context(requests_by_index[i])
+        searchable = [i for i in pending if requests_by_index[i]["query_vector"] is not None]
+        if searchable:
+            stage_start = time.perf_counter()
+            try:
+                results = batch_similarity_search_with_score(self.vector_store, [requests_by_index[i]["query_vector"] for i in searchable],
+                                                             k=self._vector_candidates(), queries=[queries[i] for i in searchable])
+                for i, docs_with_scores in zip(searchable, results):
+                    kb_contexts[i] = self._select_kb_context(docs_with_scores, requests_by_index[i])
+            except Exception as e:
+                logger.error(f"Error during batched KB retrieval: {e}")
+            stats["kb_search_s"] += time.perf_counter() - stage_start
+        stats["kb_hits"] = stats.get("kb_hits", 0) + sum(1 for context in kb_contexts.values() if context is not None)
+
+        check_cancelled()
+        # 3 + 4. Generation (with web fallback) and Output Guardrails, bounded concurrency
+        stage_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="batch-generate") as pool:
+            futures = {pool.submit(self._generate_batch_answer, queries[i], requests_by_index[i], kb_contexts[i], cancel): i
+                       for i in pending}
+            for future in as_completed(futures):
+                i = futures[future]
+                if cancel is not None and cancel.is_set():
+                    for other in futures:
+                        other.cancel() # Generations not started yet; the pool still waits for the running ones
+                try:
+                    answers[i] = future.result()
+                except (BatchCancelled, CancelledError):
+                    pass # The batch raises BatchCancelled below
+                except Exception as e:
+                    logger.error(f"Error generating answer for '{queries[i]}': {e}", exc_info=True)
+                    answers[i] = "Sorry, I encountered an issue and couldn't process your request."
+        stats["generation_s"] += time.perf_counter() - stage_start
+        check_cancelled()
+        stats["direct_answers"] = stats.get("direct_answers", 0) + sum(1 for i in pending if requests_by_index[i].get("direct_answer"))
+
+        for i, original in duplicates.items():
+            answers[i] = answers[original]
+        stats["queries"] = stats.get("queries", 0) + len(queries)
+        stats["total_s"] = stats.get("total_s", 0.0) + time.perf_counter() - batch_start
+        logger.info(f"Processed batch of {len(queries)} queries in {time.perf_counter() - batch_start:.2f}s.")
+        count("queries", stats.get("solver_hits", 0), route="solver")
+        count("queries", stats["cache_hits"], route="cache")
+        count("queries", stats["guardrail_rejections"], route="guardrail")
+        current_span().set(batch_size=len(queries), **{key: round(value, 4) if isinstance(value, float) else value
+                                                    for key, value in stats.items()})
+        return answers
+
+    def _generate_batch_answer(self, query: str, request: dict, kb_context, cancel: threading.Event = None) -> str:
+        if cancel is not None and cancel.is_set():
+            raise BatchCancelled(query)
+        # Batch workers run outside the batch span's context, so each answer is traced as its own query
+        with span("query", mode="batch"):
+            return self._generate_answer(query, request, kb_context)
+
+    def _stream_chain(self, route: str, chain, inputs: dict, request: dict = None):
+        """Yields (route, chunk) pairs from a chain. Returns False only if it failed before producing any output."""
+        produced_output = False
+        try:
+            with span("generation", route=route):
+                self._record_prompt_tokens(route, inputs, request)
+                for chunk in chain.stream(inputs):
+                    produced_output = True
+                    yield route, chunk
+            return True
+        except Exception as e:
+            logger.error(f"Error streaming {route} chain: {e}", exc_info=True)
+            if produced_output:
+                yield "error", "\n\nSorry, I encountered an error while generating the rest of this answer."
+            return produced_output
+
+    def _stream_generation(self, query: str, request: dict):
+        """Yields (route, chunk) pairs using the same KB -> web -> no-answer routing and fallbacks as process_query."""
+        kb_context = self._retrieve_kb_context(query, request)
+        direct_response = self._direct_answer(query, request, kb_context) if kb_context is not None else None
+        if direct_response is not None:
+            yield "direct", direct_response
+            return
+        if kb_context is not None:
+            if (yield from self._stream_chain("kb", self.rag_chain, {"context": kb_context, "question": query}, request)):
+                return
+        web_context = self._get_web_context(query, request)
+        if web_context is not None:
+            if (yield from self._stream_chain("web", self.web_chain, {"context": web_context, "question": query}, request)):
+                return
+        if not (yield from self._stream_chain("no_answer", self.no_answer_chain, {"question": query})):
+            yield "no_answer", NO_ANSWER_FALLBACK_MESSAGE
+
+    @staticmethod
+    def _record_first_token(request: dict, request_start: float, route: str):
+        if "ttft_ms" not in request["timings"]:
+            request["timings"]["ttft_ms"] = round((time.perf_counter() - request_start) * 1000, 2)
+            logger.info(f"Time to first token: {request['timings']['ttft_ms']} ms (route: {route})")
+
+    @traced("query", mode="stream")
+    def _stream_chunks(self, query: str, stream: "AnswerStream"):
+        request_start = time.perf_counter()
+        logger.info(f"Streaming query: {query}")
+        request = {"timings": {}, "query_vector": None}
+        query_span = current_span()
+
+        early_response, early_route = self._solve_locally(query), "solver"
+        if early_response is None:
+            early_response, early_route = self._answer_from_exact_cache(query), "cache"
+        if early_response is None:
+            early_response, early_route = self._check_input(query), "guardrail"
+        if early_response is None:
+            early_response, early_route = self._answer_from_semantic_cache(query, request), "cache"
+        if early_response is not None:
+            self._record_route(request, early_route)
+            stream.final_response = early_response
+            yield early_response
+            return
+
+        # Output guardrail runs over a rolling window so sensitive text is caught before it is emitted
+        output_guardrail = StreamingOutputGuardrail()
+        routes_used = set()
+        route = None
+        for route, chunk in self._stream_generation(query, request):
+            routes_used.add(route)
+            safe_text = output_guardrail.feed(chunk)
+            if output_guardrail.tripped:
+                break
+            if safe_text:
+                self._record_first_token(request, request_start, route)
+                yield safe_text
+        tail = output_guardrail.finish()
+        if tail:
+            self._record_first_token(request, request_start, route)
+            yield tail
+
+        # The query span is passed explicitly: a generation span may still be open if the guardrail stopped the stream
+        self._record_route(request, route or "error", query_span)
+        query_span.set(ttft_ms=request["timings"].get("ttft_ms"))
+        if output_guardrail.tripped:
+            logger.error("Output guardrail failed.")
+            stream.final_response = output_guardrail.message
+            stream.replaced = True
+        else:
+            _, stream.final_response = check_output_guardrails(output_guardrail.text)
+            if routes_used and routes_used <= {"kb", "web", "direct"} and self.answer_cache:
+                self.answer_cache.put(query, stream.final_response, request["query_vector"])
+                self._start_background_rewrite(query, request)
+
+        request["timings"]["total_ms"] = round((time.perf_counter() - request_start) * 1000, 2)
+        logger.info(f"Request timings: {request['timings']}")
+        logger.info(f"Final response streamed.")
+
+    def stream_query(self, query: str) -> "AnswerStream":
+        """
+        Streaming variant of process_query. Iterate the returned AnswerStream for answer text chunks;
+        once exhausted, `final_response` holds the full answer (replaced by the guardrail message if `replaced`).
+        """
+        stream = AnswerStream()
+        stream._chunks = self._stream_chunks(query, stream)
+        return stream
+
+class AnswerStream:
+    """Iterator over streamed answer chunks, filled in by MathAgent.stream_query."""
+
+    def __init__(self):
+        self._chunks = iter(())
+        self.final_response = ""
+        self.replaced = False # True if the output guardrail replaced the streamed answer
+
+    def __iter__(self):
+        return self._chunks
@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+
+# Attempt absolute imports first (for when imported as a module)
+try:
+    from utils import get_logger
+# If run directly via python -m src.ann_index, use relative imports
+except ModuleNotFoundError:
+    from .utils import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+
+def default_nlist(n: int) -> int:
+    """About 4 * sqrt(n) IVF lists, capped so every list gets ~39 training points (FAISS's minimum)."""
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+def build_index(vectors: np.ndarray, index_type: str, nlist: int = None, train_sample_size: int = 100000,
+                hnsw_m: int = 32, hnsw_ef_construction: int = 200, pq_m: int = 48, pq_nbits: int = 8,
+                refine_k_factor: int = 0, seed: int = 0):
+    """
+    Builds a FAISS index of `index_type` over `vectors` (added in row order, so row i keeps id i).
+    All types use the L2 metric, so returned scores are squared L2 distances like the flat index.
+    IVF quantizers and PQ codebooks are trained on a random sample of at most `train_sample_size` rows.
+    With `refine_k_factor`, IVF-PQ candidates are re-ranked with exact distances (stores the raw vectors too).
+    """
+    import faiss
+
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, d = vectors.shape
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m)
+        index.hnsw.efConstruction = hnsw_ef_construction
+    else:
+        nlist = nlist or default_nlist(n)
+        quantizer = faiss.IndexFlatL2(d)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        else:
+            if d % pq_m:
+                raise ValueError(f"PQ sub-quantizers ({pq_m}) must divide the embedding dimension ({d})")
+            if n < 39 * 2 ** pq_nbits:
+                # Each PQ codebook is k-means with 2^nbits centroids; fewer points give useless codes
+                raise ValueError(f"IVF-PQ needs at least {39 * 2 ** pq_nbits} vectors to train, got {n}")
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, pq_nbits)
+            if refine_k_factor:
+                index = faiss.IndexRefineFlat(index)
+                index.k_factor = refine_k_factor
+        sample = vectors
+        if n > train_sample_size:
+            sample = vectors[np.random.default_rng(seed).choice(n, train_sample_size, replace=False)]
+        index.train(sample)
+
+    index.add(vectors)
+    return index
+
+def configure_search(index, nprobe: int = None, ef_search: int = None, refine_k_factor: int = None):
+    """
+    Applies query-time parameters (they are not part of the build, so they can be tuned on a loaded index).
+    Returns `index` itself; the downcast views used here do not own the underlying FAISS object.
+    """
+    import faiss
+
+    typed = faiss.downcast_index(index)
+    if isinstance(typed, faiss.IndexRefine):
+        if refine_k_factor:
+            typed.k_factor = refine_k_factor
+        configure_search(typed.base_index, nprobe=nprobe, ef_search=ef_search)
+    elif isinstance(typed, faiss.IndexIVF):
+        if nprobe:
+            typed.nprobe = min(nprobe, typed.nlist)
+    elif isinstance(typed, faiss.IndexHNSW):
+        if ef_search:
+            typed.hnsw.efSearch = ef_search
+    return index
+
+def index_memory_bytes(index) -> int:
+    """Serialized index size, a close proxy for its in-memory footprint."""
+    import faiss
+
+    return int(faiss.serialize_index(index).size)
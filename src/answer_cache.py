@@ -0,0 +1,190 @@
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from utils import get_logger
+from direct_answer import same_numbers
+
+logger = get_logger(__name__)
+
+def normalize_query(query: str) -> str:
+    """Normalizes a query for exact-match caching (case, whitespace, trailing punctuation)."""
+    normalized = re.sub(r"\s+", " ", query.strip().lower())
+    return normalized.rstrip(" ?.!")
+
+class AnswerCache:
+    """
+    Two-tier answer cache placed in front of the agent pipeline.
+    - Exact tier: keyed on the normalized query text.
+    - Semantic tier: nearest stored query embedding within `semantic_threshold`
+      (squared L2 distance, same metric as the FAISS knowledge base) whose query has the same numbers,
+      since "20% of 360" and "30% of 360" embed almost identically but have different answers.
+    Entries are evicted LRU once `max_entries` is reached and expire after `ttl_seconds`.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 86400,
+                 semantic_threshold: float = 0.1, persist_path: Optional[str] = None, save_every: int = 20):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self.persist_path = persist_path
+        self.save_every = save_every
+
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        # Stacked embedding matrix for the semantic tier, rebuilt lazily after writes
+        self._matrix = None
+        self._matrix_keys: list[str] = []
+        self._unsaved_writes = 0
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+        if self.persist_path:
+            self.load()
+            # Writes since the last periodic save would otherwise be lost when the process exits
+            atexit.register(self.flush)
+
+    def _is_expired(self, entry: dict, now: float) -> bool:
+        return self.ttl_seconds is not None and now - entry["created"] > self.ttl_seconds
+
+    def _drop(self, key: str):
+        self._entries.pop(key, None)
+        self._matrix = None
+
+    def get_exact(self, query: str) -> Optional[str]:
+        """Returns the cached answer for an identical (normalized) query, if any."""
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry, now):
+                self._drop(key)
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._stats["exact_hits"] += 1
+            return entry["answer"]
+
+    def get_semantic(self, query_vector, query: str = None) -> Optional[str]:
+        """
+        Returns the cached answer of the closest stored query within the semantic threshold.
+        With `query`, only stored queries containing the same numbers are considered.
+        """
+        if query_vector is None:
+            return None
+        now = time.time()
+        with self._lock:
+            if self._matrix is None:
+                self._matrix_keys = [k for k, e in self._entries.items() if e.get("vector") is not None]
+                self._matrix = (np.array([self._entries[k]["vector"] for k in self._matrix_keys], dtype=np.float32)
+                                if self._matrix_keys else np.empty((0, 0), dtype=np.float32))
+            if not self._matrix_keys:
+                return None
+
+            vector = np.asarray(query_vector, dtype=np.float32)
+            if vector.shape[0] != self._matrix.shape[1]:
+                return None
+            distances = np.sum((self._matrix - vector) ** 2, axis=1)
+            candidates = [int(i) for i in np.argsort(distances, kind="stable") if distances[i] <= self.semantic_threshold]
+            if query is not None:
+                candidates = [i for i in candidates
+                              if same_numbers(query, self._entries.get(self._matrix_keys[i], {}).get("query", ""))]
+            if not candidates:
+                return None
+
+            best = candidates[0]
+            key = self._matrix_keys[best]
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._is_expired(entry, now):
+                self._drop(key)
+                self._stats["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["semantic_hits"] += 1
+            logger.info(f"Semantic cache hit (distance {distances[best]:.4f}) for cached query '{entry['query']}'")
+            return entry["answer"]
+
+    def record_miss(self):
+        with self._lock:
+            self._stats["misses"] += 1
+
+    def put(self, query: str, answer: str, query_vector=None):
+        """Stores an answer, evicting the least recently used entries beyond `max_entries`."""
+        key = normalize_query(query)
+        vector = [float(x) for x in query_vector] if query_vector is not None else None
+        with self._lock:
+            self._entries[key] = {"query": query, "answer": answer, "vector": vector, "created": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            self._matrix = None
+            self._unsaved_writes += 1
+            should_save = self.persist_path and self._unsaved_writes >= self.save_every
+        if should_save:
+            self.save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["exact_hits"] + self._stats["semantic_hits"] + self._stats["misses"]
+            hits = self._stats["exact_hits"] + self._stats["semantic_hits"]
+            return {**self._stats, "size": len(self._entries), "hit_rate": hits / lookups if lookups else 0.0}
+
+    def save(self):
+        """Writes the cache to `persist_path` atomically (JSON, no pickle)."""
+        if not self.persist_path:
+            return
+        with self._lock:
+            payload = list(self._entries.values())
+            self._unsaved_writes = 0
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, self.persist_path)
+            logger.debug(f"Saved {len(payload)} answer cache entries to {self.persist_path}")
+        except Exception as e:
+            logger.warning(f"Failed to save answer cache to {self.persist_path}: {e}")
+
+    def flush(self):
+        """Saves the cache if it has writes that are not on disk yet (periodic saves happen every `save_every` writes)."""
+        with self._lock:
+            unsaved = self._unsaved_writes
+        if unsaved:
+            self.save()
+
+    def load(self):
+        """Loads persisted entries, dropping any that have already expired."""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path) as f:
+                payload = json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load answer cache from {self.persist_path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for entry in payload:
+                if self._is_expired(entry, now):
+                    continue
+                self._entries[normalize_query(entry["query"])] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+        logger.info(f"Loaded {len(self._entries)} answer cache entries from {self.persist_path}")
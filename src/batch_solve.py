@@ -0,0 +1,103 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+# Add src directory to Python path (so this works both as `python -m src.batch_solve` and `python src/batch_solve.py`)
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from config import BATCH_SIZE, BATCH_MAX_CONCURRENCY
+from utils import get_logger
+
+logger = get_logger("batch_solve")
+
+def read_questions(path: str, field: str = "question") -> list[tuple[str, str]]:
+    """Reads (id, question) pairs from a CSV or JSONL file. Rows without an id use their row number."""
+    questions = []
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for row_number, line in enumerate(f):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                question = record.get(field) or record.get("query")
+                if question:
+                    questions.append((str(record.get("id", row_number)), str(question)))
+    else:
+        with open(path, encoding="utf-8", newline="") as f:
+            reader = csv.DictReader(f)
+            column = field if field in (reader.fieldnames or []) else (reader.fieldnames or [None])[0]
+            for row_number, row in enumerate(reader):
+                question = row.get(column)
+                if question:
+                    questions.append((str(row.get("id") or row_number), question))
+    return questions
+
+def read_completed_ids(output_path: str) -> set[str]:
+    """Returns ids already written to the output file, so an interrupted run can resume."""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                completed.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue # Ignore a partially written last line from a crash
+    return completed
+
+def run(input_path: str, output_path: str, batch_size: int, max_concurrency: int, field: str, limit: int = None):
+    from agent import MathAgent
+
+    questions = read_questions(input_path, field)
+    if limit:
+        questions = questions[:limit]
+    completed = read_completed_ids(output_path)
+    todo = [(qid, question) for qid, question in questions if qid not in completed]
+    logger.info(f"{len(questions)} questions in {input_path}, {len(completed)} already answered, {len(todo)} to go.")
+    if not todo:
+        return
+
+    agent = MathAgent()
+    stats = {}
+    start = time.perf_counter()
+    done = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        for batch_start in range(0, len(todo), batch_size):
+            batch = todo[batch_start:batch_start + batch_size]
+            answers = agent.process_batch([question for _, question in batch], max_concurrency=max_concurrency, stats=stats)
+            for (qid, question), answer in zip(batch, answers):
+                out.write(json.dumps({"id": qid, "question": question, "answer": answer}) + "\n")
+            # Make each finished batch durable before starting the next one
+            out.flush()
+            os.fsync(out.fileno())
+
+            done += len(batch)
+            elapsed = time.perf_counter() - start
+            rate = done / elapsed if elapsed else 0.0
+            eta = (len(todo) - done) / rate if rate else 0.0
+            logger.info(f"Progress: {done}/{len(todo)} ({rate:.2f} queries/s, ETA {eta:.0f}s)")
+
+    elapsed = time.perf_counter() - start
+    report = {
+        "queries": done,
+        "elapsed_s": round(elapsed, 2),
+        "queries_per_s": round(done / elapsed, 3) if elapsed else None,
+        "stage_s": {key: round(value, 3) for key, value in stats.items() if key.endswith("_s")},
+        "counters": {key: value for key, value in stats.items() if not key.endswith("_s")},
+    }
+    logger.info(f"Throughput report: {json.dumps(report)}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a CSV/JSONL file of questions with MathAgent and write JSONL answers.")
+    parser.add_argument("input", help="CSV (with a header row) or JSONL file of questions")
+    parser.add_argument("-o", "--output", default="answers.jsonl", help="JSONL output file (appended to; existing ids are skipped)")
+    parser.add_argument("--field", default="question", help="CSV column / JSON field holding the question")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=BATCH_MAX_CONCURRENCY, help="Generation requests in flight at once")
+    parser.add_argument("--limit", type=int, default=None, help="Only process the first N questions")
+    args = parser.parse_args()
+    run(args.input, args.output, args.batch_size, args.concurrency, args.field, args.limit)
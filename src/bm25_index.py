@@ -0,0 +1,174 @@
+import math
+import os
+import re
+from typing import Iterable, Optional
+
+import numpy as np
+
+# Attempt absolute imports first (for when imported as a module)
+try:
+    from utils import get_logger
+# If run directly via python -m src.bm25_index, use relative imports
+except ModuleNotFoundError:
+    from .utils import get_logger
+
+logger = get_logger(__name__)
+
+BM25_FILENAME = "bm25.npz"
+
+# Numbers (with decimals) and words are terms, and so is every single symbol ("%", "=", "?", "^", "/"),
+# because exact numbers and operators are what identify most JEE questions.
+_TOKEN_PATTERN = re.compile(r"\d+(?:\.\d+)?|[a-z]+|[^\sa-z\d]")
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """
+    Okapi BM25 over the knowledge base questions, stored as a compressed-sparse inverted index:
+    for each term a slice of (document, precomputed BM25 term weight) postings, sorted by document.
+    Documents are identified by their vector store docstore id, so results can be fused with vector search.
+    """
+
+    def __init__(self, vocab: np.ndarray, offsets: np.ndarray, postings_docs: np.ndarray, postings_weights: np.ndarray,
+                 idf: np.ndarray, doc_ids: np.ndarray, doc_idf_mass: np.ndarray):
+        self.vocab = vocab
+        self.term_index = {term: i for i, term in enumerate(vocab.tolist())}
+        self.offsets = offsets
+        self.postings_docs = postings_docs
+        self.postings_weights = postings_weights
+        self.idf = idf
+        self.doc_ids = doc_ids
+        self.doc_idf_mass = doc_idf_mass # Sum of idf over each document's distinct terms
+        self.max_idf = float(idf.max()) if len(idf) else 0.0
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, documents: Iterable[tuple[str, str]], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        """Builds the index from (docstore id, question text) pairs."""
+        doc_ids, doc_lengths, doc_terms = [], [], []
+        postings: dict[str, list[tuple[int, int]]] = {}
+        for doc_index, (doc_id, text) in enumerate(documents):
+            tokens = tokenize(text)
+            counts: dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_index, tf))
+            doc_ids.append(doc_id)
+            doc_lengths.append(len(tokens))
+            doc_terms.append(list(counts))
+
+        n = len(doc_ids)
+        lengths = np.array(doc_lengths, dtype=np.float32)
+        avg_length = float(lengths.mean()) if n else 0.0
+        vocab = sorted(postings)
+        idf = np.array([math.log(1.0 + (n - len(postings[t]) + 0.5) / (len(postings[t]) + 0.5)) for t in vocab], dtype=np.float32)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[t]) for t in vocab])
+        postings_docs = np.empty(offsets[-1], dtype=np.int32)
+        postings_weights = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(vocab):
+            docs, tfs = zip(*postings[term])
+            docs, tfs = np.array(docs, dtype=np.int32), np.array(tfs, dtype=np.float32)
+            norm = k1 * (1.0 - b + b * lengths[docs] / max(avg_length, 1e-9))
+            postings_docs[offsets[i]:offsets[i + 1]] = docs
+            postings_weights[offsets[i]:offsets[i + 1]] = idf[i] * tfs * (k1 + 1.0) / (tfs + norm)
+
+        term_idf = dict(zip(vocab, idf.tolist()))
+        doc_idf_mass = np.array([sum(term_idf[t] for t in terms) for terms in doc_terms], dtype=np.float32)
+        return cls(np.array(vocab, dtype=str), offsets, postings_docs, postings_weights, idf,
+                   np.array(doc_ids, dtype=str), doc_idf_mass)
+
+    def _postings(self, term_index: int):
+        start, end = self.offsets[term_index], self.offsets[term_index + 1]
+        return self.postings_docs[start:end], self.postings_weights[start:end]
+
+    def search(self, query: str, k: int = 10) -> list[tuple[int, float]]:
+        """Returns up to k (document index, BM25 score) pairs, best first. Documents with no matching term are left out."""
+        terms = [self.term_index[t] for t in set(tokenize(query)) if t in self.term_index]
+        if not terms or not len(self):
+            return []
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term_index in terms:
+            docs, weights = self._postings(term_index)
+            scores[docs] += weights # Postings hold each document at most once per term
+        k = min(k, len(self))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def coverage(self, query: str, doc_index: int) -> tuple[float, float]:
+        """
+        idf-weighted overlap between the query and a document: (share of the query's terms found in the
+        document, share of the document's terms found in the query). Terms unknown to the index count
+        against the query with the highest idf.
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms:
+            return 0.0, 0.0
+        query_mass = matched_mass = 0.0
+        for term in query_terms:
+            term_index = self.term_index.get(term)
+            if term_index is None:
+                query_mass += self.max_idf
+                continue
+            term_idf = float(self.idf[term_index])
+            query_mass += term_idf
+            docs, _ = self._postings(term_index)
+            position = np.searchsorted(docs, doc_index)
+            if position < len(docs) and docs[position] == doc_index:
+                matched_mass += term_idf
+        doc_mass = float(self.doc_idf_mass[doc_index])
+        return matched_mass / query_mass if query_mass else 0.0, matched_mass / doc_mass if doc_mass else 0.0
+
+    def is_decisive(self, query: str, hits: list[tuple[int, float]], min_query_coverage: float,
+                    min_doc_coverage: float, min_margin: float) -> bool:
+        """
+        True if the top hit alone explains the query: it covers enough of the query's terms (and the query enough
+        of its terms), with a coverage lead over the runner-up (near-duplicate questions differ only in numbers).
+        """
+        if not hits:
+            return False
+        query_coverage, doc_coverage = self.coverage(query, hits[0][0])
+        runner_up = min(self.coverage(query, hits[1][0])) if len(hits) > 1 else 0.0
+        return (query_coverage >= min_query_coverage and doc_coverage >= min_doc_coverage
+                and min(query_coverage, doc_coverage) - runner_up >= min_margin)
+
+    def save(self, path: str):
+        """Saves the index as a compressed .npz (no pickle)."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(f, vocab=self.vocab, offsets=self.offsets, postings_docs=self.postings_docs,
+                                postings_weights=self.postings_weights, idf=self.idf, doc_ids=self.doc_ids, doc_idf_mass=self.doc_idf_mass)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["vocab"], data["offsets"], data["postings_docs"], data["postings_weights"],
+                       data["idf"], data["doc_ids"], data["doc_idf_mass"])
+
+def reciprocal_rank_fusion(rankings: list[list[str]], rrf_k: int = 60) -> list[str]:
+    """Fuses ranked lists of keys: each key scores sum(1 / (rrf_k + rank)) over the lists it appears in (rank from 1)."""
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def load_bm25_index(index_dir: str) -> Optional[BM25Index]:
+    """Loads the BM25 index stored alongside a vector index, or returns None if it is missing or unreadable."""
+    path = os.path.join(index_dir, BM25_FILENAME)
+    if not os.path.exists(path):
+        logger.warning(f"BM25 index not found at {path}. Retrieval will be vector-only "
+                       "(run `python -m src.vector_store --incremental` to build it).")
+        return None
+    try:
+        index = BM25Index.load(path)
+        logger.info(f"Loaded BM25 index ({len(index)} questions) from {path}")
+        return index
+    except Exception as e:
+        logger.warning(f"Failed to load BM25 index from {path}: {e}. Retrieval will be vector-only.")
+        return None
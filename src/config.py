@@ -12,14 +12,159 @@ EMBEDDING_MODEL_NAME = "models/text-embedding-004" # Or another suitable embeddi
 
 # Vector Store configuration
 VECTOR_STORE_PATH = "faiss_index_jee_math"
+# "faiss": index.faiss + pickled docstore (FAISS.load_local). "mmap": memory-mapped vectors + SQLite docstore,
+# no unpickling at startup and shared pages across worker processes (python -m src.vector_store --convert-mmap)
+VECTOR_STORE_FORMAT = "faiss"
+MMAP_INDEX_PATH = "faiss_index_jee_math_mmap"
+# Search index built over the flat FAISS index at the end of every build (python -m src.vector_store --build-ann).
+# All types use L2, so scores stay squared L2 distances and SIMILARITY_THRESHOLD keeps its meaning
+# (IVF-PQ distances are approximate unless PQ_REFINE_K_FACTOR re-ranks them exactly). Not used by the mmap format.
+VECTOR_INDEX_TYPE = "flat" # "flat" (exact), "ivf_flat", "hnsw" or "ivf_pq"
+ANN_TRAIN_SAMPLE_SIZE = 100000 # Vectors sampled to train IVF centroids / PQ codebooks
+IVF_NLIST = None # IVF lists; None = about 4 * sqrt(corpus size)
+IVF_NPROBE = 16 # Lists scanned per query (recall vs latency)
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128 # Candidate list size per query (recall vs latency)
+PQ_M = 48 # Sub-quantizers per vector (must divide the embedding dimension)
+PQ_NBITS = 8
+PQ_REFINE_K_FACTOR = 4 # Re-rank k * factor PQ candidates with exact L2 (0 = off, smaller but approximate scores)
 CSV_PATH = "data/jee_math.csv"
+CSV_CHUNK_ROWS = 10000 # Rows read per chunk when streaming the CSV into the index
+# Incremental builds (python -m src.vector_store --incremental)
+EMBED_BATCH_SIZE = 100 # Rows embedded (and checkpointed) per batch
+EMBED_MAX_RETRIES = 5
+EMBED_RETRY_BASE_DELAY_SECONDS = 1.0 # Jittered exponential backoff between retries
+VECTOR_STORE_AUTO_UPDATE = False # Incrementally update a stale index on load instead of only warning
 
 # Agent configuration
 # Increased threshold - FAISS L2 distance, lower is better.
 # Higher value here means we accept less similar results from KB.
 SIMILARITY_THRESHOLD = 1.0 # Increased from 0.75, adjust further if needed (e.g., 1.2)
 MAX_WEB_RESULTS = 3
+# Web fetching: pages are fetched concurrently; the whole web stage (search + fetch) has one wall-clock deadline
+WEB_STAGE_DEADLINE_SECONDS = 6.0
+WEB_FETCH_TIMEOUT_SECONDS = 5.0 # Per-page connect/read timeout
+WEB_FETCH_MAX_WORKERS = 8
+WEB_FETCH_POOL_MAXSIZE = 4 # Keep-alive connections per host
+WEB_CONTENT_MAX_CHARS = 1500 # Extracted text kept per source
+WEB_FETCH_MAX_BYTES = 512 * 1024 # Page bytes read at most; non-HTML responses are skipped before the body is read
+# Persistent web cache (SQLite, shared across sessions/processes): search query -> results, URL -> extracted text
+WEB_CACHE_ENABLED = True
+WEB_CACHE_PATH = "web_cache.sqlite3"
+WEB_SEARCH_CACHE_TTL_SECONDS = 24 * 60 * 60
+WEB_PAGE_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60 # Stale pages are revalidated with ETag/Last-Modified
+WEB_CACHE_MAX_ENTRIES = 5000 # Per table, least recently used rows are evicted first
+# Async pipeline: start the web search speculatively when the best KB distance is within this margin below
+# SIMILARITY_THRESHOLD (above the threshold the web search is always started early)
+SPECULATIVE_WEB_MARGIN = 0.15
+KB_TOP_K = 3 # Documents retrieved from the knowledge base as RAG context (single FAISS search)
+# Context packing: what goes into the RAG/web prompts is deduplicated and cut to a token budget (~4 chars per token).
+# Web pages are split into passages ranked against the query (BM25 over the passages); KB documents are kept whole,
+# in retrieval order, and vector matches above SIMILARITY_THRESHOLD (other than the best) are left out.
+CONTEXT_PACKING_ENABLED = True
+CONTEXT_KB_TOKEN_BUDGET = 600
+CONTEXT_WEB_TOKEN_BUDGET = 600
+CONTEXT_PASSAGE_MAX_CHARS = 400
+CONTEXT_DEDUP_SIMILARITY = 0.8 # Term-set Jaccard above which a passage counts as a duplicate of a kept one
+# Also rank web passages by embedding similarity to the query: one extra embedding call per web answer (counts
+# against the embedding quota), made only when the passages do not all fit the budget. Off: BM25 only, fully local
+CONTEXT_SEMANTIC_RANKING = False
+# Hybrid retrieval: a local BM25 index over the KB questions, fused with vector results by reciprocal-rank fusion
+HYBRID_RETRIEVAL_ENABLED = True
+HYBRID_CANDIDATES = 10 # Candidates taken from each retriever before fusion
+RRF_K = 60 # Reciprocal-rank fusion constant: score = sum(1 / (RRF_K + rank))
+# A lexical match is decisive (KB answer without any embedding call) when the top question covers this share of the
+# query's idf-weighted terms, the query covers BM25_DECISIVE_DOC_COVERAGE of the question's, and it beats the runner-up
+BM25_DECISIVE_QUERY_COVERAGE = 0.9
+BM25_DECISIVE_DOC_COVERAGE = 0.7
+BM25_DECISIVE_MARGIN = 0.1 # Minimum coverage lead over the runner-up question
+# Direct answers: a near-exact KB match returns the stored solution (cleaned up) without any LLM call.
+# Applies when the query is the stored question verbatim (after normalization) or within DIRECT_ANSWER_MAX_DISTANCE
+# of it, and in both cases only if the query contains exactly the same numbers.
+DIRECT_ANSWER_ENABLED = True
+DIRECT_ANSWER_MAX_DISTANCE = 0.05 # L2 distance, far below SIMILARITY_THRESHOLD
+DIRECT_ANSWER_BACKGROUND_REWRITE = False # Also generate the usual LLM answer in the background and cache it for next time
+DIRECT_ANSWER_REWRITE_WORKERS = 2
+# Local solver: plain arithmetic, percentages and linear/quadratic equations are answered before the answer cache,
+# guardrails and retrieval, without any model call. Anything else falls through to the normal pipeline
+LOCAL_SOLVER_ENABLED = True
+LOCAL_SOLVER_TIME_LIMIT_MS = 50.0 # Evaluation is abandoned (and the query falls through) after this long
+LOCAL_SOLVER_MAX_QUERY_CHARS = 200
+# Batch processing (MathAgent.process_batch / python -m src.batch_solve)
+BATCH_SIZE = 64 # Queries per process_batch call in the batch CLI
+BATCH_MAX_CONCURRENCY = 8 # Generation requests in flight at once
+BATCH_GUARDRAIL_LLM_SIZE = 20 # Ambiguous queries classified per guardrail LLM call
+EMBEDDING_CACHE_MAX_ENTRIES = 10000 # Process-wide memo of query embeddings
 
 # Guardrails configuration
 ALLOWED_TOPICS = ["math", "mathematics", "algebra", "geometry", "calculus", "statistics", "probability", "education"]
 PRIVACY_KEYWORDS = ["password", "secret", "credit card", "social security"] # Add more sensitive keywords
+
+# Topic-sharded knowledge base: one FAISS index (with its own manifest and BM25 index) per topic under KB_SHARDS_PATH,
+# split from the single index without re-embedding (python -m src.sharded_store --split) or rebuilt from the CSV one
+# topic at a time (python -m src.sharded_store --rebuild calculus). Queries are routed to the shards of the topics
+# they mention plus the "general" shard, searched in parallel. Without shards on disk the single index is used.
+KB_SHARDING_ENABLED = True
+KB_SHARDS_PATH = "faiss_index_jee_math_shards"
+KB_SHARD_TOPICS = [topic for topic in ALLOWED_TOPICS if topic not in ("math", "mathematics", "education")]
+KB_SHARD_MAX_ROUTED = 2 # Topic shards searched per query besides "general"; a query naming no topic searches all shards
+KB_SHARD_SEARCH_WORKERS = 4
+KB_SHARD_RELOAD_CHECK_SECONDS = 5.0 # Rebuilt shards are swapped into running agents within this delay (0 = never)
+
+# Local topic classifier (fast path before the LLM topic check)
+TOPIC_CLASSIFIER_ENABLED = True
+TOPIC_CLASSIFIER_PATH = "models/topic_classifier.npz" # Build with: python -m src.topic_classifier
+TOPIC_NEGATIVES_PATH = "data/topic_negatives.txt"
+TOPIC_POSITIVES_PATH = "data/topic_positives_extra.txt"
+# Confidence band: P(math) >= ACCEPT passes locally, <= REJECT is rejected locally, anything in between asks the LLM
+TOPIC_CLASSIFIER_ACCEPT_THRESHOLD = 0.9
+TOPIC_CLASSIFIER_REJECT_THRESHOLD = 0.1
+
+# Answer cache configuration (exact + semantic tiers in front of the pipeline)
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_TTL_SECONDS = 24 * 60 * 60
+# Squared L2 distance between query embeddings; ~0.1 corresponds to cosine similarity ~0.95
+ANSWER_CACHE_SEMANTIC_THRESHOLD = 0.1
+ANSWER_CACHE_PATH = None # e.g. "answer_cache.json" to persist the cache across restarts
+
+# Provider client layer: every Gemini, embedding and Tavily call is rate limited, retried and circuit-broken
+GEMINI_RATE_LIMIT_PER_SECOND = 10.0 # Token bucket per process and provider (0 = unlimited); keep below your quota
+GEMINI_RATE_LIMIT_BURST = 20
+EMBEDDING_RATE_LIMIT_PER_SECOND = 25.0
+EMBEDDING_RATE_LIMIT_BURST = 50
+TAVILY_RATE_LIMIT_PER_SECOND = 5.0
+TAVILY_RATE_LIMIT_BURST = 10
+PROVIDER_MAX_RATE_WAIT_SECONDS = 10.0 # A call that would wait longer for a token fails fast instead
+PROVIDER_MAX_RETRIES = 3 # Retries of transient failures (quota, 5xx, timeouts), with full-jitter exponential backoff
+PROVIDER_RETRY_BASE_DELAY_SECONDS = 0.5
+PROVIDER_RETRY_MAX_DELAY_SECONDS = 8.0
+# Send a duplicate request when the first is slower than this (None = never); generation is too costly to hedge
+GEMINI_HEDGE_AFTER_SECONDS = None
+EMBEDDING_HEDGE_AFTER_SECONDS = 1.5
+TAVILY_HEDGE_AFTER_SECONDS = 3.0
+CIRCUIT_FAILURE_THRESHOLD = 5 # Consecutive transient failures that open a provider's circuit (0 = no breaker)
+CIRCUIT_RESET_SECONDS = 30.0 # How long an open circuit fails fast before a probe call is let through
+
+# Startup: LLM clients, the index and the chains are built on first use; with this set, MathAgent() also starts
+# building them in a background thread so the first query does not pay for it
+WARMUP_IN_BACKGROUND = True
+
+# Tracing and metrics (per-stage spans; near-zero overhead when disabled)
+TRACING_ENABLED = os.getenv("MATH_AGENT_TRACING", "0") == "1"
+TRACE_JSONL_PATH = "traces.jsonl" # One JSON line per span; None to only aggregate metrics
+METRICS_PROM_PATH = "metrics.prom" # Prometheus text file, rewritten at most every METRICS_FLUSH_INTERVAL_SECONDS
+METRICS_FLUSH_INTERVAL_SECONDS = 10.0
+METRICS_HTTP_PORT = None # e.g. 9464 to also serve GET /metrics
+
+# HTTP serving mode (python src/server.py). Limits apply per worker process
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = 8000
+SERVER_WORKERS = 1 # >1 forks independent workers; use VECTOR_STORE_FORMAT = "mmap" so they share the index pages
+SERVER_MAX_CONCURRENCY = 16 # Requests processed at once
+SERVER_MAX_QUEUE = 64 # Requests waiting for a slot; beyond this the server answers 429
+SERVER_REQUEST_TIMEOUT_SECONDS = 30.0 # Default and maximum per-request deadline (clients may send a shorter timeout_s)
+SERVER_MAX_BATCH_SIZE = 256
+SERVER_MAX_QUERY_CHARS = 4000
+SERVER_SHUTDOWN_GRACE_SECONDS = 30 # Time given to in-flight requests on SIGTERM
@@ -0,0 +1,155 @@
+import math
+import re
+from typing import Optional
+
+import numpy as np
+
+# Attempt absolute imports first (for when imported as a module)
+try:
+    from bm25_index import tokenize, reciprocal_rank_fusion
+    from utils import get_logger
+# If run directly via python -m src.context_packing, use relative imports
+except ModuleNotFoundError:
+    from .bm25_index import tokenize, reciprocal_rank_fusion
+    from .utils import get_logger
+
+logger = get_logger(__name__)
+
+CHARS_PER_TOKEN = 4 # Same estimate the tracing callback uses when a model reports no token usage
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _split_long_line(line: str, max_chars: int) -> list[str]:
+    """Splits a line longer than `max_chars` at sentence ends, hard-wrapping sentences that are still too long."""
+    pieces = []
+    for sentence in _SENTENCE_END.split(line):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+def split_passages(text: str, max_chars: int) -> list[str]:
+    """Splits extracted page text into passages of at most `max_chars`, merging short lines (headings, list items)."""
+    passages, current = [], ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        for piece in ([line] if len(line) <= max_chars else _split_long_line(line, max_chars)):
+            if current and len(current) + 1 + len(piece) > max_chars:
+                passages.append(current)
+                current = piece
+            else:
+                current = f"{current}\n{piece}" if current else piece
+    if current:
+        passages.append(current)
+    return passages
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def dedupe(texts: list[str], max_similarity: float) -> list[int]:
+    """Indices of the texts kept, in order: a text whose term set overlaps a kept one by more than `max_similarity` is dropped."""
+    kept, kept_terms = [], []
+    for i, text in enumerate(texts):
+        terms = set(tokenize(text))
+        if any(_jaccard(terms, other) > max_similarity for other in kept_terms):
+            continue
+        kept.append(i)
+        kept_terms.append(terms)
+    return kept
+
+def bm25_scores(query: str, texts: list[str], k1: float = 1.2, b: float = 0.75) -> np.ndarray:
+    """BM25 of the query against each text, with idf computed over `texts` themselves (no global index needed)."""
+    query_terms = set(tokenize(query))
+    tokenized = [tokenize(text) for text in texts]
+    lengths = np.array([len(tokens) for tokens in tokenized], dtype=np.float32)
+    average_length = float(lengths.mean()) if len(texts) and lengths.mean() > 0 else 1.0
+    scores = np.zeros(len(texts), dtype=np.float32)
+    for term in query_terms:
+        tf = np.array([tokens.count(term) for tokens in tokenized], dtype=np.float32)
+        df = int((tf > 0).sum())
+        if not df:
+            continue
+        idf = math.log(1 + (len(texts) - df + 0.5) / (df + 0.5))
+        scores += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths / average_length))
+    return scores
+
+def rank_passages(query: str, passages: list[str], query_vector=None, embeddings=None) -> list[int]:
+    """
+    Passage indices, best first. Lexical (BM25) ranking, fused by reciprocal rank with the cosine similarity to
+    `query_vector` when the query was embedded and `embeddings` can embed the passages (one batched call).
+    """
+    lexical = np.argsort(-bm25_scores(query, passages), kind="stable")
+    rankings = [[str(i) for i in lexical]]
+    if query_vector is not None and embeddings is not None:
+        try:
+            vectors = np.asarray(embeddings.embed_documents(passages), dtype=np.float32)
+            query_array = np.asarray(query_vector, dtype=np.float32)
+            similarity = vectors @ query_array / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_array) + 1e-12)
+            rankings.append([str(i) for i in np.argsort(-similarity, kind="stable")])
+        except Exception as e:
+            logger.warning(f"Passage embedding failed, ranking lexically only: {e}")
+    if len(rankings) == 1:
+        return [int(i) for i in lexical]
+    return [int(key) for key in reciprocal_rank_fusion(rankings)]
+
+def pack_documents(texts: list[str], token_budget: int, max_similarity: float = 0.8) -> tuple[list[str], dict]:
+    """
+    KB context: whole documents in retrieval order, near-duplicates dropped, until `token_budget` is used.
+    The best document is always kept (cut to the budget if it alone exceeds it).
+    """
+    candidate_tokens = sum(estimate_tokens(text) for text in texts)
+    selected, used = [], 0
+    for i in dedupe(texts, max_similarity):
+        tokens = estimate_tokens(texts[i])
+        if not selected and tokens > token_budget:
+            selected.append(texts[i][:token_budget * CHARS_PER_TOKEN])
+            used = token_budget
+            break
+        if used + tokens > token_budget:
+            continue
+        selected.append(texts[i])
+        used += tokens
+    return selected, {"candidates": len(texts), "selected": len(selected), "candidate_tokens": candidate_tokens,
+                      "context_tokens": used}
+
+def pack_web_context(query: str, pages: list[dict], token_budget: int, passage_chars: int = 400,
+                     max_similarity: float = 0.8, query_vector=None, embeddings=None) -> tuple[str, dict]:
+    """
+    Web context: every page ({"source", "text", "is_snippet"}) is split into passages, duplicates are dropped,
+    the rest ranked against the query and packed greedily into `token_budget`. Selected passages are regrouped
+    by source, in search order and page order. Returns (context, stats).
+    """
+    passages = [] # (page index, passage)
+    for page_index, page in enumerate(pages):
+        passages.extend((page_index, passage) for passage in split_passages(page["text"], passage_chars))
+    candidate_tokens = sum(estimate_tokens(passage) for _, passage in passages)
+    passages = [passages[i] for i in dedupe([passage for _, passage in passages], max_similarity)]
+
+    texts = [passage for _, passage in passages]
+    if sum(estimate_tokens(text) for text in texts) <= token_budget:
+        order = range(len(texts)) # Everything fits, no ranking needed
+    else:
+        order = rank_passages(query, texts, query_vector, embeddings)
+    chosen, used = set(), 0
+    for i in order:
+        tokens = estimate_tokens(texts[i])
+        if used + tokens <= token_budget:
+            chosen.add(i)
+            used += tokens
+
+    entries = []
+    for page_index, page in enumerate(pages):
+        selected = [passage for i, (index, passage) in enumerate(passages) if index == page_index and i in chosen]
+        if selected:
+            label = "Content Snippet" if page["is_snippet"] else "Content"
+            entries.append(f"Source: {page['source']}\n{label}:\n" + "\n".join(selected))
+    return "\n\n---\n\n".join(entries), {"candidates": len(texts), "selected": len(chosen),
+                                         "candidate_tokens": candidate_tokens, "context_tokens": used}
@@ -0,0 +1,70 @@
+import re
+from typing import Optional
+
+# Forum boilerplate that appears inside some scraped solutions
+_BOILERPLATE = re.compile(r"\b(view answer|discuss in forum|explanation\s*:)\s*", re.IGNORECASE)
+# Trailing "answer : c", "answer is d", "answer a", "ans : option b" (or a bare trailing option letter)
+_FINAL_OPTION = re.compile(r"(?:\b(?:answer|ans)\b\s*(?:is|:|=)?\s*(?:option\s*)?|\s)\(?\s*([a-e])\s*\)?\s*[.]?\s*$", re.IGNORECASE)
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+# Answer choices named inside the text ("option b is answer", "answer: a) 1 : 2", "d is correct", "- c 120")
+_OPTION_REFERENCE = re.compile(r"\boption\s*[(']?\s*[a-e]\b|\b[a-e]\s*\)|^-\s*[a-e]\b(?!\s*[=+*/^-])|"
+                               r"\b(?:answer|ans)\b\s*(?:is|:|=|should\s+be)?\s*\(?\s*[a-e]\b|\b[a-e]\s+is\s+(?:the\s+)?(?:correct|answer|right)\b", re.IGNORECASE)
+# The value a solution works out to: a plain number (fraction, percentage) after the last "=" of its last step
+_FINAL_VALUE = re.compile(r"=\s*(-?\d+(?:\.\d+)?(?:\s*/\s*\d+(?:\.\d+)?)?\s*%?)\s*\.?\s*$")
+
+DIRECT_ANSWER_TEMPLATE = """This question is in my knowledge base. Here is the stored step-by-step solution:
+
+{solution}
+{final_answer}"""
+
+def split_stored_document(page_content: str) -> tuple[str, str]:
+    """Splits a KB document ("Question: ...\\nAnswer: ...") into (question, answer)."""
+    question, _, answer = page_content.partition("\nAnswer:")
+    return question.removeprefix("Question:").strip(), answer.strip()
+
+def same_numbers(query: str, question: str) -> bool:
+    """True if both texts contain the same numbers (a near-identical question with other numbers has another answer)."""
+    return sorted(_NUMBER.findall(query)) == sorted(_NUMBER.findall(question))
+
+def clean_solution(answer: str) -> tuple[str, Optional[str]]:
+    """Tidies the tokenized stored solution text. Returns (solution, final option letter or None)."""
+    text = answer.strip().strip('"').strip()
+    text = _BOILERPLATE.sub("", text)
+    option = None
+    match = _FINAL_OPTION.search(text)
+    if match:
+        option = match.group(1).lower()
+        text = text[:match.start()].rstrip()
+    # The dataset is space-tokenized ("rs . 900 , ( 50 x 20 )"); rejoin punctuation
+    text = re.sub(r"\brs\s*\.\s*", "Rs ", text, flags=re.IGNORECASE)
+    text = re.sub(r"(\s*\.){2,}", " ... ", text)
+    text = re.sub(r"\s+([.,:;%)\]])", r"\1", text)
+    text = re.sub(r"([(\[])\s+", r"\1", text)
+    text = re.sub(r",(?=\S)", ", ", text)
+    text = re.sub(r"\s{2,}", " ", text).strip()
+    # One step per sentence
+    steps = [step.strip() for step in re.split(r"(?<=[\w)\]%])\.\s+", text) if step.strip()]
+    steps = [step[0].upper() + step[1:] for step in steps]
+    return "\n".join(f"- {step}" for step in steps), option
+
+def final_value(solution: str) -> Optional[str]:
+    """The value the cleaned solution ends on ("... = 108 × 100 / 360 = 30" -> "30"), or None."""
+    lines = solution.splitlines()
+    match = _FINAL_VALUE.search(lines[-1]) if lines else None
+    return re.sub(r"\s+", " ", match.group(1)).strip() if match else None
+
+def render_direct_answer(page_content: str) -> Optional[str]:
+    """
+    Formats a stored KB solution as the agent's answer, or None if the document has no usable solution.
+    The stored questions carry no option list, so a solution that only names its final option letter (and does
+    not end on a value) is not answered directly.
+    """
+    _, answer = split_stored_document(page_content)
+    solution, option = clean_solution(answer)
+    if not solution:
+        return None
+    value = final_value(solution)
+    if value is None and (option or _OPTION_REFERENCE.search(solution.splitlines()[-1])):
+        return None
+    final_answer = f"\n**Answer:** {value}" if value else ""
+    return DIRECT_ANSWER_TEMPLATE.format(solution=solution, final_answer=final_answer).strip()
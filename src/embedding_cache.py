@@ -0,0 +1,93 @@
+import inspect
+import threading
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+try:
+    from utils import get_logger
+except ModuleNotFoundError:
+    from .utils import get_logger
+
+logger = get_logger(__name__)
+
+# Process-wide query-embedding memo shared by every CachedEmbeddings instance, keyed on (namespace, text)
+_MEMO: OrderedDict = OrderedDict()
+_MEMO_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0, "embedding_calls": 0}
+
+def embedding_cache_stats() -> dict:
+    """Returns process-wide embedding memo counters."""
+    with _MEMO_LOCK:
+        return {**_STATS, "size": len(_MEMO)}
+
+def clear_embedding_cache():
+    with _MEMO_LOCK:
+        _MEMO.clear()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Memoizing wrapper around an Embeddings model.
+    Identical queries are embedded once per process; `embedding_calls` counts requests sent to the
+    underlying model so callers can verify how many remote calls a request actually made.
+    Document embeddings use a different task type upstream, so they are passed through uncached.
+    """
+
+    def __init__(self, base: Embeddings, namespace: str = "default", max_entries: int = 10000):
+        self.base = base
+        self.namespace = namespace
+        self.max_entries = max_entries
+
+    def _lookup(self, text: str):
+        key = (self.namespace, text)
+        with _MEMO_LOCK:
+            vector = _MEMO.get(key)
+            if vector is not None:
+                _MEMO.move_to_end(key)
+                _STATS["hits"] += 1
+            else:
+                _STATS["misses"] += 1
+            return vector
+
+    def _store(self, text: str, vector: list[float]):
+        with _MEMO_LOCK:
+            _MEMO[(self.namespace, text)] = vector
+            while len(_MEMO) > self.max_entries:
+                _MEMO.popitem(last=False)
+
+    def embed_query_with_info(self, text: str) -> tuple[list[float], bool]:
+        """Returns (vector, from_cache) so callers can report whether a remote call was made."""
+        vector = self._lookup(text)
+        if vector is not None:
+            return vector, True
+        with _MEMO_LOCK:
+            _STATS["embedding_calls"] += 1
+        vector = self.base.embed_query(text)
+        self._store(text, vector)
+        return vector, False
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_query_with_info(text)[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Embeds many queries, sending all memo misses to the underlying model in one batched call."""
+        vectors = [self._lookup(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            with _MEMO_LOCK:
+                _STATS["embedding_calls"] += 1
+            # Query embeddings use a different task type than documents when the model supports it
+            if getattr(self.base, "accepts_task_type", None) or "task_type" in inspect.signature(self.base.embed_documents).parameters:
+                new_vectors = self.base.embed_documents(missing, task_type="RETRIEVAL_QUERY")
+            else:
+                new_vectors = [self.base.embed_query(text) for text in missing]
+            embedded = dict(zip(missing, new_vectors))
+            for text, vector in embedded.items():
+                self._store(text, vector)
+            vectors = [vector if vector is not None else embedded[text] for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with _MEMO_LOCK:
+            _STATS["embedding_calls"] += 1
+        return self.base.embed_documents(texts)
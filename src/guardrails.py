@@ -1,29 +1,81 @@
+import re
+import threading
+
 from config import ALLOWED_TOPICS, PRIVACY_KEYWORDS, GOOGLE_API_KEY, GEMINI_MODEL_NAME # Added GOOGLE_API_KEY, GEMINI_MODEL_NAME
+from config import TOPIC_CLASSIFIER_ENABLED, TOPIC_CLASSIFIER_ACCEPT_THRESHOLD, TOPIC_CLASSIFIER_REJECT_THRESHOLD
 from utils import get_logger
-# Uncommented LLM import
-from langchain_google_genai import ChatGoogleGenerativeAI
+from topic_classifier import load_topic_classifier
+from providers import resilient_chat_model
+from tracing import span, llm_callbacks
 
 logger = get_logger(__name__)
 
-# Uncommented and initialized LLM for guardrails
-llm = ChatGoogleGenerativeAI(model=GEMINI_MODEL_NAME, google_api_key=GOOGLE_API_KEY, temperature=0.0) # Use low temp for classification
+# LLM for guardrails and the local topic classifier, both created on first use (or by warm_up_guardrails)
+llm = None
+topic_classifier = None
+_models_lock = threading.Lock()
+_topic_classifier_loaded = False
 
-def check_input_guardrails(query: str) -> tuple[bool, str]:
-    """
-    Checks if the input query is appropriate using keyword and LLM checks.
-    Returns (is_safe, message).
-    """
-    query_lower = query.lower()
+SENSITIVE_OUTPUT_MESSAGE = "Sorry, I cannot provide a response containing potentially sensitive information."
 
-    # 1. Privacy Check
-    for keyword in PRIVACY_KEYWORDS:
-        if keyword in query_lower:
-            message = "Input contains potentially sensitive information. Please rephrase your question."
-            logger.warning(f"Input guardrail triggered (Privacy): {query}")
-            return False, message
+# Counters for how each topic check was decided
+_topic_check_stats = {"local_accept": 0, "local_reject": 0, "llm": 0, "llm_batch_calls": 0, "llm_errors": 0}
+_stats_lock = threading.Lock()
+
+def _count(key: str):
+    with _stats_lock:
+        _topic_check_stats[key] += 1
+
+def get_topic_check_stats() -> dict:
+    """Returns how many topic checks were decided locally vs. escalated to the LLM."""
+    with _stats_lock:
+        stats = dict(_topic_check_stats)
+    total = stats["local_accept"] + stats["local_reject"] + stats["llm"]
+    stats["llm_rate"] = stats["llm"] / total if total else 0.0
+    return stats
+
+def _get_llm():
+    global llm
+    if llm is None:
+        with _models_lock:
+            if llm is None:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                llm = resilient_chat_model(ChatGoogleGenerativeAI(model=GEMINI_MODEL_NAME, google_api_key=GOOGLE_API_KEY,
+                                                                  temperature=0.0, # Use low temp for classification
+                                                                  max_retries=1), callbacks=llm_callbacks())
+    return llm
+
+def _get_topic_classifier():
+    """Local topic classifier, loaded once; confident cases skip the LLM topic check."""
+    global topic_classifier, _topic_classifier_loaded
+    if not _topic_classifier_loaded:
+        with _models_lock:
+            if not _topic_classifier_loaded:
+                topic_classifier = load_topic_classifier() if TOPIC_CLASSIFIER_ENABLED else None
+                _topic_classifier_loaded = True
+    return topic_classifier
 
-    # 2. Topic Check (LLM-based)
-    is_topic_allowed = False
+def warm_up_guardrails():
+    """Creates the guardrail LLM client and loads the topic classifier ahead of the first query."""
+    _get_llm()
+    _get_topic_classifier()
+
+def contains_sensitive_keywords(text: str) -> bool:
+    """Returns True if the text contains any of the configured privacy keywords."""
+    text_lower = text.lower()
+    return any(keyword in text_lower for keyword in PRIVACY_KEYWORDS)
+
+def _keyword_topic_check(query: str) -> bool:
+    """Keyword fallback used when the LLM topic check is unavailable."""
+    query_lower = query.lower()
+    is_topic_allowed = any(topic in query_lower for topic in ALLOWED_TOPICS)
+    # Add common math problem indicators as fallback keywords
+    fallback_keywords = ["calculate", "solve", "how many", "what is the value", "find the", "equation", "problem", "sum", "difference", "product", "ratio", "average", "percent"]
+    return is_topic_allowed or any(keyword in query_lower for keyword in fallback_keywords)
+
+def _check_topic_with_llm(query: str) -> bool:
+    """LLM-based topic check, falling back to keyword matching if the LLM call fails."""
+    _count("llm")
     try:
         # Use LLM for more robust topic classification
         prompt = f"""Is the following query primarily related to mathematics, logic puzzles, or math education? Answer only with 'yes' or 'no'.
@@ -31,20 +83,77 @@ def check_input_guardrails(query: str) -> tuple[bool, str]:
 Query: '{query}'
 
 Answer:"""
-        response = llm.invoke(prompt)
+        with span("guardrail_llm", queries=1):
+            response = _get_llm().invoke(prompt)
         llm_decision = response.content.strip().lower()
         logger.info(f"LLM topic check for '{query}': Decision='{llm_decision}'")
-        is_topic_allowed = "yes" in llm_decision
+        return "yes" in llm_decision
 
     except Exception as e:
+        _count("llm_errors")
         logger.error(f"LLM topic check failed: {e}. Falling back to keyword check.")
         # Fallback to simple keyword matching if LLM fails
-        is_topic_allowed = any(topic in query_lower for topic in ALLOWED_TOPICS)
-        # Add common math problem indicators as fallback keywords
-        fallback_keywords = ["calculate", "solve", "how many", "what is the value", "find the", "equation", "problem", "sum", "difference", "product", "ratio", "average", "percent"]
-        is_topic_allowed = is_topic_allowed or any(keyword in query_lower for keyword in fallback_keywords)
+        return _keyword_topic_check(query)
+
+def _check_topics_with_llm_batch(queries: list[str]) -> list[bool]:
+    """Classifies several queries in one LLM call. Queries missing from the reply are checked individually."""
+    _count("llm_batch_calls")
+    numbered = "\n".join(f"{i}. '{query}'" for i, query in enumerate(queries, start=1))
+    prompt = f"""For each numbered query below, decide whether it is primarily related to mathematics, logic puzzles, or math education.
+Reply with exactly one line per query in the form '<number>: yes' or '<number>: no', and nothing else.
+
+{numbered}
+
+Answers:"""
+    try:
+        with span("guardrail_llm", queries=len(queries)):
+            response = _get_llm().invoke(prompt)
+        decisions = {}
+        for line in response.content.strip().lower().splitlines():
+            match = re.match(r"^\s*(\d+)\s*[:.)-]\s*(yes|no)\b", line)
+            if match:
+                decisions[int(match.group(1))] = match.group(2) == "yes"
+    except Exception as e:
+        _count("llm_errors")
+        logger.error(f"Batched LLM topic check failed: {e}. Falling back to keyword check.")
+        return [_keyword_topic_check(query) for query in queries]
+
+    results = []
+    for i, query in enumerate(queries, start=1):
+        if i in decisions:
+            _count("llm")
+            results.append(decisions[i])
+        else:
+            logger.warning(f"Batched topic check returned no decision for '{query}'. Checking it individually.")
+            results.append(_check_topic_with_llm(query))
+    return results
 
+def _local_topic_decision(query: str):
+    """Returns True/False when the local classifier is confident, or None to escalate to the LLM."""
+    topic_classifier = _get_topic_classifier()
+    if topic_classifier is None:
+        return None
+    is_topic_allowed = None
+    math_probability = topic_classifier.predict_proba(query)
+    if math_probability >= TOPIC_CLASSIFIER_ACCEPT_THRESHOLD:
+        is_topic_allowed = True
+        _count("local_accept")
+    elif math_probability <= TOPIC_CLASSIFIER_REJECT_THRESHOLD:
+        is_topic_allowed = False
+        _count("local_reject")
+    logger.info(f"Local topic check for '{query}': P(math)={math_probability:.3f}, "
+                f"Decision={'escalate' if is_topic_allowed is None else is_topic_allowed}")
+    return is_topic_allowed
 
+def _privacy_result(query: str):
+    if contains_sensitive_keywords(query):
+        message = "Input contains potentially sensitive information. Please rephrase your question."
+        logger.warning(f"Input guardrail triggered (Privacy): {query}")
+        return False, message
+    return None
+
+def _topic_result(query: str, is_topic_allowed: bool) -> tuple[bool, str]:
+    query_lower = query.lower()
     if not is_topic_allowed:
         # Check for common greetings or non-math questions
         if any(greeting in query_lower for greeting in ["hello", "hi", "how are you", "what is your name"]):
@@ -60,19 +169,107 @@ Answer:"""
     logger.info(f"Input guardrail passed: {query}")
     return True, "Input is valid."
 
+def check_input_guardrails(query: str) -> tuple[bool, str]:
+    """
+    Checks if the input query is appropriate using keyword, local classifier and LLM checks.
+    Returns (is_safe, message).
+    """
+    with span("input_guardrails") as guardrail_span:
+        # 1. Privacy Check
+        privacy_result = _privacy_result(query)
+        if privacy_result is not None:
+            guardrail_span.set(allowed=False, reason="privacy")
+            return privacy_result
+
+        # 2. Topic Check - local classifier for confident cases, LLM for the ambiguous band
+        is_topic_allowed = _local_topic_decision(query)
+        guardrail_span.set(decided_by="local" if is_topic_allowed is not None else "llm")
+        if is_topic_allowed is None:
+            is_topic_allowed = _check_topic_with_llm(query)
+
+        guardrail_span.set(allowed=is_topic_allowed)
+        return _topic_result(query, is_topic_allowed)
+
+def check_input_guardrails_batch(queries: list[str], llm_batch_size: int = 20) -> list[tuple[bool, str]]:
+    """
+    Batch version of check_input_guardrails: same decisions, but queries the local classifier
+    cannot decide are classified `llm_batch_size` at a time in a single LLM call.
+    """
+    results = [None] * len(queries)
+    ambiguous = []
+    for i, query in enumerate(queries):
+        results[i] = _privacy_result(query)
+        if results[i] is not None:
+            continue
+        is_topic_allowed = _local_topic_decision(query)
+        if is_topic_allowed is None:
+            ambiguous.append(i)
+        else:
+            results[i] = _topic_result(query, is_topic_allowed)
+
+    for start in range(0, len(ambiguous), llm_batch_size):
+        chunk = ambiguous[start:start + llm_batch_size]
+        decisions = _check_topics_with_llm_batch([queries[i] for i in chunk])
+        for i, is_topic_allowed in zip(chunk, decisions):
+            results[i] = _topic_result(queries[i], is_topic_allowed)
+    return results
+
+class StreamingOutputGuardrail:
+    """
+    Incremental privacy check for streamed responses.
+    The last (longest keyword - 1) characters are held back, so a keyword split across chunks is
+    detected before any part of it is emitted. Feed chunks in, emit what feed()/finish() return.
+    """
+
+    def __init__(self):
+        self.text = "" # Everything received so far
+        self.tripped = False
+        self.message = None
+        self._emitted = 0
+        self._holdback = max((len(keyword) for keyword in PRIVACY_KEYWORDS), default=1) - 1
+
+    def feed(self, chunk: str) -> str:
+        """Adds a chunk and returns the text that is now safe to emit ("" once tripped)."""
+        if self.tripped:
+            return ""
+        self.text += chunk
+        # Any new keyword match must end in the new chunk, so only the tail window needs checking
+        if contains_sensitive_keywords(self.text[max(0, self._emitted - self._holdback):]):
+            self.tripped = True
+            self.message = SENSITIVE_OUTPUT_MESSAGE
+            logger.error(f"Output guardrail triggered (Privacy) while streaming: {self.text[:100]}...")
+            return ""
+        safe_until = max(self._emitted, len(self.text) - self._holdback)
+        safe_text = self.text[self._emitted:safe_until]
+        self._emitted = safe_until
+        return safe_text
+
+    def finish(self) -> str:
+        """Returns the held-back tail once the stream has ended."""
+        if self.tripped:
+            return ""
+        tail = self.text[self._emitted:]
+        self._emitted = len(self.text)
+        return tail
+
 def check_output_guardrails(response: str) -> tuple[bool, str]:
     """
     Checks if the generated response is appropriate.
     Returns (is_safe, response).
     """
+    with span("output_guardrails") as guardrail_span:
+        is_safe, response = _check_output(response)
+        guardrail_span.set(safe=is_safe)
+        return is_safe, response
+
+def _check_output(response: str) -> tuple[bool, str]:
     response_lower = response.lower()
 
     # 1. Privacy Check (Less likely but good practice)
-    for keyword in PRIVACY_KEYWORDS:
-        if keyword in response_lower:
-            message = "Sorry, I cannot provide a response containing potentially sensitive information."
-            logger.error(f"Output guardrail triggered (Privacy): {response[:100]}...") # Log snippet
-            return False, message
+    if contains_sensitive_keywords(response):
+        message = SENSITIVE_OUTPUT_MESSAGE
+        logger.error(f"Output guardrail triggered (Privacy): {response[:100]}...") # Log snippet
+        return False, message
 
     # 2. Refusal Check (Check if the LLM refused inappropriately or generated harmful content)
     refusal_phrases = ["i cannot", "i'm unable to", "i apologize, but", "as an ai"]
@@ -0,0 +1,519 @@
+import ast
+import math
+import re
+import threading
+import time
+from fractions import Fraction
+from typing import Optional, Union
+
+# Attempt absolute imports first (for when imported as a module)
+try:
+    from config import LOCAL_SOLVER_TIME_LIMIT_MS, LOCAL_SOLVER_MAX_QUERY_CHARS
+    from utils import get_logger
+# If run directly via python -m src.local_solver, use relative imports
+except ModuleNotFoundError:
+    from .config import LOCAL_SOLVER_TIME_LIMIT_MS, LOCAL_SOLVER_MAX_QUERY_CHARS
+    from .utils import get_logger
+
+logger = get_logger(__name__)
+
+Number = Union[Fraction, float] # Exact unless a square root or fractional power made it irrational
+
+# Bounds that keep every evaluation far below the time limit (e.g. no 9**9**9)
+MAX_NODES = 64
+MAX_LITERAL_DIGITS = 30
+MAX_EXPONENT = 64
+MAX_RESULT_BITS = 2000 # Numerator/denominator size of any intermediate value
+MAX_SHOWN_STEPS = 8
+FUNCTIONS = {"sqrt", "abs"}
+
+# Polite or imperative lead-ins and trailing "= ?" / "?" around the actual expression
+_LEAD_IN = re.compile(r"^(?:please\s+)?(?:what\s+is|what's|whats|calculate|compute|evaluate|simplify|work\s+out|"
+                      r"find(?:\s+the\s+value\s+of)?|solve(?:\s+for\s+[a-z])?)\s*(?:the\s+equation\s*)?[:,]?\s*",
+                      re.IGNORECASE)
+_UNKNOWN_NAMED = re.compile(r"^[a-z]\s*(?:[:,]|\bif\b|\bwhen\b|\bgiven\b)\s*(?=.*=)") # "find x: 2x = 4"
+_TRAILING = re.compile(r"(?:\s*(?:=\s*\?|=|\?|\.|!))+\s*$")
+_PERCENT_WORD = re.compile(r"\s*\bper\s*cent(?:age)?\b", re.IGNORECASE)
+_NUMBER = r"(\d+(?:\.\d+)?)"
+_PERCENT_OF = re.compile(rf"^{_NUMBER}\s*%\s*of\s*{_NUMBER}$", re.IGNORECASE)
+_IS_WHAT_PERCENT_OF = re.compile(rf"^{_NUMBER}\s*is\s*what\s*%\s*of\s*{_NUMBER}$", re.IGNORECASE)
+_WHAT_PERCENT_OF_IS = re.compile(rf"^what\s*%\s*of\s*{_NUMBER}\s*is\s*{_NUMBER}$", re.IGNORECASE)
+_ALLOWED_CHARACTERS = re.compile(r"^[\d\s.+\-*/^()=a-z]+$")
+_WORD = re.compile(r"[a-z]+")
+
+SOLUTION_TEMPLATE = """{intro}
+
+{steps}
+
+**Answer:** {answer}"""
+
+_stats = {"solved": 0, "declined": 0, "time_limit": 0}
+_stats_lock = threading.Lock()
+
+class SolverDeclined(Exception):
+    """The query is not something the local solver answers confidently; it goes through the normal pipeline."""
+
+def get_solver_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+# --- Normalization ---
+
+def _normalize(query: str) -> str:
+    text = query.strip()
+    for old, new in (("×", "*"), ("·", "*"), ("÷", "/"), ("−", "-"), ("–", "-"), ("²", "^2"), ("**", "^")):
+        text = text.replace(old, new)
+    text = re.sub(r"√\s*(\d+(?:\.\d+)?|\([^()]*\))", r"sqrt(\1)", text)
+    text = _PERCENT_WORD.sub("%", text)
+    text = _TRAILING.sub("", _LEAD_IN.sub("", text.strip())).strip().lower()
+    return _UNKNOWN_NAMED.sub("", text)
+
+def _to_python(expression: str, variable: Optional[str]) -> str:
+    """Python syntax for a normalized expression: "^" is a power and multiplication may be implicit (2x, 3(x+1))."""
+    text = expression.replace("^", "**")
+    if variable is None:
+        text = re.sub(r"(?<=[\d)])\s*x\s*(?=[\d(])", "*", text) # "3 x 4" means times when there is no unknown
+    text = re.sub(r"(\d)\s*(?=[a-z(])", r"\1*", text)
+    text = re.sub(r"\)\s*(?=[\w(])", ")*", text)
+    if variable is not None:
+        text = re.sub(rf"\b{variable}\s*(?=[\d(])", f"{variable}*", text)
+    return text
+
+def _parse(text: str) -> ast.AST:
+    try:
+        tree = ast.parse(text, mode="eval").body
+    except (SyntaxError, ValueError):
+        raise SolverDeclined("not an expression")
+    if sum(1 for _ in ast.walk(tree)) > MAX_NODES:
+        raise SolverDeclined("expression too large")
+    return tree
+
+# --- Exact evaluation ---
+
+class _Evaluator:
+    """Evaluates a parsed expression over Fractions, allowing only numbers, + - * / ^, sqrt() and abs()."""
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+
+    def _check(self, value: Number) -> Number:
+        if time.perf_counter() > self.deadline:
+            _count("time_limit")
+            raise SolverDeclined("time limit")
+        if isinstance(value, Fraction):
+            if max(value.numerator.bit_length(), value.denominator.bit_length()) > MAX_RESULT_BITS:
+                raise SolverDeclined("result too large")
+        elif not math.isfinite(value):
+            raise SolverDeclined("result not finite")
+        return value
+
+    def literal(self, node: ast.AST) -> Number:
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            text = repr(node.value)
+            if len(text) > MAX_LITERAL_DIGITS:
+                raise SolverDeclined("number too long")
+            return Fraction(text)
+        if _is_value(node):
+            return node.solver_value
+        raise SolverDeclined(f"unsupported element {type(node).__name__}")
+
+    def apply(self, node: ast.AST, operands: list[Number]) -> Number:
+        """Value of one operator or function node, given the values of its operands."""
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            return self._check(-operands[0] if isinstance(node.op, ast.USub) else operands[0])
+        if isinstance(node, ast.BinOp):
+            left, right = operands
+            if isinstance(node.op, ast.Add):
+                return self._check(left + right)
+            if isinstance(node.op, ast.Sub):
+                return self._check(left - right)
+            if isinstance(node.op, ast.Mult):
+                return self._check(left * right)
+            if isinstance(node.op, ast.Div):
+                if right == 0:
+                    raise SolverDeclined("division by zero")
+                return self._check(left / right)
+            if isinstance(node.op, ast.Pow):
+                return self._check(self._power(left, right))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS and not node.keywords:
+            (value,) = operands
+            if node.func.id == "abs":
+                return abs(value)
+            return self._check(_sqrt(value))
+        raise SolverDeclined(f"unsupported operation {type(node).__name__}")
+
+    @staticmethod
+    def _power(base: Number, exponent: Number) -> Number:
+        if isinstance(exponent, Fraction) and exponent.denominator == 1:
+            if abs(exponent) > MAX_EXPONENT:
+                raise SolverDeclined("exponent too large")
+            if isinstance(base, Fraction):
+                bits = max(base.numerator.bit_length(), base.denominator.bit_length())
+                if bits * abs(exponent) > MAX_RESULT_BITS:
+                    raise SolverDeclined("result too large")
+                if base == 0 and exponent < 0:
+                    raise SolverDeclined("division by zero")
+            return base ** int(exponent)
+        if base < 0:
+            raise SolverDeclined("fractional power of a negative number")
+        return float(base) ** float(exponent)
+
+    def operands(self, node: ast.AST) -> list[ast.AST]:
+        if isinstance(node, ast.UnaryOp):
+            return [node.operand]
+        if isinstance(node, ast.BinOp):
+            return [node.left, node.right]
+        if isinstance(node, ast.Call):
+            if len(node.args) != 1:
+                raise SolverDeclined("functions take one argument")
+            return list(node.args)
+        return []
+
+    def evaluate(self, node: ast.AST) -> Number:
+        children = self.operands(node)
+        if not children:
+            return self.literal(node)
+        return self.apply(node, [self.evaluate(child) for child in children])
+
+def _sqrt(value: Number) -> Number:
+    if value < 0:
+        raise SolverDeclined("square root of a negative number")
+    if isinstance(value, Fraction):
+        numerator, denominator = math.isqrt(value.numerator), math.isqrt(value.denominator)
+        if numerator * numerator == value.numerator and denominator * denominator == value.denominator:
+            return Fraction(numerator, denominator)
+    return math.sqrt(value)
+
+def _value_node(value: Number, decimals: bool) -> ast.Name:
+    """An already evaluated sub-expression, as a node that prints as its value."""
+    node = ast.Name(id=_operand(value, decimals), ctx=ast.Load())
+    node.solver_value = value
+    return node
+
+def _is_value(node: ast.AST) -> bool:
+    return hasattr(node, "solver_value")
+
+# --- Formatting ---
+
+def format_number(value: Number, decimals: bool = False) -> str:
+    """Integers as is; other exact values as a fraction (or a decimal if the question used decimals); approximations to 10 digits."""
+    if isinstance(value, float):
+        return f"{value:.10g}"
+    if value.denominator == 1:
+        return str(value.numerator)
+    if decimals:
+        denominator = value.denominator
+        for prime in (2, 5):
+            while denominator % prime == 0:
+                denominator //= prime
+        if denominator == 1: # Terminating decimal, shown exactly
+            return _exact_decimal(value)
+        return f"{float(value):.10g}"
+    return f"{value.numerator}/{value.denominator}"
+
+def _exact_decimal(value: Fraction) -> str:
+    sign = "-" if value < 0 else ""
+    value = abs(value)
+    whole, remainder = divmod(value.numerator, value.denominator)
+    digits = ""
+    while remainder:
+        remainder *= 10
+        digit, remainder = divmod(remainder, value.denominator)
+        digits += str(digit)
+    return f"{sign}{whole}.{digits}" if digits else f"{sign}{whole}"
+
+def _operand(value: Number, decimals: bool = False) -> str:
+    """A number as an operand: negative and fractional values are parenthesized so the expression keeps its meaning."""
+    text = format_number(value, decimals)
+    return f"({text})" if text.startswith("-") or "/" in text else text
+
+def _answer(value: Number, decimals: bool) -> str:
+    text = format_number(value, decimals)
+    if isinstance(value, float):
+        return f"≈ {text}"
+    if "/" in text:
+        return f"{text} (≈ {float(value):.10g})"
+    return text
+
+def _display(expression: str) -> str:
+    return expression.replace(" ** ", "^").replace("**", "^").replace(" * ", " × ")
+
+def _render(tree: ast.AST, decimals: bool = False) -> str:
+    if _is_value(tree):
+        return format_number(tree.solver_value, decimals)
+    return _display(ast.unparse(tree))
+
+def _root(variable: str, value: Number) -> str:
+    return f"{variable} {_answer(value, False)}" if isinstance(value, float) else f"{variable} = {_answer(value, False)}"
+
+# --- Arithmetic ---
+
+def _fold_signed_literals(node: ast.AST, evaluator: _Evaluator, decimals: bool) -> ast.AST:
+    """Turns "-3" into a single value so it is not shown as a step of its own."""
+    for field, child in ast.iter_fields(node):
+        if isinstance(child, ast.AST):
+            setattr(node, field, _fold_signed_literals(child, evaluator, decimals))
+        elif isinstance(child, list):
+            setattr(node, field, [_fold_signed_literals(item, evaluator, decimals) if isinstance(item, ast.AST) else item
+                                  for item in child])
+    if isinstance(node, ast.UnaryOp) and (isinstance(node.operand, ast.Constant) or _is_value(node.operand)):
+        return _value_node(evaluator.apply(node, [evaluator.literal(node.operand)]), decimals)
+    if isinstance(node, ast.Constant):
+        return _value_node(evaluator.literal(node), decimals)
+    return node
+
+def _reduce_once(node: ast.AST, evaluator: _Evaluator, decimals: bool) -> tuple[ast.AST, bool]:
+    """Evaluates the first operation (in evaluation order) whose operands are all values. Returns (tree, changed)."""
+    children = evaluator.operands(node)
+    if not children:
+        return node, False
+    if all(_is_value(child) for child in children):
+        return _value_node(evaluator.apply(node, [child.solver_value for child in children]), decimals), True
+    for field, child in ast.iter_fields(node):
+        if isinstance(child, ast.AST):
+            reduced, changed = _reduce_once(child, evaluator, decimals)
+            if changed:
+                setattr(node, field, reduced)
+                return node, True
+        elif isinstance(child, list):
+            for i, item in enumerate(child):
+                if isinstance(item, ast.AST):
+                    reduced, changed = _reduce_once(item, evaluator, decimals)
+                    if changed:
+                        child[i] = reduced
+                        return node, True
+    return node, False
+
+def solve_arithmetic(expression: str, deadline: float) -> str:
+    decimals = "." in expression
+    tree = _parse(_to_python(expression, None))
+    if not any(isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Call)) for node in ast.walk(tree)):
+        raise SolverDeclined("no operation") # A bare number is not a question for the solver
+    evaluator = _Evaluator(deadline)
+    tree = _fold_signed_literals(tree, evaluator, decimals)
+    shown = _render(tree)
+    steps = []
+    while not _is_value(tree):
+        tree, changed = _reduce_once(tree, evaluator, decimals)
+        if not changed:
+            raise SolverDeclined("could not evaluate")
+        step = f"= {_render(tree, decimals)}"
+        if not steps or steps[-1] != step: # "-(9)" becoming "-9" is not a step of its own
+            steps.append(step)
+    value = tree.solver_value
+    if len(steps) > MAX_SHOWN_STEPS:
+        steps = steps[:MAX_SHOWN_STEPS - 1] + ["= ...", steps[-1]]
+    return SOLUTION_TEMPLATE.format(intro=f"Evaluating {shown} step by step (powers and roots first, then × and /, "
+                                          f"then + and -, left to right):",
+                                    steps="\n".join(f"{i}. {step}" for i, step in enumerate(steps, start=1)),
+                                    answer=_answer(value, decimals))
+
+# --- Percentages ---
+
+def solve_percentage(expression: str) -> Optional[str]:
+    match = _PERCENT_OF.match(expression)
+    if match:
+        percent, whole = Fraction(match.group(1)), Fraction(match.group(2))
+        decimals = "." in expression
+        result = percent / 100 * whole
+        steps = [f"{format_number(percent, decimals)}% means {format_number(percent, decimals)}/100 = {format_number(percent / 100, True)}",
+                 f"{format_number(percent / 100, True)} × {format_number(whole, decimals)} = {format_number(result, True)}"]
+        return SOLUTION_TEMPLATE.format(intro=f"Finding {format_number(percent, decimals)}% of {format_number(whole, decimals)}:",
+                                        steps="\n".join(f"{i}. {step}" for i, step in enumerate(steps, start=1)),
+                                        answer=_answer(result, True))
+    match = _IS_WHAT_PERCENT_OF.match(expression) or _WHAT_PERCENT_OF_IS.match(expression)
+    if match:
+        if match.re is _IS_WHAT_PERCENT_OF:
+            part, whole = Fraction(match.group(1)), Fraction(match.group(2))
+        else:
+            whole, part = Fraction(match.group(1)), Fraction(match.group(2))
+        if whole == 0:
+            raise SolverDeclined("percentage of zero")
+        result = part / whole * 100
+        steps = [f"Divide the part by the whole: {format_number(part, True)} / {format_number(whole, True)} = {format_number(part / whole, True)}",
+                 f"Multiply by 100: {format_number(part / whole, True)} × 100 = {format_number(result, True)}"]
+        return SOLUTION_TEMPLATE.format(intro=f"Finding what percentage {format_number(part, True)} is of {format_number(whole, True)}:",
+                                        steps="\n".join(f"{i}. {step}" for i, step in enumerate(steps, start=1)),
+                                        answer=f"{_answer(result, True)}%")
+    return None
+
+# --- Linear and quadratic equations ---
+
+def _polynomial(node: ast.AST, variable: str, evaluator: _Evaluator) -> dict[int, Fraction]:
+    """Coefficients {degree: coefficient} of an expression in one unknown (degree at most 2, exact coefficients only)."""
+    if isinstance(node, ast.Name) and node.id == variable:
+        return {1: Fraction(1)}
+    children = evaluator.operands(node)
+    if not children or not any(isinstance(sub, ast.Name) and sub.id == variable for sub in ast.walk(node)):
+        value = evaluator.evaluate(node)
+        if not isinstance(value, Fraction):
+            raise SolverDeclined("irrational coefficient")
+        return {0: value}
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = _polynomial(node.operand, variable, evaluator)
+        return {degree: -c for degree, c in operand.items()} if isinstance(node.op, ast.USub) else operand
+    if isinstance(node, ast.BinOp):
+        left = _polynomial(node.left, variable, evaluator)
+        if isinstance(node.op, ast.Pow):
+            exponent = evaluator.evaluate(node.right)
+            if not isinstance(exponent, Fraction) or exponent.denominator != 1 or not 0 <= exponent <= 2:
+                raise SolverDeclined("unsupported power of the unknown")
+            result = {0: Fraction(1)}
+            for _ in range(int(exponent)):
+                result = _multiply(result, left)
+            return result
+        right = _polynomial(node.right, variable, evaluator)
+        if isinstance(node.op, (ast.Add, ast.Sub)):
+            sign = 1 if isinstance(node.op, ast.Add) else -1
+            result = dict(left)
+            for degree, c in right.items():
+                result[degree] = result.get(degree, 0) + sign * c
+            return result
+        if isinstance(node.op, ast.Mult):
+            return _multiply(left, right)
+        if isinstance(node.op, ast.Div):
+            if set(right) != {0} or right[0] == 0:
+                raise SolverDeclined("division by the unknown or by zero")
+            return {degree: c / right[0] for degree, c in left.items()}
+    raise SolverDeclined(f"unsupported operation {type(node).__name__}")
+
+def _multiply(left: dict, right: dict) -> dict:
+    result = {}
+    for d1, c1 in left.items():
+        for d2, c2 in right.items():
+            if c1 and c2:
+                if d1 + d2 > 2:
+                    raise SolverDeclined("degree above 2")
+                result[d1 + d2] = result.get(d1 + d2, 0) + c1 * c2
+    return result
+
+def _format_polynomial(coefficients: dict, variable: str) -> str:
+    terms = []
+    for degree in sorted(coefficients, reverse=True):
+        c = coefficients[degree]
+        if not c:
+            continue
+        magnitude = format_number(abs(c))
+        if degree and magnitude == "1":
+            magnitude = ""
+        elif degree and "/" in magnitude:
+            magnitude = f"({magnitude})"
+        power = {0: "", 1: variable, 2: f"{variable}^2"}[degree]
+        sign = "-" if c < 0 else "+"
+        terms.append((sign, f"{magnitude}{power}"))
+    if not terms:
+        return "0"
+    text = ("-" if terms[0][0] == "-" else "") + terms[0][1]
+    return text + "".join(f" {sign} {term}" for sign, term in terms[1:])
+
+def solve_equation(expression: str, variable: str, deadline: float) -> str:
+    left_text, right_text = expression.split("=")
+    evaluator = _Evaluator(deadline)
+    left = _polynomial(_parse(_to_python(left_text.strip(), variable)), variable, evaluator)
+    right = _polynomial(_parse(_to_python(right_text.strip(), variable)), variable, evaluator)
+    coefficients = dict(left)
+    for degree, c in right.items():
+        coefficients[degree] = coefficients.get(degree, 0) - c
+    coefficients = {degree: c for degree, c in coefficients.items() if c}
+    degree = max(coefficients, default=0)
+    if degree == 0:
+        raise SolverDeclined("no unknown left") # Identities and contradictions are left to the full pipeline
+    a = coefficients.get(degree)
+    b = coefficients.get(degree - 1, Fraction(0))
+    standard = f"{_format_polynomial(coefficients, variable)} = 0"
+    intro = f"Solving {expression.replace(' ', '').replace('=', ' = ')} for {variable}:"
+    steps = [f"Move every term to the left-hand side: {standard}"]
+
+    if degree == 1:
+        root = -b / a
+        steps.append(f"Isolate {variable}: {variable} = {_operand(-b)} / {_operand(a)} = {format_number(root)}")
+        answer = _root(variable, root)
+    else:
+        c = coefficients.get(0, Fraction(0))
+        discriminant = b * b - 4 * a * c
+        steps.append(f"Identify the coefficients: a = {format_number(a)}, b = {format_number(b)}, c = {format_number(c)}")
+        steps.append(f"Discriminant: D = b^2 - 4ac = {_operand(b)}^2 - 4 × {_operand(a)} × {_operand(c)} "
+                     f"= {format_number(discriminant)}")
+        root_d = _sqrt(abs(discriminant))
+        if discriminant == 0:
+            root = -b / (2 * a)
+            steps.append(f"D = 0, so there is one (double) root: {variable} = -b / (2a) = {format_number(root)}")
+            answer = _root(variable, root)
+        elif discriminant > 0:
+            roots = sorted(((-b - root_d) / (2 * a), (-b + root_d) / (2 * a)))
+            kind = "two rational roots" if isinstance(root_d, Fraction) else "two irrational roots"
+            steps.append(f"D > 0, so there are {kind}: {variable} = (-b ± √D) / (2a) = "
+                         f"({format_number(-b)} ± √{format_number(discriminant)}) / {format_number(2 * a)}")
+            answer = f"{_root(variable, roots[0])} or {_root(variable, roots[1])}"
+        else:
+            real, imaginary = -b / (2 * a), root_d / abs(2 * a)
+            steps.append(f"D < 0, so there are no real roots; the complex roots are {variable} = (-b ± i√(-D)) / (2a) = "
+                         f"({format_number(-b)} ± i√{format_number(-discriminant)}) / {format_number(2 * a)}")
+            answer = f"{variable} = {_complex_roots(real, imaginary)} (no real solution)"
+    return SOLUTION_TEMPLATE.format(intro=intro, steps="\n".join(f"{i}. {step}" for i, step in enumerate(steps, start=1)),
+                                    answer=answer)
+
+def _imaginary(value: Number) -> str:
+    """An imaginary part as it is written: i, 3i, i/2, 3i/2 or 1.732050808i."""
+    if isinstance(value, float):
+        return f"{value:.10g}i"
+    numerator = "i" if value.numerator == 1 else f"{value.numerator}i"
+    return numerator if value.denominator == 1 else f"{numerator}/{value.denominator}"
+
+def _complex_roots(real: Number, imaginary: Number) -> str:
+    """The conjugate pair real ± imaginary·i, without a zero real part: ±i, -1 ± 2i."""
+    if real == 0:
+        return f"±{_imaginary(imaginary)}"
+    return f"{format_number(real)} ± {_imaginary(imaginary)}"
+
+# --- Entry point ---
+
+def _classify(expression: str) -> tuple[str, Optional[str]]:
+    """("arithmetic" | "equation", unknown) for expressions the solver handles, else raises SolverDeclined."""
+    if not _ALLOWED_CHARACTERS.match(expression):
+        raise SolverDeclined("unsupported characters")
+    words = set(_WORD.findall(expression)) - FUNCTIONS
+    equals = expression.count("=")
+    if equals == 0:
+        if words - {"x"} or ("x" in words and not re.search(r"[\d)]\s*x\s*[\d(]", expression)):
+            raise SolverDeclined("unknown without an equation")
+        return "arithmetic", None
+    if equals == 1 and len(words) == 1 and len(next(iter(words))) == 1:
+        return "equation", next(iter(words))
+    raise SolverDeclined("not a single equation in one unknown")
+
+def solve_locally(query: str, time_limit_ms: float = LOCAL_SOLVER_TIME_LIMIT_MS) -> Optional[str]:
+    """
+    Answers pure arithmetic, percentages and linear/quadratic equations in one unknown with a templated
+    step-by-step solution, or returns None for anything else (the query then takes the normal pipeline).
+    Only numbers, + - * / ^, sqrt() and abs() are evaluated (exactly, over fractions); the evaluation is
+    bounded in size and stopped after `time_limit_ms`.
+    """
+    if len(query) > LOCAL_SOLVER_MAX_QUERY_CHARS or not re.search(r"\d", query):
+        return None
+    deadline = time.perf_counter() + time_limit_ms / 1000
+    expression = _normalize(query)
+    try:
+        answer = solve_percentage(expression)
+        if answer is None:
+            kind, variable = _classify(expression)
+            answer = solve_arithmetic(expression, deadline) if kind == "arithmetic" else solve_equation(expression, variable, deadline)
+    except SolverDeclined as e:
+        logger.debug(f"Local solver declined '{query}': {e}")
+        _count("declined")
+        return None
+    except (ArithmeticError, ValueError, TypeError, RecursionError) as e:
+        logger.debug(f"Local solver failed on '{query}': {e}")
+        _count("declined")
+        return None
+    _count("solved")
+    return answer
+
+if __name__ == "__main__":
+    import sys
+    for text in sys.argv[1:] or ["2+2", "What is 15% of 240?", "Solve 2x + 3 = 7", "x^2 - 5x + 6 = 0"]:
+        print(f">>> {text}\n{solve_locally(text)}\n")
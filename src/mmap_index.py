@@ -0,0 +1,132 @@
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from langchain.docstore.document import Document
+
+# Attempt absolute imports first (for when imported as a module)
+try:
+    from utils import get_logger
+# If run directly via python -m src.mmap_index, use relative imports
+except ModuleNotFoundError:
+    from .utils import get_logger
+
+logger = get_logger(__name__)
+
+META_FILENAME = "meta.json"
+VECTORS_FILENAME = "vectors.npy"
+NORMS_FILENAME = "norms.npy"
+DOCS_FILENAME = "docs.sqlite3"
+
+class MmapVectorStore:
+    """
+    Read-only, pickle-free knowledge base format for fast startup.
+    - vectors.npy / norms.npy: float32 arrays opened with mmap, so worker processes share pages via the OS page cache
+    - docs.sqlite3: documents keyed by row number, read lazily only for search hits
+    Search is exact squared L2 (same scores as the flat FAISS index), computed in row chunks to bound memory.
+    """
+
+    def __init__(self, path: str, embedding_function, chunk_rows: int = 65536):
+        self.path = path
+        self.embedding_function = embedding_function
+        self.chunk_rows = chunk_rows
+        with open(os.path.join(path, META_FILENAME)) as f:
+            self.meta = json.load(f)
+        self.vectors = np.load(os.path.join(path, VECTORS_FILENAME), mmap_mode="r")
+        self.norms = np.load(os.path.join(path, NORMS_FILENAME), mmap_mode="r")
+        self._docs_path = os.path.join(path, DOCS_FILENAME)
+        self._local = threading.local() # sqlite3 connections are per thread
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self._docs_path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def get_documents(self, rows: list[int]) -> dict[int, Document]:
+        """Reads documents by row number."""
+        if not rows:
+            return {}
+        placeholders = ",".join("?" * len(rows))
+        cursor = self._connect().execute(
+            f"SELECT row, page_content, metadata FROM docs WHERE row IN ({placeholders})", [int(r) for r in rows])
+        return {row: Document(page_content=content, metadata=json.loads(metadata)) for row, content, metadata in cursor}
+
+    def get_documents_by_doc_id(self, doc_ids: list[str]) -> dict[str, Document]:
+        """Reads documents by their original docstore id."""
+        if not doc_ids:
+            return {}
+        placeholders = ",".join("?" * len(doc_ids))
+        cursor = self._connect().execute(
+            f"SELECT doc_id, page_content, metadata FROM docs WHERE doc_id IN ({placeholders})", list(doc_ids))
+        return {doc_id: Document(page_content=content, metadata=json.loads(metadata)) for doc_id, content, metadata in cursor}
+
+    def search_vectors(self, query_vectors, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns (distances, rows), each shaped (n_queries, k), best first. Missing results have row -1."""
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        n_queries, total = queries.shape[0], len(self)
+        k = min(k, total)
+        if k == 0:
+            return np.empty((n_queries, 0), dtype=np.float32), np.empty((n_queries, 0), dtype=np.int64)
+        best_distances = np.full((n_queries, k), np.inf, dtype=np.float32)
+        best_rows = np.full((n_queries, k), -1, dtype=np.int64)
+        query_norms = np.sum(queries * queries, axis=1, keepdims=True)
+        for start in range(0, total, self.chunk_rows):
+            block = self.vectors[start:start + self.chunk_rows]
+            distances = self.norms[start:start + block.shape[0]][None, :] - 2.0 * queries @ block.T + query_norms
+            # Merge this chunk's candidates with the running top-k
+            all_distances = np.concatenate([best_distances, distances], axis=1)
+            all_rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + block.shape[0]), distances.shape)], axis=1)
+            top = np.argpartition(all_distances, k - 1, axis=1)[:, :k]
+            best_distances = np.take_along_axis(all_distances, top, axis=1)
+            best_rows = np.take_along_axis(all_rows, top, axis=1)
+        order = np.argsort(best_distances, axis=1)
+        return np.maximum(np.take_along_axis(best_distances, order, axis=1), 0.0), np.take_along_axis(best_rows, order, axis=1)
+
+    def batch_search_with_score(self, query_vectors, k: int = 4) -> list[list[tuple[Document, float]]]:
+        distances, rows = self.search_vectors(query_vectors, k)
+        documents = self.get_documents(sorted({int(r) for r in rows.ravel() if r >= 0}))
+        return [[(documents[int(r)], float(d)) for d, r in zip(row_distances, row_ids) if r >= 0 and int(r) in documents]
+                for row_distances, row_ids in zip(distances, rows)]
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, **kwargs) -> list[tuple[Document, float]]:
+        return self.batch_search_with_score([embedding], k)[0]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k)
+
+def convert_faiss_to_mmap(faiss_store, output_path: str, embedding_model: str = None):
+    """Writes a loaded LangChain FAISS store out in the mmap format (vectors in FAISS row order)."""
+    os.makedirs(output_path, exist_ok=True)
+    total = faiss_store.index.ntotal
+    vectors = faiss_store.index.reconstruct_n(0, total).astype(np.float32) if total else np.empty((0, faiss_store.index.d), dtype=np.float32)
+    np.save(os.path.join(output_path, VECTORS_FILENAME), vectors)
+    np.save(os.path.join(output_path, NORMS_FILENAME), np.sum(vectors * vectors, axis=1))
+
+    docs_path = os.path.join(output_path, DOCS_FILENAME)
+    if os.path.exists(docs_path):
+        os.remove(docs_path)
+    conn = sqlite3.connect(docs_path)
+    with conn:
+        conn.execute("CREATE TABLE docs (row INTEGER PRIMARY KEY, doc_id TEXT NOT NULL, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+        for row in range(total):
+            doc_id = faiss_store.index_to_docstore_id[row]
+            doc = faiss_store.docstore.search(doc_id)
+            conn.execute("INSERT INTO docs VALUES (?, ?, ?, ?)", (row, doc_id, doc.page_content, json.dumps(doc.metadata)))
+        conn.execute("CREATE INDEX docs_doc_id ON docs (doc_id)")
+    conn.close()
+
+    with open(os.path.join(output_path, META_FILENAME), "w") as f:
+        json.dump({"version": 1, "count": int(total), "dim": int(faiss_store.index.d), "metric": "l2",
+                   "embedding_model": embedding_model}, f)
+    logger.info(f"Converted FAISS index ({total} vectors) to mmap format at {output_path}")
@@ -0,0 +1,533 @@
+import asyncio
+import contextvars
+import inspect
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import count as attempts
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+try:
+    from config import (PROVIDER_MAX_RETRIES, PROVIDER_RETRY_BASE_DELAY_SECONDS, PROVIDER_RETRY_MAX_DELAY_SECONDS,
+                        PROVIDER_MAX_RATE_WAIT_SECONDS, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS,
+                        GEMINI_RATE_LIMIT_PER_SECOND, GEMINI_RATE_LIMIT_BURST, GEMINI_HEDGE_AFTER_SECONDS,
+                        EMBEDDING_RATE_LIMIT_PER_SECOND, EMBEDDING_RATE_LIMIT_BURST, EMBEDDING_HEDGE_AFTER_SECONDS,
+                        TAVILY_RATE_LIMIT_PER_SECOND, TAVILY_RATE_LIMIT_BURST, TAVILY_HEDGE_AFTER_SECONDS)
+    from tracing import count
+    from utils import get_logger
+except ModuleNotFoundError:
+    from .config import (PROVIDER_MAX_RETRIES, PROVIDER_RETRY_BASE_DELAY_SECONDS, PROVIDER_RETRY_MAX_DELAY_SECONDS,
+                         PROVIDER_MAX_RATE_WAIT_SECONDS, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS,
+                         GEMINI_RATE_LIMIT_PER_SECOND, GEMINI_RATE_LIMIT_BURST, GEMINI_HEDGE_AFTER_SECONDS,
+                         EMBEDDING_RATE_LIMIT_PER_SECOND, EMBEDDING_RATE_LIMIT_BURST, EMBEDDING_HEDGE_AFTER_SECONDS,
+                         TAVILY_RATE_LIMIT_PER_SECOND, TAVILY_RATE_LIMIT_BURST, TAVILY_HEDGE_AFTER_SECONDS)
+    from .tracing import count
+    from .utils import get_logger
+
+logger = get_logger(__name__)
+
+HEDGE_WORKERS = 32 # Threads per provider for hedged sync calls
+
+class ProviderUnavailableError(RuntimeError):
+    """Raised without calling the provider: its circuit is open or its rate limit would make the caller wait too long."""
+
+class SearchToolError(RuntimeError):
+    """A search tool reported a failure in its result instead of raising (TavilySearchResults returns repr(error))."""
+
+# --- Error classification ---
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# google.api_core, requests/httpx and builtin exception names for quota, overload, timeout and connection errors
+RETRYABLE_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                         "DeadlineExceeded", "GatewayTimeout", "BadGateway", "Timeout", "ConnectTimeout", "ReadTimeout",
+                         "ConnectionError", "TimeoutError", "RemoteProtocolError"}
+RETRYABLE_MESSAGE = re.compile(r"\b(?:408|429|50[0234])\b|quota|rate.?limit|resource.?exhausted|unavailable|overloaded"
+                               r"|timed? ?out|connection (?:reset|refused|aborted)", re.IGNORECASE)
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for value in (getattr(error, "code", None), getattr(error, "status_code", None),
+                  getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(value, int):
+            return value
+    return None
+
+# Rejections that say nothing about the provider's health: bad credentials or missing permission
+AUTH_STATUS_CODES = {401, 403, 407}
+
+def is_request_rejection(error: BaseException) -> bool:
+    """True if the provider answered and rejected the request itself (a 4xx other than auth errors), also when wrapped."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = _status_code(error)
+        if status is not None:
+            return 400 <= status < 500 and status not in RETRYABLE_STATUS_CODES and status not in AUTH_STATUS_CODES
+        error = error.__cause__ or error.__context__
+    return False
+
+def is_retryable(error: BaseException) -> bool:
+    """True for transient provider failures (quota, overload, timeouts, dropped connections), also when wrapped."""
+    if isinstance(error, ProviderUnavailableError):
+        return False
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = _status_code(error)
+        if status is not None:
+            return status in RETRYABLE_STATUS_CODES
+        if any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__):
+            return True
+        if RETRYABLE_MESSAGE.search(str(error)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+# --- Building blocks ---
+
+class TokenBucket:
+    """
+    Per-process rate limiter: `rate` calls per second on average, bursts of up to `burst`.
+    Callers reserve a token and sleep until it is due, so waiting callers are served in arrival order.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait: float) -> float:
+        """Takes a token and returns the seconds to wait before using it. Raises if that exceeds `max_wait`."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            wait_seconds = max(0.0, (1 - self.tokens) / self.rate)
+            if wait_seconds > max_wait:
+                raise ProviderUnavailableError(f"Rate limit: next slot in {wait_seconds:.1f}s")
+            self.tokens -= 1
+            return wait_seconds
+
+    def try_acquire(self) -> bool:
+        """Takes a token only if one is available right now."""
+        if not self.rate:
+            return True
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive transient failures; while open, calls fail fast.
+    After `reset_seconds` one probe call is let through (half-open): success closes the circuit, failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Gives the half-open probe slot back without a verdict (the probe never reached the provider)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Returns True if this failure opened the circuit."""
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+                self.opens += 1
+                return True
+            return False
+
+# --- Provider client ---
+
+class ProviderClient:
+    """
+    Shared gate for every call to one remote provider: token-bucket rate limiting, retries of transient failures
+    with full-jitter exponential backoff, an optional hedged duplicate request when the first one is slower than
+    `hedge_after_seconds`, and a circuit breaker that fails fast (ProviderUnavailableError) while the provider is
+    unhealthy, so callers go straight to their fallback path.
+    """
+
+    def __init__(self, name: str, rate_per_second: float = 0.0, burst: float = 1, max_retries: int = 0,
+                 retry_base_delay: float = 0.5, retry_max_delay: float = 8.0, max_rate_wait: float = 10.0,
+                 hedge_after_seconds: Optional[float] = None, failure_threshold: int = 0, reset_seconds: float = 30.0):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds) if failure_threshold else None
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.max_rate_wait = max_rate_wait
+        self.hedge_after_seconds = hedge_after_seconds
+        self._stats = {"calls": 0, "attempts": 0, "successes": 0, "failures": 0, "retries": 0, "hedges": 0,
+                       "hedge_wins": 0, "fail_fast": 0, "rate_limited_wait_s": 0.0}
+        self._stats_lock = threading.Lock()
+        self._hedge_executor = None
+
+    def _count(self, key: str, amount: float = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+        if key in ("retries", "fail_fast", "hedges", "failures"):
+            count("provider_events", provider=self.name, event=key)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["rate_limited_wait_s"] = round(stats["rate_limited_wait_s"], 3)
+        stats["circuit"] = self.breaker.state if self.breaker else "disabled"
+        stats["circuit_opens"] = self.breaker.opens if self.breaker else 0
+        return stats
+
+    def _admit(self) -> float:
+        """Checks the circuit and reserves a rate-limit token; returns the seconds to wait before calling."""
+        if self.breaker and not self.breaker.allow():
+            self._count("fail_fast")
+            raise ProviderUnavailableError(f"{self.name} circuit is open; failing fast")
+        try:
+            wait_seconds = self.bucket.reserve(self.max_rate_wait)
+        except ProviderUnavailableError:
+            self._release_probe() # The provider was not called; the circuit stays half-open
+            self._count("fail_fast")
+            raise
+        self._count("attempts")
+        if wait_seconds:
+            self._count("rate_limited_wait_s", wait_seconds)
+        return wait_seconds
+
+    def _release_probe(self):
+        """Frees the half-open probe slot of an attempt that ended without a verdict on the provider's health."""
+        if self.breaker and self.breaker.state == "half_open":
+            self.breaker.release_probe()
+
+    def _succeeded(self):
+        self._count("successes")
+        if self.breaker:
+            self.breaker.record_success()
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Records a failed attempt; returns the backoff before retrying, or None if the error should propagate."""
+        if not is_retryable(error):
+            if self.breaker:
+                if is_request_rejection(error):
+                    self.breaker.record_success() # The provider answered; the request itself was rejected
+                else:
+                    self._release_probe() # No verdict on the provider's health (e.g. bad credentials)
+            return None
+        self._count("failures")
+        if self.breaker and self.breaker.record_failure():
+            logger.warning(f"{self.name}: circuit opened after {self.breaker.failures} consecutive failures "
+                           f"(failing fast for {self.breaker.reset_seconds:.0f}s).")
+        if attempt >= self.max_retries or (self.breaker and self.breaker.state != "closed"):
+            return None
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+        retry_after = getattr(error, "retry_after", None)
+        if isinstance(retry_after, (int, float)):
+            delay = max(delay, min(float(retry_after), self.retry_max_delay))
+        self._count("retries")
+        logger.warning(f"{self.name} call failed ({error}). Retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries}).")
+        return delay
+
+    # Sync
+
+    def call(self, function, *args, hedge: bool = True, **kwargs):
+        """Calls `function(*args, **kwargs)` through the rate limiter, retries, hedging and circuit breaker."""
+        self._count("calls")
+        for attempt in attempts():
+            wait_seconds = self._admit()
+            try:
+                time.sleep(wait_seconds)
+                if hedge and self.hedge_after_seconds is not None:
+                    result = self._call_hedged(function, args, kwargs)
+                else:
+                    result = function(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self._release_probe() # Interrupted before a verdict
+                raise
+            self._succeeded()
+            return result
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._hedge_executor is None:
+            with self._stats_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix=f"{self.name}-hedge")
+        return self._hedge_executor
+
+    def _call_hedged(self, function, args, kwargs):
+        # Both requests run in the caller's context (tracing spans); the slower one is left to finish in the background
+        executor = self._executor()
+        first = executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+        done, _ = wait([first], timeout=self.hedge_after_seconds)
+        # A hedge needs a spare rate-limit token: duplicates must never push the provider over its quota
+        if done or not self.bucket.try_acquire():
+            return first.result()
+        self._count("hedges")
+        second = executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def stream(self, function, *args, **kwargs) -> Iterator:
+        """Iterates `function(*args, **kwargs)`; failures before the first item are retried, later ones propagate."""
+        self._count("calls")
+        for attempt in attempts():
+            wait_seconds = self._admit()
+            started = False
+            try:
+                time.sleep(wait_seconds)
+                for item in function(*args, **kwargs):
+                    started = True
+                    yield item
+            except Exception as e:
+                if started:
+                    if is_retryable(e):
+                        self._count("failures")
+                        if self.breaker:
+                            self.breaker.record_failure()
+                    else:
+                        self._release_probe()
+                    raise
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self._release_probe() # Cancelled, or closed early by the consumer (GeneratorExit), before a verdict
+                raise
+            self._succeeded()
+            return
+
+    # Async
+
+    async def acall(self, function, *args, hedge: bool = True, **kwargs):
+        """Async variant of call(); `function` returns an awaitable."""
+        self._count("calls")
+        for attempt in attempts():
+            wait_seconds = self._admit()
+            try:
+                await asyncio.sleep(wait_seconds)
+                if hedge and self.hedge_after_seconds is not None:
+                    result = await self._acall_hedged(function, args, kwargs)
+                else:
+                    result = await function(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self._release_probe() # Cancelled before a verdict
+                raise
+            self._succeeded()
+            return result
+
+    async def _acall_hedged(self, function, args, kwargs):
+        first = asyncio.ensure_future(function(*args, **kwargs))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after_seconds)
+        if done or not self.bucket.try_acquire():
+            return await first
+        self._count("hedges")
+        second = asyncio.ensure_future(function(*args, **kwargs))
+        pending, error = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def astream(self, function, *args, **kwargs) -> AsyncIterator:
+        """Async variant of stream(); `function` returns an async iterator."""
+        self._count("calls")
+        for attempt in attempts():
+            wait_seconds = self._admit()
+            started = False
+            try:
+                await asyncio.sleep(wait_seconds)
+                async for item in function(*args, **kwargs):
+                    started = True
+                    yield item
+            except Exception as e:
+                if started:
+                    if is_retryable(e):
+                        self._count("failures")
+                        if self.breaker:
+                            self.breaker.record_failure()
+                    else:
+                        self._release_probe()
+                    raise
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self._release_probe() # Cancelled, or closed early by the consumer (GeneratorExit), before a verdict
+                raise
+            self._succeeded()
+            return
+
+# --- Wrappers for the LangChain clients ---
+
+class ResilientChatModel(BaseChatModel):
+    """Chat model that sends every invoke/stream of `model` (ainvoke/astream too) through a ProviderClient."""
+    model: Any
+    client: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return f"resilient-{getattr(self.model, '_llm_type', type(self.model).__name__)}"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self.client.call(self.model.invoke, messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = await self.client.acall(self.model.ainvoke, messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        for message_chunk in self.client.stream(self.model.stream, messages, stop=stop, **kwargs):
+            chunk = ChatGenerationChunk(message=message_chunk)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        async for message_chunk in self.client.astream(self.model.astream, messages, stop=stop, **kwargs):
+            chunk = ChatGenerationChunk(message=message_chunk)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+class ResilientEmbeddings(Embeddings):
+    """Embeddings whose calls go through a ProviderClient. Document batches are never hedged (they are costly)."""
+
+    def __init__(self, base: Embeddings, client: ProviderClient):
+        self.base = base
+        self.client = client
+        self.accepts_task_type = "task_type" in inspect.signature(base.embed_documents).parameters
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.client.call(self.base.embed_query, text)
+
+    def embed_documents(self, texts: list[str], **kwargs) -> list[list[float]]:
+        return self.client.call(self.base.embed_documents, texts, hedge=False, **kwargs)
+
+class ResilientSearchTool:
+    """Search tool whose invoke() goes through a ProviderClient, turning error results into exceptions."""
+
+    def __init__(self, tool, client: ProviderClient):
+        self.tool = tool
+        self.client = client
+
+    def _search(self, query: str):
+        results = self.tool.invoke(query)
+        if isinstance(results, str):
+            raise SearchToolError(results)
+        return results
+
+    def invoke(self, query: str):
+        return self.client.call(self._search, query)
+
+# --- Process-wide clients, one per provider quota ---
+
+_PROVIDER_SETTINGS = {
+    "gemini": (GEMINI_RATE_LIMIT_PER_SECOND, GEMINI_RATE_LIMIT_BURST, GEMINI_HEDGE_AFTER_SECONDS),
+    "gemini_embedding": (EMBEDDING_RATE_LIMIT_PER_SECOND, EMBEDDING_RATE_LIMIT_BURST, EMBEDDING_HEDGE_AFTER_SECONDS),
+    "tavily": (TAVILY_RATE_LIMIT_PER_SECOND, TAVILY_RATE_LIMIT_BURST, TAVILY_HEDGE_AFTER_SECONDS),
+}
+_providers: dict[str, ProviderClient] = {}
+_providers_lock = threading.Lock()
+
+def get_provider(name: str) -> ProviderClient:
+    """Returns the shared client for a provider ("gemini", "gemini_embedding" or "tavily")."""
+    with _providers_lock:
+        if name not in _providers:
+            rate, burst, hedge_after = _PROVIDER_SETTINGS[name]
+            _providers[name] = ProviderClient(name, rate_per_second=rate, burst=burst, max_retries=PROVIDER_MAX_RETRIES,
+                                              retry_base_delay=PROVIDER_RETRY_BASE_DELAY_SECONDS,
+                                              retry_max_delay=PROVIDER_RETRY_MAX_DELAY_SECONDS,
+                                              max_rate_wait=PROVIDER_MAX_RATE_WAIT_SECONDS, hedge_after_seconds=hedge_after,
+                                              failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS)
+        return _providers[name]
+
+def get_provider_stats() -> dict:
+    """Per-provider call, retry, hedge and circuit breaker counters."""
+    with _providers_lock:
+        providers = dict(_providers)
+    return {name: provider.stats() for name, provider in providers.items()}
+
+def resilient_chat_model(model, callbacks: list = None) -> ResilientChatModel:
+    return ResilientChatModel(model=model, client=get_provider("gemini"), callbacks=callbacks)
+
+def resilient_embeddings(embeddings: Embeddings) -> ResilientEmbeddings:
+    return ResilientEmbeddings(embeddings, get_provider("gemini_embedding"))
+
+def resilient_search_tool(tool) -> ResilientSearchTool:
+    return ResilientSearchTool(tool, get_provider("tavily"))
@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+# Add src directory to Python path (so worker processes can import "server:create_app" in any launch mode)
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from config import (SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_MAX_CONCURRENCY, SERVER_MAX_QUEUE,
+                    SERVER_REQUEST_TIMEOUT_SECONDS, SERVER_MAX_BATCH_SIZE, SERVER_MAX_QUERY_CHARS,
+                    SERVER_SHUTDOWN_GRACE_SECONDS, VECTOR_STORE_FORMAT)
+from tracing import tracer
+from utils import get_logger
+
+logger = get_logger("server")
+
+DEADLINE_MESSAGE = "\n\n[The answer was cut off because the request deadline was reached.]"
+
+class RequestRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Bounded admission for one worker process: at most `max_concurrency` requests run at once and at most
+    `max_queue` more wait for a slot. Requests beyond that are rejected with 429 instead of piling up,
+    and a queued request whose deadline passes before it gets a slot fails with 504.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.draining = False
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def acquire(self, deadline: float):
+        """Waits for a processing slot until `deadline` (event loop time). Call release() when done."""
+        if self.draining:
+            raise RequestRejected(503, "Server is shutting down.")
+        if self.in_flight >= self.max_concurrency and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise RequestRejected(429, "Too many requests in flight, retry later.", retry_after=1)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=max(0.0, deadline - asyncio.get_running_loop().time()))
+        except asyncio.TimeoutError:
+            raise RequestRejected(504, "Deadline exceeded while waiting in the queue.")
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    async def drain(self, timeout: float):
+        """Stops admitting requests and waits (up to `timeout`) for queued and running ones to finish."""
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        give_up = loop.time() + timeout
+        while (self.in_flight or self.waiting) and loop.time() < give_up:
+            await asyncio.sleep(0.05)
+        return self.in_flight + self.waiting
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "waiting": self.waiting, "rejected": self.rejected,
+                "max_concurrency": self.max_concurrency, "max_queue": self.max_queue, "draining": self.draining}
+
+async def _read_json(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except (ValueError, UnicodeDecodeError):
+        raise RequestRejected(400, "Request body must be JSON.")
+    if not isinstance(body, dict):
+        raise RequestRejected(400, "Request body must be a JSON object.")
+    return body
+
+def _validate_query(query) -> str:
+    if not isinstance(query, str) or not query.strip():
+        raise RequestRejected(400, "'query' must be a non-empty string.")
+    if len(query) > SERVER_MAX_QUERY_CHARS:
+        raise RequestRejected(413, f"'query' is longer than {SERVER_MAX_QUERY_CHARS} characters.")
+    return query
+
+def _deadline(body: dict) -> float:
+    """Absolute event loop time by which the request must be answered. Clients may only shorten the default."""
+    timeout = body.get("timeout_s", SERVER_REQUEST_TIMEOUT_SECONDS)
+    if not isinstance(timeout, (int, float)) or timeout <= 0:
+        raise RequestRejected(400, "'timeout_s' must be a positive number.")
+    return asyncio.get_running_loop().time() + min(float(timeout), SERVER_REQUEST_TIMEOUT_SECONDS)
+
+def _remaining(deadline: float) -> float:
+    return max(0.0, deadline - asyncio.get_running_loop().time())
+
+def _release_when_done(admission: AdmissionController, work: asyncio.Future):
+    """Frees the admission slot only once `work` has really finished, not when the client stops waiting for it."""
+    def done(future: asyncio.Future):
+        if not future.cancelled():
+            future.exception() # Retrieved so an abandoned failure is not logged as "never retrieved"
+        admission.release()
+    work.add_done_callback(done)
+
+async def _await_work(work: asyncio.Future, deadline: float, cancel):
+    """Waits for `work` until `deadline`; on timeout (or if the request itself is cancelled) calls `cancel` so it stops early."""
+    try:
+        return await asyncio.wait_for(asyncio.shield(work), timeout=_remaining(deadline))
+    except asyncio.TimeoutError:
+        cancel()
+        raise RequestRejected(504, "Deadline exceeded.")
+    except asyncio.CancelledError:
+        cancel()
+        raise
+
+def _error_response(error: RequestRejected) -> JSONResponse:
+    headers = {"Retry-After": str(error.retry_after)} if error.retry_after else None
+    return JSONResponse({"error": error.detail}, status_code=error.status_code, headers=headers)
+
+def _agent(request: Request):
+    agent = request.app.state.agent
+    if agent is None:
+        raise RequestRejected(503, "Agent is still loading.", retry_after=5)
+    return agent
+
+async def query_endpoint(request: Request):
+    """POST {"query": str, "timeout_s": float?} -> {"answer": str, "elapsed_ms": float}"""
+    admission = request.app.state.admission
+    start = time.perf_counter()
+    try:
+        body = await _read_json(request)
+        query = _validate_query(body.get("query"))
+        deadline = _deadline(body)
+        agent = _agent(request)
+        await admission.acquire(deadline)
+        # The slot stays taken until the query (including stages running in worker threads) has stopped
+        work = asyncio.ensure_future(agent.aprocess_query(query))
+        _release_when_done(admission, work)
+        answer = await _await_work(work, deadline, work.cancel)
+    except RequestRejected as e:
+        return _error_response(e)
+    return JSONResponse({"answer": answer, "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)})
+
+async def stream_endpoint(request: Request):
+    """POST {"query": str, "timeout_s": float?} -> text/plain answer chunks as they are generated."""
+    admission = request.app.state.admission
+    try:
+        body = await _read_json(request)
+        query = _validate_query(body.get("query"))
+        deadline = _deadline(body)
+        agent = _agent(request)
+        await admission.acquire(deadline)
+    except RequestRejected as e:
+        return _error_response(e)
+
+    async def chunks():
+        # The slot is held until the stream ends (or the client disconnects), the chunk being generated when that
+        # happens has been returned by its worker thread, and the agent's generator has been closed
+        iterator = iter(agent.stream_query(query))
+        end = object()
+        next_chunk = None
+        try:
+            while True:
+                next_chunk = asyncio.ensure_future(asyncio.to_thread(next, iterator, end))
+                try:
+                    chunk = await _await_work(next_chunk, deadline, lambda: None)
+                except RequestRejected:
+                    yield DEADLINE_MESSAGE
+                    break
+                if chunk is end:
+                    break
+                yield chunk
+        finally:
+            async def close():
+                if next_chunk is not None and not next_chunk.done():
+                    await asyncio.wait([next_chunk])
+                if hasattr(iterator, "close"):
+                    await asyncio.to_thread(iterator.close)
+            _release_when_done(admission, asyncio.ensure_future(close()))
+
+    return StreamingResponse(chunks(), media_type="text/plain; charset=utf-8")
+
+async def batch_endpoint(request: Request):
+    """POST {"queries": [str, ...], "timeout_s": float?} -> {"answers": [str, ...], "stats": {...}}"""
+    admission = request.app.state.admission
+    start = time.perf_counter()
+    try:
+        body = await _read_json(request)
+        queries = body.get("queries")
+        if not isinstance(queries, list) or not queries:
+            raise RequestRejected(400, "'queries' must be a non-empty list of strings.")
+        if len(queries) > SERVER_MAX_BATCH_SIZE:
+            raise RequestRejected(413, f"At most {SERVER_MAX_BATCH_SIZE} queries per batch.")
+        queries = [_validate_query(query) for query in queries]
+        deadline = _deadline(body)
+        agent = _agent(request)
+        await admission.acquire(deadline)
+        stats = {}
+        # A timed-out batch stops at its next stage or generation; its slot is freed once the thread returns
+        cancel = threading.Event()
+        work = asyncio.ensure_future(asyncio.to_thread(agent.process_batch, queries, stats=stats, cancel=cancel))
+        _release_when_done(admission, work)
+        answers = await _await_work(work, deadline, cancel.set)
+    except RequestRejected as e:
+        return _error_response(e)
+    return JSONResponse({"answers": answers, "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+                         "stats": {key: round(value, 4) if isinstance(value, float) else value for key, value in stats.items()}})
+
+async def health_endpoint(request: Request):
+    return JSONResponse({"status": "ok", "pid": os.getpid()})
+
+async def ready_endpoint(request: Request):
+    admission = request.app.state.admission
+    ready = request.app.state.agent is not None and not admission.draining
+    return JSONResponse({"ready": ready, "pid": os.getpid(), **admission.stats()}, status_code=200 if ready else 503)
+
+async def metrics_endpoint(request: Request):
+    if not tracer.enabled:
+        return PlainTextResponse("Tracing is disabled (set MATH_AGENT_TRACING=1).\n", status_code=404)
+    return PlainTextResponse(tracer.metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+def create_app(agent=None, agent_factory=None) -> Starlette:
+    """
+    Builds the ASGI app. The agent is passed in, or created with `agent_factory` (default: MathAgent) during
+    startup; until it is loaded /readyz reports 503.
+    """
+
+    @asynccontextmanager
+    async def lifespan(app: Starlette):
+        loop = asyncio.get_running_loop()
+        # aprocess_query runs its blocking stages via asyncio.to_thread; size the pool for the admitted requests
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=SERVER_MAX_CONCURRENCY * 4, thread_name_prefix="agent"))
+        app.state.admission = AdmissionController(SERVER_MAX_CONCURRENCY, SERVER_MAX_QUEUE)
+        app.state.agent = agent
+        if app.state.agent is None:
+            factory = agent_factory
+            if factory is None:
+                from agent import MathAgent
+                factory = MathAgent
+            start = time.perf_counter()
+            app.state.agent = await asyncio.to_thread(factory)
+            # Report ready only once the lazily built clients, index and chains exist
+            await asyncio.to_thread(app.state.agent.warm_up, True)
+            logger.info(f"Worker {os.getpid()} loaded the agent in {time.perf_counter() - start:.2f}s.")
+        yield
+        # Uvicorn stops accepting connections first; requests still queued or running get the grace period
+        left = await app.state.admission.drain(SERVER_SHUTDOWN_GRACE_SECONDS)
+        if left:
+            logger.warning(f"Worker {os.getpid()} shut down with {left} requests unfinished.")
+        if getattr(app.state.agent, "answer_cache", None):
+            await asyncio.to_thread(app.state.agent.answer_cache.flush)
+        tracer.write_metrics()
+        logger.info(f"Worker {os.getpid()} stopped.")
+
+    app = Starlette(routes=[
+        Route("/v1/query", query_endpoint, methods=["POST"]),
+        Route("/v1/stream", stream_endpoint, methods=["POST"]),
+        Route("/v1/batch", batch_endpoint, methods=["POST"]),
+        Route("/healthz", health_endpoint, methods=["GET"]),
+        Route("/readyz", ready_endpoint, methods=["GET"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+    ], lifespan=lifespan)
+    app.state.agent = None
+    app.state.admission = AdmissionController(SERVER_MAX_CONCURRENCY, SERVER_MAX_QUEUE)
+    return app
+
+def run(host: str = SERVER_HOST, port: int = SERVER_PORT, workers: int = SERVER_WORKERS, app: str = "server:create_app"):
+    """
+    Serves `app` (an import string of an app factory) with `workers` processes. Each worker loads its own agent;
+    with VECTOR_STORE_FORMAT = "mmap" they share the index pages through the OS page cache.
+    """
+    if workers > 1 and VECTOR_STORE_FORMAT != "mmap":
+        logger.warning(f"Running {workers} workers with the '{VECTOR_STORE_FORMAT}' index format: every worker holds its "
+                       "own copy of the index. Convert it (python -m src.vector_store --convert-mmap) and set "
+                       "VECTOR_STORE_FORMAT = \"mmap\" to share it.")
+    uvicorn.run(app, factory=True, host=host, port=port, workers=workers,
+                timeout_graceful_shutdown=SERVER_SHUTDOWN_GRACE_SECONDS, log_level="info")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve MathAgent over HTTP (query, stream and batch endpoints).")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Worker processes")
+    args = parser.parse_args()
+    run(args.host, args.port, args.workers)
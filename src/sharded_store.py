@@ -0,0 +1,395 @@
+import argparse
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+# Attempt absolute imports first (for when imported as a module)
+try:
+    from config import (KB_SHARDS_PATH, KB_SHARD_TOPICS, KB_SHARD_MAX_ROUTED, KB_SHARD_SEARCH_WORKERS,
+                        KB_SHARD_RELOAD_CHECK_SECONDS, VECTOR_INDEX_TYPE)
+    from utils import get_logger
+    from tracing import current_span, count
+    from bm25_index import BM25Index, BM25_FILENAME, load_bm25_index
+    from vector_store import (batch_similarity_search_with_score, iter_csv_documents, read_manifest, is_index_stale,
+                              update_vector_store, build_ann_index, _create_embeddings, _project_paths, _content_hash,
+                              _write_manifest, _swap_into_place, _use_ann_index)
+# If run directly via python -m src.sharded_store, use relative imports
+except ModuleNotFoundError:
+    from .config import (KB_SHARDS_PATH, KB_SHARD_TOPICS, KB_SHARD_MAX_ROUTED, KB_SHARD_SEARCH_WORKERS,
+                         KB_SHARD_RELOAD_CHECK_SECONDS, VECTOR_INDEX_TYPE)
+    from .utils import get_logger
+    from .tracing import current_span, count
+    from .bm25_index import BM25Index, BM25_FILENAME, load_bm25_index
+    from .vector_store import (batch_similarity_search_with_score, iter_csv_documents, read_manifest, is_index_stale,
+                               update_vector_store, build_ann_index, _create_embeddings, _project_paths, _content_hash,
+                               _write_manifest, _swap_into_place, _use_ann_index)
+
+logger = get_logger(__name__)
+
+GENERAL_SHARD = "general" # Questions that name no topic (most arithmetic word problems)
+
+# Words that place a question in a topic ("*" matches any ending). Documents go to the topic with the most
+# matches; queries are routed to every topic they match.
+TOPIC_KEYWORDS = {
+    "algebra": ["algebra*", "equation*", "polynomial*", "quadratic*", "linear", "root*", "variable*", "expression*",
+                "inequalit*", "logarithm*", "log", "exponent*", "matri*", "determinant*", "progression*", "arithmetic series",
+                "geometric series", "binomial theorem", "complex number*", "factori*", "simplif*", "solve for"],
+    "geometry": ["geometr*", "triangle*", "circle*", "radius", "radii", "diameter*", "circumference*", "area*", "perimeter*",
+                 "angle*", "rectangl*", "square*", "rhomb*", "trapez*", "polygon*", "hexagon*", "volume*", "cube", "cubes",
+                 "cuboid*", "cylind*", "cone*", "sphere*", "hemispher*", "hypotenuse", "parallel*", "perpendicular*",
+                 "coordinate*", "chord*", "diagonal*", "trigonometr*", "sine", "cosine", "sin", "cos", "tan"],
+    "calculus": ["calculus", "derivative*", "differentia*", "integra*", "limit", "limits", "continuity", "maxima", "minima",
+                 "maximi*", "minimi*", "rate of change", "slope of the tangent", "d/dx", "dy/dx", "antiderivative*"],
+    "statistics": ["statistic*", "mean", "median*", "mode", "average*", "variance*", "standard deviation*", "data",
+                   "frequenc*", "percentile*", "quartile*", "correlation*", "regression*"],
+    "probability": ["probabilit*", "dice", "die", "coin*", "card*", "deck*", "random*", "chance*", "odds", "permutation*",
+                    "combination*", "arrange*", "arrangement*", "expected value*"],
+}
+_TOPIC_PATTERNS = {topic: re.compile(r"\b(?:" + "|".join(re.escape(word[:-1]) + r"\w*" if word.endswith("*")
+                                                         else re.escape(word) + r"(?!\w)" for word in words) + ")",
+                                     re.IGNORECASE)
+                   for topic, words in TOPIC_KEYWORDS.items()}
+
+def topic_matches(text: str, topics: list[str] = None) -> dict[str, int]:
+    """Keyword matches per topic (only topics with at least one match)."""
+    matches = {}
+    for topic in topics or KB_SHARD_TOPICS:
+        pattern = _TOPIC_PATTERNS.get(topic)
+        hits = len(pattern.findall(text)) if pattern else 0
+        if hits:
+            matches[topic] = hits
+    return matches
+
+def classify_question(question: str, topics: list[str] = None) -> str:
+    """The shard a KB question belongs to: the topic with the most keyword matches (ties go to the earlier topic)."""
+    matches = topic_matches(question, topics)
+    return max(matches, key=matches.get) if matches else GENERAL_SHARD
+
+def route_query(query: str, topics: list[str] = None, max_routed: int = KB_SHARD_MAX_ROUTED) -> Optional[list[str]]:
+    """
+    Shards to search for a query: its `max_routed` best matching topics plus the general shard,
+    or None (search every shard) if it names no topic.
+    """
+    matches = topic_matches(query, topics)
+    if not matches:
+        return None
+    return sorted(matches, key=matches.get, reverse=True)[:max_routed] + [GENERAL_SHARD]
+
+def _shards_path() -> str:
+    return os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')), KB_SHARDS_PATH)
+
+def _directory_version(path: str):
+    # A rebuilt shard (or the root BM25 file) is swapped in as a new directory (or file), so its inode (or mtime) changes
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns
+
+def load_shard(path: str, embeddings):
+    return _use_ann_index(FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True), path)
+
+class ShardedVectorStore:
+    """
+    Knowledge base split into one FAISS index per topic (`<root>/<topic>`), with the search interface the agent uses.
+    - Each query is routed to the shards of the topics it names (route_query); the shards are searched in parallel
+      and their top-k merged by L2 distance, which is comparable across shards (same embedding model).
+    - Shards are independent: any of them can be rebuilt on disk while agents are running. Every
+      `reload_check_seconds` a search checks the shard directories and reloads changed shards in the background,
+      swapping each one in atomically; searches keep using the previous copy until then.
+    - The BM25 index over every shard (`<root>/bm25.npz`, lexical search is not routed) is owned by the store
+      and reloaded in the same refresh, so lexical hits always come from the shards currently on disk.
+    """
+
+    def __init__(self, root: str, embedding_function, topics: list[str] = None, max_workers: int = KB_SHARD_SEARCH_WORKERS,
+                 reload_check_seconds: float = KB_SHARD_RELOAD_CHECK_SECONDS):
+        self.root = root
+        self.embedding_function = embedding_function
+        self.topics = list(topics or KB_SHARD_TOPICS) + [GENERAL_SHARD]
+        self.reload_check_seconds = reload_check_seconds
+        self._shards = {} # topic -> FAISS store; replaced (never mutated) on reload
+        self._versions = {} # topic (or BM25_FILENAME) -> version on disk when loaded
+        self.bm25_index = None
+        self._lock = threading.Lock()
+        self._reloading = False
+        self._next_check = time.monotonic() + reload_check_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="kb-shard")
+        for topic in self.topics:
+            self.reload_shard(topic)
+        self.reload_bm25()
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def __len__(self) -> int:
+        return sum(self.shard_sizes().values())
+
+    def shard_path(self, topic: str) -> str:
+        return os.path.join(self.root, topic)
+
+    def shard_sizes(self) -> dict[str, int]:
+        return {topic: store.index.ntotal for topic, store in self._shards.items()}
+
+    def reload_shard(self, topic: str) -> bool:
+        """Loads (or reloads) one shard from disk and swaps it in. Returns False if it is missing or unreadable."""
+        path = self.shard_path(topic)
+        if not os.path.isdir(path):
+            return False
+        try:
+            version = _directory_version(path)
+            store = load_shard(path, self.embedding_function)
+        except Exception as e:
+            logger.warning(f"Failed to load KB shard '{topic}' from {path}: {e}. Keeping the loaded copy, if any.")
+            return False
+        with self._lock:
+            self._shards[topic] = store
+            self._versions[topic] = version
+        logger.info(f"Loaded KB shard '{topic}' ({store.index.ntotal} documents) from {path}")
+        return True
+
+    def reload_bm25(self) -> bool:
+        """Loads (or reloads) the shards' BM25 index and swaps it in. Returns False if it is missing or unreadable."""
+        path = os.path.join(self.root, BM25_FILENAME)
+        try:
+            version = _directory_version(path)
+        except OSError:
+            version = None
+        index = load_bm25_index(self.root)
+        if index is None:
+            return False
+        with self._lock:
+            self.bm25_index = index
+            self._versions[BM25_FILENAME] = version
+        return True
+
+    def refresh(self) -> list[str]:
+        """
+        Reloads the shards whose directory changed since they were loaded, then the BM25 index if it changed
+        (it is rewritten after every shard rebuild). Returns the reloaded topics.
+        """
+        reloaded = []
+        for topic in self.topics:
+            path = self.shard_path(topic)
+            try:
+                version = _directory_version(path)
+            except OSError:
+                continue # Missing, or being swapped right now
+            if version != self._versions.get(topic) and self.reload_shard(topic):
+                reloaded.append(topic)
+        try:
+            bm25_version = _directory_version(os.path.join(self.root, BM25_FILENAME))
+        except OSError:
+            bm25_version = None
+        if bm25_version is not None and bm25_version != self._versions.get(BM25_FILENAME):
+            self.reload_bm25()
+        return reloaded
+
+    def _maybe_refresh(self):
+        if self.reload_check_seconds <= 0 or time.monotonic() < self._next_check:
+            return
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+            self._next_check = time.monotonic() + self.reload_check_seconds
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._reloading = False
+        threading.Thread(target=run, name="kb-shard-reload", daemon=True).start()
+
+    def route(self, query: Optional[str]) -> list[str]:
+        """Loaded shards to search for a query (all of them without a query or a topic match)."""
+        routed = route_query(query, self.topics) if query else None
+        loaded = [topic for topic in (routed or self.topics) if topic in self._shards]
+        return loaded or list(self._shards)
+
+    def batch_search_with_score(self, query_vectors, k: int = 4, queries: list[str] = None) -> list[list[tuple[Document, float]]]:
+        """One [(Document, L2 distance)] list per query, best first, over the shards each query is routed to."""
+        self._maybe_refresh()
+        vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        routes = [self.route(query) for query in queries] if queries else [self.route(None)] * len(vectors)
+        shards = dict(self._shards) # A consistent snapshot, even if a shard is swapped mid-search
+        rows_by_shard = {}
+        for row, topics in enumerate(routes):
+            for topic in topics:
+                rows_by_shard.setdefault(topic, []).append(row)
+        for topic in rows_by_shard:
+            count("kb_shard_searches", shard=topic)
+
+        def search(topic: str):
+            rows = rows_by_shard[topic]
+            return rows, batch_similarity_search_with_score(shards[topic], vectors[rows], k=k)
+
+        if len(rows_by_shard) == 1:
+            shard_results = [search(next(iter(rows_by_shard)))]
+        else:
+            shard_results = list(self._pool.map(search, rows_by_shard))
+        merged = [[] for _ in range(len(vectors))]
+        for rows, results in shard_results:
+            for row, docs_with_scores in zip(rows, results):
+                merged[row].extend(docs_with_scores)
+        if len(vectors) == 1:
+            current_span().set(shards=",".join(routes[0]))
+        return [sorted(docs_with_scores, key=lambda pair: pair[1])[:k] for docs_with_scores in merged]
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, query: str = None, **kwargs) -> list[tuple[Document, float]]:
+        return self.batch_search_with_score([embedding], k, queries=[query] if query else None)[0]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k, query=query)
+
+    def get_documents_by_doc_id(self, doc_ids: list[str]) -> dict[str, Document]:
+        """Looks documents up by docstore id in every shard (ids are unique across shards)."""
+        found = {}
+        for store in dict(self._shards).values():
+            for doc_id in doc_ids:
+                if doc_id not in found:
+                    doc = store.docstore.search(doc_id)
+                    if isinstance(doc, Document):
+                        found[doc_id] = doc
+        return found
+
+def load_sharded_vector_store(embeddings=None) -> Optional[ShardedVectorStore]:
+    """Opens the sharded knowledge base, or returns None if no shard has been built."""
+    root = _shards_path()
+    topics = list(KB_SHARD_TOPICS) + [GENERAL_SHARD]
+    if not any(os.path.isdir(os.path.join(root, topic)) for topic in topics):
+        logger.info(f"No knowledge base shards at {root}; using the single index "
+                    "(run `python -m src.sharded_store --split` to create them).")
+        return None
+    store = ShardedVectorStore(root, embeddings or _create_embeddings())
+    if not store.shard_sizes():
+        return None
+    logger.info(f"Opened sharded knowledge base: {store.shard_sizes()}")
+    return store
+
+# --- Building shards ---
+
+def _build_root_bm25(root: str, topics: list[str]):
+    """
+    BM25 index over the questions of every shard, at the shards root (lexical search is not routed).
+    Questions come from the CSV; docstore ids from the shard manifests (content hash -> id).
+    """
+    doc_ids = {}
+    for topic in topics:
+        manifest = read_manifest(os.path.join(root, topic)) if os.path.isdir(os.path.join(root, topic)) else None
+        if manifest:
+            doc_ids.update(manifest["rows"])
+    _, csv_path = _project_paths()
+    lexical_documents, seen = [], set()
+    for documents in iter_csv_documents(csv_path):
+        for doc in documents:
+            doc_id = doc_ids.get(_content_hash(doc.page_content))
+            if doc_id is not None and doc_id not in seen:
+                seen.add(doc_id)
+                lexical_documents.append((doc_id, doc.metadata["question"]))
+    # Written next to the target and renamed over it, so running stores never read a half-written index
+    partial_path = os.path.join(root, f"{BM25_FILENAME}.partial")
+    BM25Index.build(lexical_documents).save(partial_path)
+    os.replace(partial_path, os.path.join(root, BM25_FILENAME))
+    logger.info(f"Built the shards' BM25 index over {len(lexical_documents)} questions.")
+
+def split_vector_store(embeddings=None) -> dict[str, int]:
+    """
+    Splits the single FAISS index into topic shards, reusing its vectors (nothing is re-embedded).
+    Docstore ids are kept, and each shard gets the matching subset of the row manifest. Returns the shard sizes.
+    """
+    import faiss
+
+    index_path, _ = _project_paths()
+    source = FAISS.load_local(index_path, embeddings or _create_embeddings(), allow_dangerous_deserialization=True)
+    manifest = read_manifest(index_path) or {}
+    hash_by_id = {doc_id: content_hash for content_hash, doc_id in manifest.get("rows", {}).items()}
+    vectors = source.index.reconstruct_n(0, source.index.ntotal)
+    topics = list(KB_SHARD_TOPICS) + [GENERAL_SHARD]
+
+    groups = {topic: [] for topic in topics} # topic -> [(row, doc_id, doc)]
+    for row, doc_id in sorted(source.index_to_docstore_id.items()):
+        doc = source.docstore.search(doc_id)
+        if isinstance(doc, Document):
+            groups[classify_question(doc.metadata.get("question", doc.page_content))].append((row, doc_id, doc))
+
+    root = _shards_path()
+    os.makedirs(root, exist_ok=True)
+    sizes = {}
+    for topic, members in groups.items():
+        if not members:
+            logger.info(f"No documents for shard '{topic}'; not created.")
+            continue
+        shard = FAISS(source.embedding_function, faiss.IndexFlatL2(vectors.shape[1]),
+                      InMemoryDocstore({doc_id: doc for _, doc_id, doc in members}),
+                      {i: doc_id for i, (_, doc_id, _) in enumerate(members)},
+                      normalize_L2=getattr(source, "_normalize_L2", False), distance_strategy=source.distance_strategy)
+        shard.index.add(np.ascontiguousarray(vectors[[row for row, _, _ in members]]))
+        partial_path = f"{os.path.join(root, topic)}.partial"
+        if os.path.exists(partial_path):
+            shutil.rmtree(partial_path)
+        shard.save_local(partial_path)
+        rows = {hash_by_id.get(doc_id) or _content_hash(doc.page_content): doc_id for _, doc_id, doc in members}
+        _write_manifest(partial_path, rows, manifest.get("csv_fingerprint"), complete=manifest.get("complete", False), topic=topic)
+        BM25Index.build([(doc_id, doc.metadata.get("question", doc.page_content)) for _, doc_id, doc in members]).save(
+            os.path.join(partial_path, BM25_FILENAME))
+        if VECTOR_INDEX_TYPE != "flat":
+            build_ann_index(partial_path, shard)
+        _swap_into_place(partial_path, os.path.join(root, topic))
+        sizes[topic] = len(members)
+        logger.info(f"Wrote KB shard '{topic}' ({len(members)} documents).")
+    _build_root_bm25(root, topics)
+    return sizes
+
+def rebuild_shard(topic: str, fresh: bool = False, embeddings=None):
+    """
+    Brings one shard in line with the CSV rows classified into its topic: an incremental update (only new or
+    changed rows are embedded), or a full rebuild with `fresh`. Running agents pick the new shard up on their own.
+    """
+    topics = list(KB_SHARD_TOPICS) + [GENERAL_SHARD]
+    if topic not in topics:
+        raise ValueError(f"Unknown shard '{topic}'. Shards: {', '.join(topics)}")
+    root = _shards_path()
+    os.makedirs(root, exist_ok=True)
+    vector_store = update_vector_store(fresh=fresh, embeddings=embeddings, index_path=os.path.join(root, topic), topic=topic,
+                                       row_filter=lambda doc: classify_question(doc.metadata["question"]) == topic)
+    if vector_store is not None:
+        _build_root_bm25(root, topics)
+    return vector_store
+
+def shard_status() -> list[dict]:
+    """Per shard: documents, whether it is stale relative to the CSV, and when it was last built."""
+    root = _shards_path()
+    _, csv_path = _project_paths()
+    status = []
+    for topic in list(KB_SHARD_TOPICS) + [GENERAL_SHARD]:
+        path = os.path.join(root, topic)
+        manifest = read_manifest(path) if os.path.isdir(path) else None
+        if manifest is None:
+            status.append({"shard": topic, "built": False})
+            continue
+        status.append({"shard": topic, "built": True, "documents": len(manifest["rows"]),
+                       "stale": is_index_stale(path, csv_path) if os.path.exists(csv_path) else None,
+                       "modified": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(path)))})
+    return status
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and inspect the topic-sharded knowledge base.")
+    parser.add_argument("--split", action="store_true", help="Split the single FAISS index into topic shards (no re-embedding)")
+    parser.add_argument("--rebuild", metavar="TOPIC", help="Update one shard from the CSV ('all' for every shard)")
+    parser.add_argument("--fresh", action="store_true", help="With --rebuild: re-embed every row instead of updating")
+    args = parser.parse_args()
+    if args.split:
+        logger.info(f"Shard sizes: {split_vector_store()}")
+    elif args.rebuild:
+        for topic in (list(KB_SHARD_TOPICS) + [GENERAL_SHARD] if args.rebuild == "all" else [args.rebuild]):
+            rebuild_shard(topic, fresh=args.fresh)
+    for entry in shard_status():
+        logger.info(entry)
@@ -0,0 +1,144 @@
+import math
+import os
+import random
+import re
+import zlib
+
+import numpy as np
+
+# Attempt absolute imports first (for when imported as a module)
+try:
+    from config import CSV_PATH, TOPIC_CLASSIFIER_PATH, TOPIC_NEGATIVES_PATH, TOPIC_POSITIVES_PATH
+    from utils import get_logger
+# If run directly via python -m src.topic_classifier, use relative imports
+except ModuleNotFoundError:
+    from .config import CSV_PATH, TOPIC_CLASSIFIER_PATH, TOPIC_NEGATIVES_PATH, TOPIC_POSITIVES_PATH
+    from .utils import get_logger
+
+logger = get_logger(__name__)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+class TopicClassifier:
+    """
+    Local math/not-math classifier over hashed character n-grams (logistic regression).
+    Used by the input guardrail to decide confident cases without an LLM call.
+    """
+
+    def __init__(self, n_features: int = 2 ** 18, ngram_range: tuple[int, int] = (2, 4)):
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.weights = np.zeros(n_features, dtype=np.float32)
+        self.bias = 0.0
+
+    def _features(self, text: str) -> dict[int, float]:
+        """Maps text to {bucket: weight} using sublinear TF over word-bounded char n-grams, L2 normalized."""
+        text = " " + re.sub(r"\s+", " ", text.lower().strip()) + " "
+        # Collapse digit runs so "360" and "725" share features
+        text = re.sub(r"\d+", "0", text)
+        counts: dict[int, int] = {}
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                bucket = zlib.crc32(text[i:i + n].encode("utf-8")) % self.n_features
+                counts[bucket] = counts.get(bucket, 0) + 1
+        features = {bucket: 1.0 + math.log(count) for bucket, count in counts.items()}
+        norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+        return {bucket: v / norm for bucket, v in features.items()}
+
+    def predict_proba(self, text: str) -> float:
+        """Returns P(math) for the text."""
+        features = self._features(text)
+        score = self.bias + sum(float(self.weights[bucket]) * v for bucket, v in features.items())
+        return 1.0 / (1.0 + math.exp(-max(min(score, 30.0), -30.0)))
+
+    def train(self, texts: list[str], labels: list[int], epochs: int = 15, learning_rate: float = 0.5,
+              l2: float = 1e-5, seed: int = 0):
+        """Trains with class-balanced SGD on the logistic loss."""
+        featurized = [self._features(t) for t in texts]
+        positives = sum(labels)
+        negatives = len(labels) - positives
+        class_weight = {1: len(labels) / (2.0 * max(positives, 1)), 0: len(labels) / (2.0 * max(negatives, 1))}
+
+        order = list(range(len(texts)))
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            lr = learning_rate / (1.0 + epoch)
+            for i in order:
+                features, label = featurized[i], labels[i]
+                score = self.bias + sum(float(self.weights[b]) * v for b, v in features.items())
+                prediction = 1.0 / (1.0 + math.exp(-max(min(score, 30.0), -30.0)))
+                gradient = (prediction - label) * class_weight[label]
+                for bucket, v in features.items():
+                    self.weights[bucket] -= lr * (gradient * v + l2 * self.weights[bucket])
+                self.bias -= lr * gradient
+
+    def save(self, path: str):
+        """Saves the model as a compressed .npz (no pickle)."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, weights=self.weights, bias=np.float32(self.bias),
+                            n_features=np.int64(self.n_features), ngram_range=np.array(self.ngram_range))
+
+    @classmethod
+    def load(cls, path: str) -> "TopicClassifier":
+        with np.load(path, allow_pickle=False) as data:
+            model = cls(n_features=int(data["n_features"]), ngram_range=tuple(int(n) for n in data["ngram_range"]))
+            model.weights = data["weights"].astype(np.float32)
+            model.bias = float(data["bias"])
+        return model
+
+def load_topic_classifier(path: str = None):
+    """Loads the persisted classifier artifact, or returns None if it is missing or unreadable."""
+    path = path or os.path.join(PROJECT_ROOT, TOPIC_CLASSIFIER_PATH)
+    if not os.path.exists(path):
+        logger.warning(f"Topic classifier not found at {path}. All topic checks will use the LLM.")
+        return None
+    try:
+        model = TopicClassifier.load(path)
+        logger.info(f"Loaded topic classifier from {path}")
+        return model
+    except Exception as e:
+        logger.warning(f"Failed to load topic classifier from {path}: {e}. All topic checks will use the LLM.")
+        return None
+
+def _read_lines(path: str) -> list[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def build_training_set() -> tuple[list[str], list[int]]:
+    """Positives: KB questions plus extra math queries. Negatives: off-topic queries and greetings."""
+    import pandas as pd
+
+    # The first row is the 'question,solution' header
+    df = pd.read_csv(os.path.join(PROJECT_ROOT, CSV_PATH), on_bad_lines='skip', engine='python')
+    questions = df.iloc[:, 0].dropna().astype(str).tolist()
+    positives = questions + _read_lines(os.path.join(PROJECT_ROOT, TOPIC_POSITIVES_PATH))
+    negatives = _read_lines(os.path.join(PROJECT_ROOT, TOPIC_NEGATIVES_PATH))
+    return positives + negatives, [1] * len(positives) + [0] * len(negatives)
+
+def train_and_save(path: str = None, holdout: float = 0.2, seed: int = 0) -> TopicClassifier:
+    """Trains on a split, reports held-out accuracy, then retrains on everything and saves."""
+    texts, labels = build_training_set()
+    indices = list(range(len(texts)))
+    random.Random(seed).shuffle(indices)
+    cut = int(len(indices) * (1 - holdout))
+    train_idx, test_idx = indices[:cut], indices[cut:]
+
+    model = TopicClassifier()
+    model.train([texts[i] for i in train_idx], [labels[i] for i in train_idx], seed=seed)
+    correct = sum((model.predict_proba(texts[i]) >= 0.5) == bool(labels[i]) for i in test_idx)
+    logger.info(f"Held-out accuracy: {correct}/{len(test_idx)} ({correct / max(len(test_idx), 1):.1%})")
+
+    model = TopicClassifier()
+    model.train(texts, labels, seed=seed)
+    path = path or os.path.join(PROJECT_ROOT, TOPIC_CLASSIFIER_PATH)
+    model.save(path)
+    logger.info(f"Saved topic classifier trained on {len(texts)} examples to {path}")
+    return model
+
+if __name__ == "__main__":
+    # Run this script directly to (re)train the classifier artifact: python -m src.topic_classifier
+    logger.info("Training topic classifier...")
+    train_and_save()
+    logger.info("Finished training topic classifier.")
@@ -0,0 +1,365 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Attempt absolute imports first (for when imported as a module)
+try:
+    from config import (TRACING_ENABLED, TRACE_JSONL_PATH, METRICS_PROM_PATH, METRICS_FLUSH_INTERVAL_SECONDS,
+                        METRICS_HTTP_PORT)
+    from utils import get_logger
+# If run directly via python -m src.tracing, use relative imports
+except ModuleNotFoundError:
+    from .config import (TRACING_ENABLED, TRACE_JSONL_PATH, METRICS_PROM_PATH, METRICS_FLUSH_INTERVAL_SECONDS,
+                         METRICS_HTTP_PORT)
+    from .utils import get_logger
+
+logger = get_logger(__name__)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Stage latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_PREFIX = "math_agent"
+
+class _NoopSpan:
+    """Returned by span() while tracing is disabled: entering, annotating and leaving it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, key: str, amount: float):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class _Trace:
+    """Spans of one root operation (e.g. one query), written together when the root span ends."""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        self.finished = False
+        self.lock = threading.Lock()
+
+class Span:
+    """A timed stage. Attributes set on it (route, cache hits, scores, token counts...) are exported with it."""
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.trace = None
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start_time = 0.0
+        self.duration = 0.0
+        self._start = 0.0
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key: str, amount: float):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def __enter__(self) -> "Span":
+        self.parent = _current_span.get()
+        self.trace = self.parent.trace if self.parent is not None else _Trace()
+        self._token = _current_span.set(self)
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            _current_span.set(self.parent) # Exited in another context (e.g. a generator closed elsewhere)
+        self.tracer._finish(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {"trace_id": self.trace.trace_id, "span_id": self.span_id,
+                "parent_id": self.parent.span_id if self.parent is not None else None, "name": self.name,
+                "start": round(self.start_time, 6), "duration_ms": round(self.duration * 1000, 3), **self.attributes}
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+class Metrics:
+    """Prometheus-style stage latency histograms and labelled counters, rendered in the text exposition format."""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.histograms: dict[str, list] = {} # stage -> [bucket counts..., +Inf count, sum]
+        self.counters: dict[tuple, float] = {} # (name, sorted label items) -> value
+        self.lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[bisect_left(self.buckets, seconds)] += 1
+            histogram[-1] += seconds
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def stage_histograms(self) -> dict[str, dict]:
+        """Per stage: bucket upper bounds (seconds), per-bucket counts (not cumulative), count and sum."""
+        with self.lock:
+            return {stage: {"buckets": list(self.buckets) + [float("inf")], "counts": histogram[:-1],
+                            "count": sum(histogram[:-1]), "sum": histogram[-1]}
+                    for stage, histogram in sorted(self.histograms.items())}
+
+    def stage_summary(self) -> list[dict]:
+        """Per stage: count, mean and p50/p95 latency (ms), the percentiles taken as the containing bucket's upper bound."""
+        rows = []
+        for stage, histogram in self.stage_histograms().items():
+            row = {"stage": stage, "count": histogram["count"],
+                   "mean_ms": round(histogram["sum"] / histogram["count"] * 1000, 1) if histogram["count"] else None}
+            for name, quantile in (("p50_ms", 0.5), ("p95_ms", 0.95)):
+                cumulative, target = 0, quantile * histogram["count"]
+                for bound, bucket_count in zip(histogram["buckets"], histogram["counts"]):
+                    cumulative += bucket_count
+                    if cumulative >= target:
+                        row[name] = f"<= {bound * 1000:g}"
+                        break
+            rows.append(row)
+        return rows
+
+    def render_prometheus(self) -> str:
+        lines = [f"# HELP {METRIC_PREFIX}_stage_duration_seconds Duration of each agent pipeline stage.",
+                 f"# TYPE {METRIC_PREFIX}_stage_duration_seconds histogram"]
+        with self.lock:
+            histograms = {stage: list(histogram) for stage, histogram in sorted(self.histograms.items())}
+            counters = sorted(self.counters.items())
+        for stage, histogram in histograms.items():
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ["+Inf"], histogram[:-1]):
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{METRIC_PREFIX}_stage_duration_seconds_sum{{stage="{stage}"}} {histogram[-1]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_stage_duration_seconds_count{{stage="{stage}"}} {cumulative}')
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+                typed.add(name)
+            label_text = ",".join(f'{key}="{label_value}"' for key, label_value in labels)
+            lines.append(f"{METRIC_PREFIX}_{name}_total{{{label_text}}} {value:g}" if labels else f"{METRIC_PREFIX}_{name}_total {value:g}")
+        return "\n".join(lines) + "\n"
+
+class Tracer:
+    """
+    Records spans to a JSONL file (one line per span, written when the root span of the trace ends) and
+    aggregates their durations into Metrics, exported as a Prometheus text file and optionally over HTTP.
+    """
+
+    def __init__(self, enabled: bool, jsonl_path: Optional[str] = None, prom_path: Optional[str] = None,
+                 flush_interval_seconds: float = 10.0, http_port: Optional[int] = None):
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.flush_interval_seconds = flush_interval_seconds
+        self.http_port = http_port
+        self.metrics = Metrics()
+        self._write_lock = threading.Lock()
+        self._last_metrics_flush = 0.0
+        self._http_server = None
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def current(self):
+        """The innermost open span in this context (a no-op span if there is none or tracing is disabled)."""
+        return (_current_span.get() if self.enabled else None) or _NOOP_SPAN
+
+    def count(self, name: str, amount: float = 1, **labels):
+        if self.enabled:
+            self.metrics.increment(name, amount, **labels)
+
+    def _finish(self, span: Span):
+        self.metrics.observe(span.name, span.duration)
+        trace = span.trace
+        with trace.lock:
+            if trace.finished:
+                # A child that outlived its root (e.g. a cancelled speculative branch) is written on its own
+                lines = [span.to_dict()]
+            else:
+                trace.spans.append(span)
+                if span.parent is not None:
+                    return
+                trace.finished = True
+                lines = [s.to_dict() for s in trace.spans]
+        self._write_spans(lines)
+        self._maybe_flush_metrics()
+
+    def _write_spans(self, spans: list[dict]):
+        if not self.jsonl_path:
+            return
+        payload = "".join(json.dumps(s, default=str) + "\n" for s in spans)
+        try:
+            with self._write_lock, open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(payload)
+        except OSError as e:
+            logger.warning(f"Failed to write trace spans to {self.jsonl_path}: {e}")
+
+    def _maybe_flush_metrics(self, force: bool = False):
+        now = time.monotonic()
+        if not self.prom_path or (not force and now - self._last_metrics_flush < self.flush_interval_seconds):
+            return
+        self._last_metrics_flush = now
+        self.write_metrics()
+
+    def write_metrics(self):
+        """Writes the Prometheus text file atomically (e.g. for node_exporter's textfile collector)."""
+        if not self.prom_path:
+            return
+        temp_path = f"{self.prom_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(self.metrics.render_prometheus())
+            os.replace(temp_path, self.prom_path)
+        except OSError as e:
+            logger.warning(f"Failed to write metrics to {self.prom_path}: {e}")
+
+    def start_http_server(self):
+        """Serves GET /metrics in a background thread (once)."""
+        if self._http_server is not None or not self.http_port:
+            return
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self._http_server = ThreadingHTTPServer(("0.0.0.0", self.http_port), Handler)
+        except OSError as e:
+            logger.warning(f"Could not start metrics endpoint on port {self.http_port}: {e}")
+            return
+        self._http_server.daemon_threads = True
+        threading.Thread(target=self._http_server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"Serving Prometheus metrics on http://0.0.0.0:{self.http_port}/metrics")
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """
+    Adds LLM token counts to the current span and the token counters. Uses the usage metadata
+    reported by the model, or estimates ~4 characters per token when there is none.
+    """
+    run_inline = True # Keep callbacks in the caller's context so they see its current span
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._prompt_chars = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._prompt_chars[run_id] = sum(len(str(m.content)) for batch in messages for m in batch)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._prompt_chars[run_id] = sum(len(p) for p in prompts)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_chars = self._prompt_chars.pop(run_id, 0)
+        prompt_tokens = completion_tokens = 0
+        estimated = False
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+                else:
+                    completion_tokens += len(generation.text) // 4
+                    estimated = True
+        if estimated and not prompt_tokens:
+            prompt_tokens = prompt_chars // 4
+        span = self.tracer.current()
+        span.add("prompt_tokens", prompt_tokens)
+        span.add("completion_tokens", completion_tokens)
+        if estimated:
+            span.set(tokens_estimated=True)
+        self.tracer.count("llm_tokens", prompt_tokens, kind="prompt")
+        self.tracer.count("llm_tokens", completion_tokens, kind="completion")
+        self.tracer.count("llm_calls")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._prompt_chars.pop(run_id, None)
+        self.tracer.count("llm_errors")
+
+def _project_path(path: Optional[str]) -> Optional[str]:
+    return os.path.join(PROJECT_ROOT, path) if path and not os.path.isabs(path) else path
+
+tracer = Tracer(TRACING_ENABLED, jsonl_path=_project_path(TRACE_JSONL_PATH), prom_path=_project_path(METRICS_PROM_PATH),
+                flush_interval_seconds=METRICS_FLUSH_INTERVAL_SECONDS, http_port=METRICS_HTTP_PORT)
+if tracer.enabled:
+    tracer.start_http_server()
+
+def span(name: str, **attributes):
+    """Context manager timing one pipeline stage: `with span("kb_search") as s: ...; s.set(best_score=...)`."""
+    return tracer.span(name, **attributes)
+
+def traced(name: str, **attributes):
+    """Decorator running a function, coroutine function or generator function inside span(name)."""
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with tracer.span(name, **attributes):
+                    return await function(*args, **kwargs)
+        elif inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with tracer.span(name, **attributes):
+                    return (yield from function(*args, **kwargs))
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with tracer.span(name, **attributes):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def current_span():
+    return tracer.current()
+
+def count(name: str, amount: float = 1, **labels):
+    tracer.count(name, amount, **labels)
+
+def llm_callbacks() -> list:
+    """Callbacks to attach to LLM clients (none while tracing is disabled)."""
+    return [TokenUsageCallback(tracer)] if tracer.enabled else []
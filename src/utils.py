@@ -1,5 +1,6 @@
 import logging
 import sys
+import threading
 
 def get_logger(name: str, level=logging.INFO) -> logging.Logger:
     """Sets up and returns a logger."""
@@ -11,3 +12,29 @@ def get_logger(name: str, level=logging.INFO) -> logging.Logger:
         handler.setFormatter(formatter)
         logger.addHandler(handler)
     return logger
+
+class lazy_property:
+    """
+    Like functools.cached_property, but thread-safe: the value is computed on first access, by one thread only,
+    and stored on the instance (later reads are plain attribute lookups). Assigning the attribute overrides it.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+        self.lock = threading.RLock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with self.lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.func(instance)
+            return instance.__dict__[self.name]
+
+    def is_loaded(self, instance) -> bool:
+        return self.name in instance.__dict__
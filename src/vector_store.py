@@ -1,14 +1,31 @@
-import pandas as pd
+import numpy as np
 import os
 import sys # Import sys
+import argparse
+import hashlib
+import json
+import random
+import re
+import shutil
+import time
+import warnings
+from typing import Callable, Iterator
 from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain.docstore.document import Document
+from langchain_core.documents import Document
 
 # Attempt absolute imports first (for when imported as a module)
 try:
-    from config import GOOGLE_API_KEY, EMBEDDING_MODEL_NAME, CSV_PATH, VECTOR_STORE_PATH
+    from config import GOOGLE_API_KEY, EMBEDDING_MODEL_NAME, CSV_PATH, VECTOR_STORE_PATH, EMBEDDING_CACHE_MAX_ENTRIES
+    from config import EMBED_BATCH_SIZE, EMBED_MAX_RETRIES, EMBED_RETRY_BASE_DELAY_SECONDS, VECTOR_STORE_AUTO_UPDATE
+    from config import VECTOR_STORE_FORMAT, MMAP_INDEX_PATH, CSV_CHUNK_ROWS
+    from config import (VECTOR_INDEX_TYPE, ANN_TRAIN_SAMPLE_SIZE, IVF_NLIST, IVF_NPROBE, HNSW_M, HNSW_EF_CONSTRUCTION,
+                        HNSW_EF_SEARCH, PQ_M, PQ_NBITS, PQ_REFINE_K_FACTOR)
     from utils import get_logger
+    from embedding_cache import CachedEmbeddings
+    from providers import resilient_embeddings
+    from mmap_index import MmapVectorStore, convert_faiss_to_mmap
+    from ann_index import build_index, configure_search, index_memory_bytes
+    from bm25_index import BM25Index, BM25_FILENAME, load_bm25_index
 # If run directly via python -m src.vector_store, use relative imports
 except ModuleNotFoundError:
     # Ensure the parent directory (math_agent) is in the path for relative imports to work correctly
@@ -17,26 +34,75 @@ except ModuleNotFoundError:
     # parent_dir = os.path.abspath(os.path.join(script_dir, '..'))
     # if parent_dir not in sys.path:
     #     sys.path.insert(0, parent_dir)
-    from .config import GOOGLE_API_KEY, EMBEDDING_MODEL_NAME, CSV_PATH, VECTOR_STORE_PATH
+    from .config import GOOGLE_API_KEY, EMBEDDING_MODEL_NAME, CSV_PATH, VECTOR_STORE_PATH, EMBEDDING_CACHE_MAX_ENTRIES
+    from .config import EMBED_BATCH_SIZE, EMBED_MAX_RETRIES, EMBED_RETRY_BASE_DELAY_SECONDS, VECTOR_STORE_AUTO_UPDATE
+    from .config import VECTOR_STORE_FORMAT, MMAP_INDEX_PATH, CSV_CHUNK_ROWS
+    from .config import (VECTOR_INDEX_TYPE, ANN_TRAIN_SAMPLE_SIZE, IVF_NLIST, IVF_NPROBE, HNSW_M, HNSW_EF_CONSTRUCTION,
+                        HNSW_EF_SEARCH, PQ_M, PQ_NBITS, PQ_REFINE_K_FACTOR)
     from .utils import get_logger
+    from .embedding_cache import CachedEmbeddings
+    from .providers import resilient_embeddings
+    from .mmap_index import MmapVectorStore, convert_faiss_to_mmap
+    from .ann_index import build_index, configure_search, index_memory_bytes
+    from .bm25_index import BM25Index, BM25_FILENAME, load_bm25_index
 
 logger = get_logger(__name__)
 
+MANIFEST_FILENAME = "manifest.json"
+ANN_FILENAME = "index_{index_type}.faiss" # Derived search index; index.faiss stays flat as the source for updates
+
+def iter_csv_documents(file_path: str, chunk_rows: int = CSV_CHUNK_ROWS, report: dict = None) -> Iterator[list[Document]]:
+    """
+    Streams the CSV as lists of LangChain Documents, one list per chunk of `chunk_rows` rows,
+    so memory stays bounded by the chunk size rather than the corpus size.
+    Malformed rows are skipped (like on_bad_lines='skip') and counted in `report`, along with rows
+    missing a question or answer: {"rows", "documents", "malformed", "malformed_lines", "missing"}.
+    """
+    import pandas as pd # Only needed when (re)building the index
+
+    report = report if report is not None else {}
+    report.update({"rows": 0, "documents": 0, "malformed": 0, "malformed_lines": [], "missing": 0})
+    source = os.path.basename(file_path)
+    # Assuming the CSV has 'question' and 'answer' columns without a header row
+    with pd.read_csv(file_path, header=None, names=['question', 'answer'], dtype=str, on_bad_lines='warn',
+                     engine='c', quoting=1, chunksize=chunk_rows) as reader:
+        while True:
+            # The C parser reports skipped rows as ParserWarnings; collect them instead of printing them
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always", pd.errors.ParserWarning)
+                try:
+                    chunk = next(reader)
+                except StopIteration:
+                    break
+            for warning in caught:
+                if issubclass(warning.category, pd.errors.ParserWarning):
+                    lines = [int(n) for n in re.findall(r"Skipping line (\d+)", str(warning.message))]
+                    report["malformed"] += len(lines)
+                    report["malformed_lines"].extend(lines[:max(0, 20 - len(report["malformed_lines"]))])
+                else:
+                    warnings.warn_explicit(warning.message, warning.category, warning.filename, warning.lineno)
+
+            rows = len(chunk)
+            chunk = chunk.dropna(subset=['question', 'answer']) # Drop rows where question or answer is missing
+            report["rows"] += rows
+            report["missing"] += rows - len(chunk)
+            # Combine question and answer for better context during retrieval (built column-wise, not per row)
+            contents = ("Question: " + chunk['question'] + "\nAnswer: " + chunk['answer']).tolist()
+            # Use the question as metadata for potential future use
+            documents = [Document(page_content=content, metadata={"source": source, "question": question})
+                         for content, question in zip(contents, chunk['question'].tolist())]
+            report["documents"] += len(documents)
+            if documents:
+                yield documents
+
+    if report["malformed"] or report["missing"]:
+        logger.warning(f"Skipped {report['malformed']} malformed rows in {file_path} "
+                       f"(first lines: {report['malformed_lines']}) and {report['missing']} rows missing a question or answer.")
+
 def load_csv_data(file_path: str) -> list[Document]:
     """Loads data from CSV and converts it into LangChain Documents."""
     try:
-        # Assuming the CSV has 'question' and 'answer' columns (adjust if needed)
-        # The header might be missing, so use header=None and assign names
-        df = pd.read_csv(file_path, header=None, names=['question', 'answer'], on_bad_lines='skip', engine='python', quoting=1) # quoting=1 for QUOTE_MINIMAL
-        df.dropna(subset=['question', 'answer'], inplace=True) # Drop rows where question or answer is missing
-
-        documents = []
-        for _, row in df.iterrows():
-            # Combine question and answer for better context during retrieval
-            content = f"Question: {row['question']}\nAnswer: {row['answer']}"
-            # Use the question as metadata for potential future use
-            metadata = {"source": os.path.basename(file_path), "question": row['question']}
-            documents.append(Document(page_content=content, metadata=metadata))
+        documents = [doc for chunk in iter_csv_documents(file_path) for doc in chunk]
         logger.info(f"Loaded {len(documents)} documents from {file_path}")
         return documents
     except FileNotFoundError:
@@ -46,45 +112,395 @@ def load_csv_data(file_path: str) -> list[Document]:
         logger.error(f"Error loading or processing CSV {file_path}: {e}")
         return []
 
-def create_or_load_vector_store(force_recreate: bool = False):
-    """Creates a FAISS vector store from the CSV or loads an existing one."""
+def batch_similarity_search_with_score(vector_store, query_vectors: list[list[float]], k: int = 3,
+                                       queries: list[str] = None) -> list[list[tuple[Document, float]]]:
+    """
+    Searches many query vectors with a single FAISS index.search call.
+    Returns one [(Document, L2 distance)] list per query, like similarity_search_with_score_by_vector.
+    A sharded store routes each query by its text (`queries`, aligned with `query_vectors`) when given.
+    """
+    if isinstance(vector_store, MmapVectorStore):
+        return vector_store.batch_search_with_score(query_vectors, k)
+    if hasattr(vector_store, "route"): # ShardedVectorStore (sharded_store imports this module, not the other way round)
+        return vector_store.batch_search_with_score(query_vectors, k, queries=queries)
+
+    import faiss
+
+    vectors = np.asarray(query_vectors, dtype=np.float32)
+    if getattr(vector_store, "_normalize_L2", False):
+        faiss.normalize_L2(vectors)
+    scores, indices = vector_store.index.search(vectors, k)
+    results = []
+    for row_scores, row_indices in zip(scores, indices):
+        docs_with_scores = []
+        for score, i in zip(row_scores, row_indices):
+            if i == -1:
+                continue # Fewer than k vectors in the index
+            doc = vector_store.docstore.search(vector_store.index_to_docstore_id[i])
+            if isinstance(doc, Document):
+                docs_with_scores.append((doc, float(score)))
+        results.append(docs_with_scores)
+    return results
+
+def get_documents_by_ids(vector_store, doc_ids: list[str]) -> list[Document]:
+    """Looks up documents by docstore id (in the given order), skipping ids that are not in the store."""
+    if hasattr(vector_store, "get_documents_by_doc_id"): # MmapVectorStore and ShardedVectorStore
+        found = vector_store.get_documents_by_doc_id(doc_ids)
+        return [found[doc_id] for doc_id in doc_ids if doc_id in found]
+    documents = [vector_store.docstore.search(doc_id) for doc_id in doc_ids]
+    return [doc for doc in documents if isinstance(doc, Document)]
+
+def _create_embeddings():
     if not GOOGLE_API_KEY:
         raise ValueError("GOOGLE_API_KEY not found in environment variables.")
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
 
-    embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME, google_api_key=GOOGLE_API_KEY)
+    # Query embeddings are memoized process-wide so repeat queries never hit the embedding API twice
+    return CachedEmbeddings(resilient_embeddings(GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME, google_api_key=GOOGLE_API_KEY)),
+                            namespace=EMBEDDING_MODEL_NAME, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
 
+def _project_paths() -> tuple[str, str]:
     # Construct paths relative to the project root (math_agent directory)
     project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    vector_store_full_path = os.path.join(project_root, VECTOR_STORE_PATH)
-    csv_full_path = os.path.join(project_root, CSV_PATH)
+    return os.path.join(project_root, VECTOR_STORE_PATH), os.path.join(project_root, CSV_PATH)
+
+def _mmap_path() -> str:
+    return os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')), MMAP_INDEX_PATH)
+
+def convert_to_mmap(faiss_store=None, embeddings=None):
+    """Converts the FAISS index (index.faiss + pickled docstore) to the pickle-free mmap format."""
+    index_path, _ = _project_paths()
+    if faiss_store is None:
+        faiss_store = FAISS.load_local(index_path, embeddings or _create_embeddings(), allow_dangerous_deserialization=True)
+    output_path = _mmap_path()
+    convert_faiss_to_mmap(faiss_store, output_path, embedding_model=EMBEDDING_MODEL_NAME)
+    # Carry the row manifest (for staleness checks) and the BM25 index over to the mmap copy
+    for filename in (MANIFEST_FILENAME, BM25_FILENAME):
+        if os.path.exists(os.path.join(index_path, filename)):
+            shutil.copy(os.path.join(index_path, filename), os.path.join(output_path, filename))
+    return MmapVectorStore(output_path, faiss_store.embedding_function)
+
+# --- ANN search indexes ---
+
+def _ann_path(index_path: str) -> str:
+    return os.path.join(index_path, ANN_FILENAME.format(index_type=VECTOR_INDEX_TYPE))
+
+def build_ann_index(index_path: str, vector_store):
+    """Builds the configured ANN index from the flat index's vectors and writes it next to index.faiss."""
+    import faiss
+
+    if VECTOR_INDEX_TYPE == "flat":
+        logger.info("VECTOR_INDEX_TYPE is 'flat'; searches use index.faiss directly, nothing to build.")
+        return
+    flat_index = vector_store.index
+    vectors = flat_index.reconstruct_n(0, flat_index.ntotal)
+    start = time.perf_counter()
+    try:
+        ann_index = build_index(vectors, VECTOR_INDEX_TYPE, nlist=IVF_NLIST, train_sample_size=ANN_TRAIN_SAMPLE_SIZE,
+                                hnsw_m=HNSW_M, hnsw_ef_construction=HNSW_EF_CONSTRUCTION, pq_m=PQ_M, pq_nbits=PQ_NBITS,
+                                refine_k_factor=PQ_REFINE_K_FACTOR if VECTOR_INDEX_TYPE == "ivf_pq" else 0)
+    except ValueError as e:
+        logger.error(f"Could not build the {VECTOR_INDEX_TYPE} index: {e}. Searches will use the flat index.")
+        return
+    faiss.write_index(ann_index, _ann_path(index_path))
+    logger.info(f"Built {VECTOR_INDEX_TYPE} index over {flat_index.ntotal} vectors in {time.perf_counter() - start:.1f}s "
+                f"({index_memory_bytes(ann_index) / 1e6:.1f} MB) at {_ann_path(index_path)}")
+
+def _use_ann_index(vector_store, index_path: str):
+    """Swaps the loaded flat index for the configured ANN index (row ids line up, so the docstore mapping is shared)."""
+    if VECTOR_INDEX_TYPE == "flat":
+        return vector_store
+    import faiss
+
+    ann_path = _ann_path(index_path)
+    if not os.path.exists(ann_path):
+        logger.warning(f"No {VECTOR_INDEX_TYPE} index at {ann_path}; searching the flat index. "
+                       "Run `python -m src.vector_store --build-ann` to build it.")
+        return vector_store
+    ann_index = faiss.read_index(ann_path)
+    if ann_index.ntotal != vector_store.index.ntotal:
+        logger.warning(f"{ann_path} has {ann_index.ntotal} vectors but the flat index has {vector_store.index.ntotal}; "
+                       "searching the flat index. Run `python -m src.vector_store --build-ann` to rebuild it.")
+        return vector_store
+    vector_store.index = configure_search(ann_index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH,
+                                          refine_k_factor=PQ_REFINE_K_FACTOR)
+    logger.info(f"Searching with the {VECTOR_INDEX_TYPE} index ({ann_index.ntotal} vectors).")
+    return vector_store
+
+def load_kb_bm25_index():
+    """Loads the BM25 index that belongs to the configured vector store format."""
+    index_path, _ = _project_paths()
+    if VECTOR_STORE_FORMAT == "mmap" and os.path.exists(os.path.join(_mmap_path(), BM25_FILENAME)):
+        return load_bm25_index(_mmap_path())
+    return load_bm25_index(index_path)
+
+# --- Incremental builds ---
+# Each index directory carries a manifest mapping the content hash of every CSV row to its docstore id,
+# plus a fingerprint of the CSV it was built from (used to detect a stale index on load).
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _csv_fingerprint(csv_path: str) -> dict:
+    stat = os.stat(csv_path)
+    digest = hashlib.sha256()
+    with open(csv_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest.hexdigest()}
+
+def read_manifest(index_path: str):
+    manifest_path = os.path.join(index_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def _write_manifest(index_path: str, rows: dict, csv_fingerprint: dict = None, complete: bool = False, topic: str = None):
+    manifest = {"version": 1, "embedding_model": EMBEDDING_MODEL_NAME, "complete": complete,
+                "csv_fingerprint": csv_fingerprint, "rows": rows}
+    if topic is not None:
+        manifest["topic"] = topic # Knowledge base shard
+    manifest_path = os.path.join(index_path, MANIFEST_FILENAME)
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+def is_index_stale(index_path: str, csv_path: str) -> bool:
+    """Returns True if the index was not built from the current CSV (or has no manifest to tell)."""
+    manifest = read_manifest(index_path)
+    if not manifest or not manifest.get("complete") or not manifest.get("csv_fingerprint"):
+        return True
+    if manifest.get("embedding_model") != EMBEDDING_MODEL_NAME:
+        return True
+    built_from = manifest["csv_fingerprint"]
+    stat = os.stat(csv_path)
+    if stat.st_size == built_from["size"] and stat.st_mtime == built_from["mtime"]:
+        return False # Fast path: file untouched since the build
+    return _csv_fingerprint(csv_path)["sha256"] != built_from["sha256"]
+
+def _load_with_manifest(index_path: str, embeddings):
+    """
+    Loads an index and its row manifest. Indexes built before manifests existed are adopted by
+    hashing their stored documents; duplicate copies are returned as ids to delete.
+    """
+    vector_store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+    manifest = read_manifest(index_path)
+    if manifest and manifest.get("embedding_model") == EMBEDDING_MODEL_NAME:
+        return vector_store, dict(manifest["rows"]), []
+    rows, duplicate_ids = {}, []
+    for doc_id in vector_store.index_to_docstore_id.values():
+        doc = vector_store.docstore.search(doc_id)
+        if not isinstance(doc, Document):
+            continue
+        content_hash = _content_hash(doc.page_content)
+        if content_hash in rows:
+            duplicate_ids.append(doc_id)
+        else:
+            rows[content_hash] = doc_id
+    logger.info(f"Adopted index at {index_path} without a manifest ({len(rows)} rows, {len(duplicate_ids)} duplicates).")
+    return vector_store, rows, duplicate_ids
+
+def _embed_with_retry(embeddings, texts: list[str]) -> list[list[float]]:
+    """Embeds a batch of documents, retrying with jittered exponential backoff."""
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            delay = EMBED_RETRY_BASE_DELAY_SECONDS * (2 ** attempt) * (0.5 + random.random())
+            logger.warning(f"Embedding batch failed ({e}). Retrying in {delay:.1f}s (attempt {attempt + 1}/{EMBED_MAX_RETRIES}).")
+            time.sleep(delay)
+
+def _swap_into_place(partial_path: str, index_path: str):
+    old_path = f"{index_path}.old"
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.exists(index_path):
+        os.rename(index_path, old_path)
+    os.rename(partial_path, index_path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+
+def update_vector_store(fresh: bool = False, batch_size: int = EMBED_BATCH_SIZE, embeddings=None, index_path: str = None,
+                        row_filter: Callable[[Document], bool] = None, topic: str = None):
+    """
+    Brings the index in line with the CSV, embedding only new or changed rows.
+    - The CSV is streamed in chunks, so memory is bounded by the chunk and batch size (plus row hashes).
+    - Rows are identified by content hash; vectors for deleted or changed rows are removed.
+    - New rows are embedded in fixed-size batches with retry/backoff.
+    - Progress is checkpointed to `<index>.partial` after every batch; an interrupted build resumes from there.
+    - `fresh=True` ignores the current index and rebuilds everything (still batched and checkpointed).
+    - A knowledge base shard is built at `index_path` from the rows `row_filter` accepts, with `topic` in its manifest.
+    """
+    embeddings = embeddings or _create_embeddings()
+    default_path, csv_path = _project_paths()
+    index_path = index_path or default_path
+    partial_path = f"{index_path}.partial"
+
+    if not os.path.exists(csv_path):
+        logger.error(f"CSV file not found at {csv_path}")
+        return None
+    csv_fingerprint = _csv_fingerprint(csv_path)
+
+    # Resume an interrupted build if there is one, otherwise start from the live index (unless fresh)
+    vector_store, rows, ids_to_delete = None, {}, []
+    partial_manifest = read_manifest(partial_path) if os.path.exists(partial_path) else None
+    if partial_manifest and partial_manifest.get("embedding_model") == EMBEDDING_MODEL_NAME:
+        logger.info(f"Resuming interrupted build from {partial_path} ({len(partial_manifest['rows'])} rows done).")
+        vector_store, rows, ids_to_delete = _load_with_manifest(partial_path, embeddings)
+    else:
+        if os.path.exists(partial_path):
+            shutil.rmtree(partial_path)
+        if not fresh and os.path.exists(index_path):
+            try:
+                vector_store, rows, ids_to_delete = _load_with_manifest(index_path, embeddings)
+            except Exception as e:
+                logger.warning(f"Failed to load existing vector store for incremental update: {e}. Rebuilding...")
+
+    if vector_store is not None and ids_to_delete:
+        # Duplicates found while adopting a legacy index
+        vector_store.delete(ids_to_delete)
+        vector_store.save_local(partial_path)
+        _write_manifest(partial_path, rows, topic=topic)
+
+    def embed_batch(batch: list[tuple[str, Document]]):
+        nonlocal vector_store
+        hashes = [content_hash for content_hash, _ in batch]
+        texts = [doc.page_content for _, doc in batch]
+        text_embeddings = list(zip(texts, _embed_with_retry(embeddings, texts)))
+        metadatas = [doc.metadata for _, doc in batch]
+        # Content hashes double as docstore ids
+        if vector_store is None:
+            vector_store = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=hashes)
+        else:
+            vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=hashes)
+        rows.update({content_hash: content_hash for content_hash in hashes})
+        vector_store.save_local(partial_path)
+        _write_manifest(partial_path, rows, topic=topic)
+
+    # Stream the CSV: only the current chunk, the pending batch and the row hashes are held in memory
+    # (plus the questions for the BM25 index, which is rebuilt from every row on each pass)
+    seen, pending, embedded, report = set(), [], 0, {}
+    lexical_documents = []
+    try:
+        for documents in iter_csv_documents(csv_path, report=report):
+            for doc in documents:
+                if row_filter is not None and not row_filter(doc):
+                    continue
+                content_hash = _content_hash(doc.page_content)
+                if content_hash in seen:
+                    continue
+                seen.add(content_hash)
+                # New rows get their content hash as docstore id
+                lexical_documents.append((rows.get(content_hash, content_hash), doc.metadata["question"]))
+                if content_hash not in rows:
+                    pending.append((content_hash, doc))
+                if len(pending) >= batch_size:
+                    embed_batch(pending)
+                    embedded += len(pending)
+                    pending = []
+                    logger.info(f"Embedded {embedded} new rows so far ({report['rows']} CSV rows read, checkpointed).")
+        if pending:
+            embed_batch(pending)
+            embedded += len(pending)
+    except Exception as e:
+        logger.error(f"Failed to build vector store after {embedded} new rows: {e}. "
+                     f"Progress so far is checkpointed in {partial_path}.")
+        return None
+    if not seen:
+        logger.error("No documents loaded, cannot build vector store.")
+        return None
+
+    removed = [content_hash for content_hash in rows if content_hash not in seen]
+    logger.info(f"Incremental build: {len(seen)} rows in CSV, {len(seen) - embedded} unchanged, "
+                f"{embedded} embedded, {len(removed)} vectors to remove.")
+
+    if vector_store is not None and not embedded and not removed and not os.path.exists(partial_path):
+        # Nothing to re-embed; just record that the live index matches this CSV
+        _write_manifest(index_path, rows, csv_fingerprint, complete=True, topic=topic)
+        logger.info("Vector store is up to date.")
+        if not os.path.exists(os.path.join(index_path, BM25_FILENAME)):
+            BM25Index.build(lexical_documents).save(os.path.join(index_path, BM25_FILENAME))
+            logger.info(f"Built BM25 index over {len(lexical_documents)} questions.")
+        if VECTOR_INDEX_TYPE != "flat" and not os.path.exists(_ann_path(index_path)):
+            build_ann_index(index_path, vector_store)
+        return _use_ann_index(vector_store, index_path)
+
+    if vector_store is not None and removed:
+        vector_store.delete([rows.pop(content_hash) for content_hash in removed])
+
+    if vector_store is None:
+        logger.error("No vectors were built.")
+        return None
+    vector_store.save_local(partial_path)
+    _write_manifest(partial_path, rows, csv_fingerprint, complete=True, topic=topic)
+    BM25Index.build(lexical_documents).save(os.path.join(partial_path, BM25_FILENAME))
+    logger.info(f"Built BM25 index over {len(lexical_documents)} questions.")
+    if VECTOR_INDEX_TYPE != "flat":
+        build_ann_index(partial_path, vector_store)
+    _swap_into_place(partial_path, index_path)
+    logger.info(f"Successfully built and saved vector store to {index_path}")
+    if VECTOR_STORE_FORMAT == "mmap" and index_path == default_path: # Shards stay in the FAISS format
+        return convert_to_mmap(vector_store)
+    return _use_ann_index(vector_store, index_path)
+
+def create_or_load_vector_store(force_recreate: bool = False):
+    """Creates a FAISS vector store from the CSV or loads an existing one."""
+    embeddings = _create_embeddings()
+    vector_store_full_path, csv_full_path = _project_paths()
+
+    if VECTOR_STORE_FORMAT == "mmap" and not force_recreate:
+        mmap_path = _mmap_path()
+        if os.path.exists(os.path.join(mmap_path, "meta.json")):
+            logger.info(f"Opening mmap vector store at {mmap_path}")
+            vector_store = MmapVectorStore(mmap_path, embeddings)
+            if os.path.exists(csv_full_path) and is_index_stale(mmap_path, csv_full_path):
+                logger.warning("Vector store is stale relative to the CSV (or has no manifest). "
+                               "Run `python -m src.vector_store --incremental` to update it.")
+            return vector_store
+        logger.warning(f"No mmap vector store at {mmap_path}; loading the FAISS index instead. "
+                       "Run `python -m src.vector_store --convert-mmap` to create it.")
 
     if os.path.exists(vector_store_full_path) and not force_recreate:
         try:
             logger.info(f"Loading existing vector store from {vector_store_full_path}")
             vector_store = FAISS.load_local(vector_store_full_path, embeddings, allow_dangerous_deserialization=True)
             logger.info("Successfully loaded vector store.")
-            return vector_store
+            if os.path.exists(csv_full_path) and is_index_stale(vector_store_full_path, csv_full_path):
+                if VECTOR_STORE_AUTO_UPDATE:
+                    logger.info("Vector store is stale relative to the CSV. Updating incrementally...")
+                    return update_vector_store(embeddings=embeddings) or _use_ann_index(vector_store, vector_store_full_path)
+                logger.warning("Vector store is stale relative to the CSV (or has no manifest). "
+                               "Run `python -m src.vector_store --incremental` to update it.")
+            return _use_ann_index(vector_store, vector_store_full_path)
         except Exception as e:
             logger.warning(f"Failed to load existing vector store: {e}. Recreating...")
 
     logger.info(f"Creating new vector store from {csv_full_path}")
-    documents = load_csv_data(csv_full_path) # Use the constructed path
-    if not documents:
-        logger.error("No documents loaded, cannot create vector store.")
-        return None
-
-    try:
-        vector_store = FAISS.from_documents(documents, embeddings)
-        vector_store.save_local(vector_store_full_path) # Save using the constructed path
-        logger.info(f"Successfully created and saved vector store to {vector_store_full_path}")
-        return vector_store
-    except Exception as e:
-        logger.error(f"Failed to create vector store: {e}")
-        return None
+    return update_vector_store(fresh=True, embeddings=embeddings)
 
 if __name__ == "__main__":
     # Example usage: Run this script directly to create the index
     # No need for specific imports here anymore, as the top-level try/except handles it.
+    parser = argparse.ArgumentParser(description="Build the FAISS knowledge base from the CSV.")
+    parser.add_argument("--incremental", action="store_true", help="Only embed new/changed rows and drop deleted ones (resumes interrupted builds)")
+    parser.add_argument("--check", action="store_true", help="Only report whether the index is stale relative to the CSV")
+    parser.add_argument("--convert-mmap", action="store_true", help="Convert the FAISS index to the pickle-free mmap format")
+    parser.add_argument("--build-ann", action="store_true", help="(Re)build the VECTOR_INDEX_TYPE search index from the flat index")
+    args = parser.parse_args()
     logger.info("Running vector_store.py as main script...")
-    create_or_load_vector_store(force_recreate=True)
+    if args.check:
+        index_path, csv_path = _project_paths()
+        logger.info(f"Index is {'STALE' if is_index_stale(index_path, csv_path) else 'up to date'} relative to {csv_path}")
+    elif args.convert_mmap:
+        convert_to_mmap()
+    elif args.build_ann:
+        index_path, _ = _project_paths()
+        build_ann_index(index_path, FAISS.load_local(index_path, _create_embeddings(), allow_dangerous_deserialization=True))
+    elif args.incremental:
+        update_vector_store()
+    else:
+        create_or_load_vector_store(force_recreate=True)
     logger.info("Finished running vector_store.py.")
@@ -0,0 +1,136 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+class WebCache:
+    """
+    Disk-backed cache for the web fallback, stored in SQLite so several Streamlit sessions
+    or worker processes can share it safely (WAL mode, busy timeout).
+    - search: normalized search query -> Tavily result list
+    - pages: URL -> extracted text plus ETag/Last-Modified validators for conditional revalidation
+    Both tables expire entries by TTL and evict least recently used rows beyond `max_entries`.
+    """
+
+    def __init__(self, path: str, search_ttl_seconds: float = 86400, page_ttl_seconds: float = 7 * 86400,
+                 max_entries: int = 5000):
+        self.path = path
+        self.search_ttl_seconds = search_ttl_seconds
+        self.page_ttl_seconds = page_ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local() # sqlite3 connections are per thread
+        self._stats = {"search_hits": 0, "search_misses": 0, "page_hits": 0, "page_stale": 0, "page_revalidated": 0, "page_misses": 0}
+        self._stats_lock = threading.Lock()
+
+        conn = self._connect()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS search (query TEXT PRIMARY KEY, results TEXT NOT NULL, "
+                         "created REAL NOT NULL, last_access REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, text TEXT NOT NULL, etag TEXT, "
+                         "last_modified TEXT, fetched REAL NOT NULL, last_access REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS search_lru ON search (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_lru ON pages (last_access)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _evict(self, conn: sqlite3.Connection, table: str):
+        conn.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY last_access DESC "
+                     f"LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    @staticmethod
+    def _search_key(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def get_search(self, query: str) -> Optional[list]:
+        """Returns cached search results for the query if they have not expired."""
+        key = self._search_key(query)
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                row = conn.execute("SELECT results, created FROM search WHERE query = ?", (key,)).fetchone()
+                if row is None or now - row[1] > self.search_ttl_seconds:
+                    self._count("search_misses")
+                    return None
+                conn.execute("UPDATE search SET last_access = ? WHERE query = ?", (now, key))
+            self._count("search_hits")
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            logger.warning(f"Web cache search lookup failed: {e}")
+            return None
+
+    def put_search(self, query: str, results: list):
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO search (query, results, created, last_access) VALUES (?, ?, ?, ?)",
+                             (self._search_key(query), json.dumps(results), now, now))
+                self._evict(conn, "search")
+        except sqlite3.Error as e:
+            logger.warning(f"Web cache search store failed: {e}")
+
+    def get_page(self, url: str) -> Optional[dict]:
+        """
+        Returns {"text", "etag", "last_modified", "fresh"} for a cached page, or None.
+        Stale entries are still returned (fresh=False) so callers can revalidate with their validators.
+        """
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                row = conn.execute("SELECT text, etag, last_modified, fetched FROM pages WHERE url = ?", (url,)).fetchone()
+                if row is None:
+                    self._count("page_misses")
+                    return None
+                conn.execute("UPDATE pages SET last_access = ? WHERE url = ?", (now, url))
+            fresh = now - row[3] <= self.page_ttl_seconds
+            self._count("page_hits" if fresh else "page_stale")
+            return {"text": row[0], "etag": row[1], "last_modified": row[2], "fresh": fresh}
+        except sqlite3.Error as e:
+            logger.warning(f"Web cache page lookup failed: {e}")
+            return None
+
+    def put_page(self, url: str, text: str, etag: str = None, last_modified: str = None):
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO pages (url, text, etag, last_modified, fetched, last_access) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (url, text, etag, last_modified, now, now))
+                self._evict(conn, "pages")
+        except sqlite3.Error as e:
+            logger.warning(f"Web cache page store failed: {e}")
+
+    def mark_revalidated(self, url: str):
+        """Marks a stale page as fresh again after a 304 Not Modified response."""
+        now = time.time()
+        self._count("page_revalidated")
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("UPDATE pages SET fetched = ?, last_access = ? WHERE url = ?", (now, now, url))
+        except sqlite3.Error as e:
+            logger.warning(f"Web cache revalidation update failed: {e}")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self._stats)
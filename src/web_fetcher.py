@@ -0,0 +1,276 @@
+import codecs
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+READ_CHUNK_BYTES = 16 * 1024
+# Elements whose text is never page content
+SKIPPED_TAGS = {"head", "script", "style", "noscript", "template", "svg", "canvas", "iframe", "object",
+                "nav", "header", "footer", "aside", "form", "button", "select", "dialog"}
+# Elements skipped when their class/id names page chrome; all have a required end tag, so skipping ends reliably
+BOILERPLATE_CONTAINERS = {"div", "section", "ul", "ol", "table", "span"}
+# Elements without an end tag; they never open a skipped or main region
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+MAIN_TAGS = {"main", "article"}
+# A class or id token naming page chrome (e.g. "site-footer", "sidebar", "cookie-banner"); "has-sidebar" does not match
+BOILERPLATE_TOKEN = re.compile(r"(?:site-|page-|main-|global-)?(?:nav|navbar|navigation|menu|header|footer|sidebar|"
+                               r"breadcrumbs?|cookies?|cookie-\w+|banner|ads?|advert\w*|promo|share|sharing|social|"
+                               r"related(?:-\w+)?|comments?|subscribe|newsletter|popup|modal|toc)", re.IGNORECASE)
+# Digits, math symbols or math vocabulary: text that can help answer a math question
+MATH_SIGNAL = re.compile(r"\d|[=+^<>√∑∏∫π∞≤≥≠±×÷∂]|\b(?:equations?|formulae?|formulas|theorems?|proofs?|prove|solve|"
+                         r"solutions?|derivatives?|integra(?:l|ls|tion)|functions?|matri(?:x|ces)|vectors?|"
+                         r"probability|angles?|triangles?|circles?|area|volume|sum|product|limits?|series|primes?|"
+                         r"roots?|ratio|lemma|polynomials?|logarithms?|sine|cosine|tangent|parabola|ellipse)\b",
+                         re.IGNORECASE)
+MIN_RELEVANT_CHARS = 20 # Shorter text fragments (menu items, labels, inline symbols) never count as relevant
+CHARSET_HEADER = re.compile(r"charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+CHARSET_META = re.compile(rb"<meta[^>]+charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+
+class UnsupportedContentError(ValueError):
+    """The response is not an HTML (or other text) page; the caller falls back to the search snippet."""
+
+def create_http_session(pool_connections: int = 10, pool_maxsize: int = 4) -> requests.Session:
+    """
+    Creates a pooled, keep-alive HTTP session.
+    `pool_connections` is the number of per-host pools kept, `pool_maxsize` the connections per host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({'User-Agent': 'Mozilla/5.0'}) # Be polite
+    return session
+
+class TextExtractor(HTMLParser):
+    """
+    Incremental HTML-to-text extractor: feed() it the page as it arrives, then read text().
+    No document tree is built. Text inside boilerplate (scripts, styles, navigation, headers, footers, sidebars,
+    forms and elements whose class/id names them) is dropped, and text inside <main>/<article> is preferred
+    over the rest of the page when there is any. `done` turns True once `target_chars` of math-relevant text
+    have been collected, so the caller can stop reading the page.
+    """
+
+    def __init__(self, target_chars: int = None):
+        super().__init__(convert_charrefs=True)
+        self.target_chars = target_chars
+        self.main_parts, self.other_parts = [], []
+        self.main_relevant = self.other_relevant = 0
+        self.done = False
+        self._skip_tag = None # Tag of the boilerplate element being skipped and how deeply it is nested in itself
+        self._skip_depth = 0
+        self._main_depth = 0
+
+    @staticmethod
+    def _is_boilerplate(attrs: list) -> bool:
+        for name, value in attrs:
+            if name in ("class", "id", "role") and value:
+                if any(BOILERPLATE_TOKEN.fullmatch(token) for token in value.split()):
+                    return True
+        return False
+
+    def handle_starttag(self, tag: str, attrs: list):
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_depth += 1
+            return
+        if tag in VOID_TAGS:
+            return
+        if tag in MAIN_TAGS:
+            self._main_depth += 1
+        elif tag in SKIPPED_TAGS or (tag in BOILERPLATE_CONTAINERS and self._is_boilerplate(attrs)):
+            self._skip_tag, self._skip_depth = tag, 1
+
+    def handle_endtag(self, tag: str):
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if not self._skip_depth:
+                    self._skip_tag = None
+        elif tag in MAIN_TAGS and self._main_depth:
+            self._main_depth -= 1
+
+    def handle_data(self, data: str):
+        if self._skip_tag or self.done:
+            return
+        text = data.strip()
+        if not text:
+            return
+        relevant = len(text) if len(text) >= MIN_RELEVANT_CHARS and MATH_SIGNAL.search(text) else 0
+        if self._main_depth:
+            self.main_parts.append(text)
+            self.main_relevant += relevant
+        else:
+            self.other_parts.append(text)
+            self.other_relevant += relevant
+        if self.target_chars:
+            # Once a <main>/<article> has enough, stop; without one, keep a margin in case it comes later
+            self.done = (self.main_relevant >= self.target_chars
+                         or (not self.main_parts and self.other_relevant >= 2 * self.target_chars))
+
+    def text(self) -> str:
+        return "\n".join(self.main_parts or self.other_parts)
+
+def extract_text(html: str, target_chars: int = None) -> str:
+    """Extracts readable text from an HTML page, preferring <main>/<article> over the whole body."""
+    extractor = TextExtractor(target_chars)
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text()
+
+def _charset(content_type: str, head: bytes) -> str:
+    """Encoding from the Content-Type header, else from a <meta> tag in the first chunk, else UTF-8."""
+    match = CHARSET_HEADER.search(content_type)
+    candidates = [match.group(1)] if match else []
+    match = CHARSET_META.search(head[:4096])
+    if match:
+        candidates.append(match.group(1).decode("ascii", "ignore"))
+    for candidate in candidates:
+        try:
+            return codecs.lookup(candidate).name
+        except LookupError:
+            continue
+    return "utf-8"
+
+def read_page_text(response: requests.Response, target_chars: int = None, max_bytes: int = 512 * 1024) -> tuple[str, int]:
+    """
+    Streams a response (requested with stream=True) through TextExtractor. Non-HTML content types are rejected
+    before the body is read; reading stops after `max_bytes` or once the extractor has `target_chars` of
+    relevant text. Returns (text, bytes read).
+    """
+    content_type = response.headers.get("Content-Type", "")
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type and media_type not in HTML_CONTENT_TYPES and not media_type.startswith("text/"):
+        raise UnsupportedContentError(f"Not an HTML page ({media_type})")
+
+    extractor = TextExtractor(target_chars)
+    decoder = None
+    received = 0
+    for chunk in response.iter_content(chunk_size=READ_CHUNK_BYTES):
+        chunk = chunk[:max_bytes - received]
+        if decoder is None:
+            decoder = codecs.getincrementaldecoder(_charset(content_type, chunk))(errors="replace")
+        received += len(chunk)
+        extractor.feed(decoder.decode(chunk))
+        if extractor.done or received >= max_bytes:
+            break
+    if decoder is not None:
+        extractor.feed(decoder.decode(b"", final=True))
+    extractor.close()
+    return extractor.text(), received
+
+class WebFetcher:
+    """
+    Fetches and extracts search result pages concurrently over a shared pooled session.
+    Pages that are not ready by the stage deadline (or that fail, or are not HTML) fall back to the search snippet.
+    Page bodies are streamed: at most `max_bytes` are read, and less once enough relevant text was extracted.
+    With a `page_cache` (WebCache), fresh pages skip the network and stale ones are revalidated
+    with If-None-Match/If-Modified-Since.
+    """
+
+    def __init__(self, max_workers: int = 8, request_timeout: float = 5.0, max_chars: int = 1500,
+                 session: requests.Session = None, page_cache=None, max_bytes: int = 512 * 1024):
+        self.request_timeout = request_timeout
+        self.max_chars = max_chars
+        self.max_bytes = max_bytes
+        self.session = session or create_http_session()
+        self.page_cache = page_cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="web-fetch")
+
+    def _fetch_one(self, url: str, deadline: float) -> str:
+        # Never wait on a single page past the stage deadline
+        timeout = max(0.1, min(self.request_timeout, deadline - time.monotonic()))
+
+        cached = self.page_cache.get_page(url) if self.page_cache else None
+        if cached and cached["fresh"]:
+            return cached["text"]
+
+        headers = {}
+        if cached:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        with self.session.get(url, timeout=timeout, headers=headers, stream=True) as response:
+            if cached and response.status_code == 304:
+                self.page_cache.mark_revalidated(url)
+                return cached["text"]
+            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+            text, received = read_page_text(response, target_chars=self.max_chars, max_bytes=self.max_bytes)
+        logger.debug(f"Read {received} bytes of {url}")
+        if self.page_cache:
+            self.page_cache.put_page(url, text, etag=response.headers.get("ETag"),
+                                     last_modified=response.headers.get("Last-Modified"))
+        return text
+
+    def fetch_pages(self, search_results: list[dict], deadline: float) -> list[dict]:
+        """
+        Returns one {"source", "text", "is_snippet"} page per search result, in search order: the extracted text
+        (cut to `max_chars`), or the search snippet for pages that failed or were not ready.
+        `deadline` is an absolute time.monotonic() value for the whole fetch stage.
+        """
+        futures = {}
+        for i, result in enumerate(search_results):
+            if result.get("url"):
+                futures[i] = self.executor.submit(self._fetch_one, result["url"], deadline)
+
+        if futures:
+            done, not_done = wait(futures.values(), timeout=max(0.0, deadline - time.monotonic()))
+            for future in not_done:
+                future.cancel() # Only cancels fetches that have not started; running ones are bounded by their timeout
+            if not_done:
+                logger.warning(f"Web fetch deadline reached: {len(not_done)} of {len(futures)} pages not ready, using snippets.")
+
+        pages = []
+        for i, result in enumerate(search_results):
+            url = result.get("url")
+            content_snippet = result.get("content", "") # Use snippet provided by Tavily first
+            if url:
+                snippet_page = {"source": url, "text": content_snippet, "is_snippet": True}
+                future = futures[i]
+                if not future.done() or future.cancelled():
+                    pages.append(snippet_page)
+                    continue
+                try:
+                    text = future.result()
+                    if not text:
+                        # e.g. a page whose content sits behind more than max_bytes of inline scripts
+                        logger.info(f"No readable text in {url}. Using snippet.")
+                        pages.append(snippet_page)
+                        continue
+                    # Limit length per source
+                    pages.append({"source": url, "text": text[:self.max_chars], "is_snippet": False})
+                    logger.debug(f"Extracted content from {url}")
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f"Failed to fetch URL {url}: {e}. Using snippet: {content_snippet}")
+                    pages.append(snippet_page)
+                except UnsupportedContentError as e:
+                    logger.info(f"Skipping {url}: {e}. Using snippet.")
+                    pages.append(snippet_page)
+                except Exception as e:
+                    logger.warning(f"Failed to parse URL {url}: {e}. Using snippet: {content_snippet}")
+                    pages.append(snippet_page)
+            elif content_snippet:
+                pages.append({"source": "Search Result Snippet", "text": content_snippet, "is_snippet": False})
+        return pages
+
+    @staticmethod
+    def format_page(page: dict) -> str:
+        if page["is_snippet"]:
+            return f"Source: {page['source']}\nContent Snippet:\n{page['text']}"
+        if page["source"] == "Search Result Snippet":
+            return f"Source: {page['source']}\nContent:\n{page['text']}"
+        return f"Source: {page['source']}\nContent:\n{page['text']}..."
+
+    def fetch_all(self, search_results: list[dict], deadline: float) -> list[str]:
+        """Returns one formatted context entry per search result, in search order (see fetch_pages)."""
+        return [self.format_page(page) for page in self.fetch_pages(search_results, deadline)]